@@ -0,0 +1,342 @@
+"""
+Reproducible benchmark for the compression pipeline.
+
+Builds deterministic test clips with FFmpeg's lavfi sources, runs them through
+compress_video, new.py's process_videos and (optionally) a running API at
+several concurrency levels, and saves throughput, latency, memory, size and
+quality figures as JSON so runs can be compared over time.
+
+    python benchmarks/bench.py                      # default suite
+    python benchmarks/bench.py --quick              # one small clip, concurrency 1
+    python benchmarks/bench.py --api-url http://localhost:8000
+    python benchmarks/bench.py --compare results/a.json results/b.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.config import ENCODING_PROFILES, DEFAULT_PROFILE, get_ffmpeg_path
+from src.encoder_registry import get_capabilities
+from src.video_processor import compress_video
+import new
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIPS_DIR = os.path.join(BENCH_DIR, "clips")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+# name: (width, height, seconds, with audio)
+CLIPS = {
+    "360p_10s_audio": (640, 360, 10, True),
+    "720p_10s_audio": (1280, 720, 10, True),
+    "720p_10s_silent": (1280, 720, 10, False),
+    "1080p_20s_audio": (1920, 1080, 20, True),
+}
+QUICK_CLIPS = ["360p_10s_audio"]
+CONCURRENCY_LEVELS = [1, 2, 4]
+
+
+def make_clip(ffmpeg_path, name):
+    """Render a test clip once; identical arguments give identical files"""
+    width, height, seconds, audio = CLIPS[name]
+    path = os.path.join(CLIPS_DIR, f"{name}.mp4")
+    if os.path.exists(path):
+        return path
+    os.makedirs(CLIPS_DIR, exist_ok=True)
+    command = [
+        ffmpeg_path, "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate=30:duration={seconds}",
+    ]
+    if audio:
+        command += ["-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={seconds}"]
+    command += [
+        # High-bitrate, single-threaded source so the pipeline has real work to do
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "12", "-threads", "1",
+        "-pix_fmt", "yuv420p",
+        *(["-c:a", "aac", "-b:a", "192k"] if audio else []),
+        "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+        "-map_metadata", "-1",
+        path
+    ]
+    subprocess.run(command, check=True)
+    return path
+
+
+def measure_quality(ffmpeg_path, reference, distorted):
+    """SSIM and PSNR of distorted against reference (distorted is scaled back up first)"""
+    width, height = CLIPS[os.path.splitext(os.path.basename(reference))[0]][:2]
+    graph = (
+        f"[1:v]scale={width}:{height}:flags=bicubic,split[d1][d2];"
+        f"[0:v]split[r1][r2];[d1][r1]ssim;[d2][r2]psnr"
+    )
+    result = subprocess.run(
+        [ffmpeg_path, "-hide_banner", "-i", reference, "-i", distorted,
+         "-lavfi", graph, "-f", "null", "-"],
+        capture_output=True, text=True
+    )
+    ssim = re.search(r"SSIM .*All:([\d.]+)", result.stderr)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr)
+    return {
+        "ssim": float(ssim.group(1)) if ssim else None,
+        "psnr": float(psnr.group(1)) if psnr else None,
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """
+    Peak RSS of this process and of its largest child (FFmpeg), in MB.
+
+    getrusage only ever reports the maximum since the process started, so
+    every run is measured in a process of its own (see run_in_process).
+    """
+    scale = 1024 * 1024 if platform.system() == "Darwin" else 1024  # bytes vs KiB
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def summarize(target, concurrency, clips, latencies, wall, outputs, ffmpeg_path, quality=True, peak_rss=None):
+    """Figures of one run; throughput, realtime factor and size ratio count successful outputs only"""
+    succeeded = [name for name in clips if outputs.get(name) and os.path.exists(outputs[name])]
+    content_seconds = sum(CLIPS[name][2] for name in succeeded)
+    input_bytes = sum(os.path.getsize(make_clip(ffmpeg_path, name)) for name in succeeded)
+    output_bytes = sum(os.path.getsize(outputs[name]) for name in succeeded)
+    result = {
+        "target": target,
+        "concurrency": concurrency,
+        "videos": len(clips),
+        "failed": len(clips) - len(succeeded),
+        "wall_seconds": round(wall, 3),
+        "videos_per_minute": round(len(succeeded) * 60 / wall, 2) if wall else None,
+        "realtime_factor": round(content_seconds / wall, 2) if wall else None,
+        "latency_p50": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "latency_p95": round(percentile(latencies, 0.95), 3) if latencies else None,
+        "compression_ratio": round(output_bytes / input_bytes, 4) if input_bytes else None,
+        "peak_rss_mb": peak_rss,
+        "quality": {},
+    }
+    if quality:
+        for name, path in outputs.items():
+            if path and os.path.exists(path):
+                result["quality"][name] = measure_quality(ffmpeg_path, make_clip(ffmpeg_path, name), path)
+    return result
+
+
+def bench_compress_video(ffmpeg_path, clips, concurrency, work_dir, **options):
+    """Call compress_video directly, concurrency encodes at a time"""
+    outputs, latencies = {}, []
+
+    def run(name):
+        output_path = os.path.join(work_dir, f"compressed_{name}.mp4")
+        started = time.perf_counter()
+        success, result = compress_video((make_clip(ffmpeg_path, name), output_path, ffmpeg_path), **options)
+        latencies.append(time.perf_counter() - started)
+        outputs[name] = result if success else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, clips))
+    return latencies, time.perf_counter() - started, outputs
+
+
+def bench_process_videos(ffmpeg_path, clips, concurrency, work_dir, profile=None):
+    """Run new.py's batch entry point over a folder of clips (batch latency only)"""
+    input_dir = os.path.join(work_dir, "input")
+    os.makedirs(input_dir, exist_ok=True)
+    for name in clips:
+        shutil.copyfile(make_clip(ffmpeg_path, name), os.path.join(input_dir, f"{name}.mp4"))
+    started = time.perf_counter()
+    new.process_videos(input_dir, work_dir, ffmpeg_path, max_threads=concurrency, profile=profile)
+    wall = time.perf_counter() - started
+    outputs = {name: os.path.join(work_dir, f"compressed_{name}.mp4") for name in clips}
+    return [], wall, outputs
+
+
+def bench_api(api_url, ffmpeg_path, clips, concurrency, work_dir):
+    """Submit clips to a running server through POST /jobs and wait for the results"""
+    outputs, latencies = {}, []
+
+    def run(name):
+        path = make_clip(ffmpeg_path, name)
+        boundary = "benchmarkboundary"
+        with open(path, "rb") as f:
+            body = (
+                f"--{boundary}\r\nContent-Disposition: form-data; name=\"video\"; filename=\"{name}.mp4\"\r\n"
+                f"Content-Type: video/mp4\r\n\r\n"
+            ).encode() + f.read() + f"\r\n--{boundary}--\r\n".encode()
+        started = time.perf_counter()
+        request = urllib.request.Request(
+            f"{api_url}/jobs", data=body, method="POST",
+            headers={"Content-Type": f"multipart/form-data; boundary={boundary}"}
+        )
+        with urllib.request.urlopen(request) as response:
+            job_id = json.load(response)["job_id"]
+        while True:
+            with urllib.request.urlopen(f"{api_url}/jobs/{job_id}") as response:
+                status = json.load(response)["status"]
+            if status in ("done", "failed"):
+                break
+            time.sleep(0.2)
+        output_path = os.path.join(work_dir, f"compressed_{name}.mp4")
+        if status == "done":
+            with urllib.request.urlopen(f"{api_url}/jobs/{job_id}/result") as response, \
+                    open(output_path, "wb") as out:
+                shutil.copyfileobj(response, out)
+            outputs[name] = output_path
+        else:
+            outputs[name] = None
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run, clips))
+    return latencies, time.perf_counter() - started, outputs
+
+
+def run_target(target, ffmpeg_path, clips, concurrency, work_dir, profile=None, batch_profile=None,
+               api_url=None):
+    """One run of target; returns (latencies, wall, outputs, peak RSS of the run)"""
+    if target == "compress_video":
+        run = bench_compress_video(ffmpeg_path, clips, concurrency, work_dir, profile=profile)
+    elif target == "compress_video_segmented":
+        run = bench_compress_video(ffmpeg_path, clips, concurrency, work_dir, segmented=True, profile=profile)
+    elif target == "process_videos":
+        run = bench_process_videos(ffmpeg_path, clips, concurrency, work_dir, batch_profile)
+    else:
+        run = bench_api(api_url, ffmpeg_path, clips, concurrency, work_dir)
+    return (*run, peak_rss_mb())
+
+
+def run_in_process(*args, **kwargs):
+    """run_target in a fresh process, so its peak RSS is not an earlier run's"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(run_target, *args, **kwargs).result()
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def run_suite(args):
+    ffmpeg_path = args.ffmpeg or get_ffmpeg_path()
+    clips = QUICK_CLIPS if args.quick else list(CLIPS)
+    levels = [1] if args.quick else args.concurrency
+    for name in clips:
+        make_clip(ffmpeg_path, name)
+
+    # Without a profile new.py encodes with NVENC, which fails on every clip of a CPU-only host
+    batch_profile = args.profile
+    if batch_profile is None and "h264_nvenc" not in get_capabilities(ffmpeg_path)["encoders"]:
+        batch_profile = DEFAULT_PROFILE
+        print(f"h264_nvenc is not available; process_videos uses the {batch_profile} profile")
+
+    targets = ["compress_video", "compress_video_segmented", "process_videos"]
+    if args.api_url:
+        targets.append("api")
+    selected = args.targets or targets
+
+    results = []
+    for target in selected:
+        for concurrency in levels:
+            work_dir = tempfile.mkdtemp(prefix=f"bench_{target}_")
+            try:
+                print(f"{target} @ concurrency {concurrency} ...", flush=True)
+                latencies, wall, outputs, peak_rss = run_in_process(
+                    target, ffmpeg_path, clips, concurrency, work_dir, profile=args.profile,
+                    batch_profile=batch_profile, api_url=args.api_url and args.api_url.rstrip("/")
+                )
+                result = summarize(target, concurrency, clips, latencies, wall, outputs,
+                                   ffmpeg_path, quality=not args.no_quality, peak_rss=peak_rss)
+                results.append(result)
+                print(f"  {result['videos_per_minute']} videos/min, {result['realtime_factor']}x realtime, "
+                      f"p50 {result['latency_p50']}s, p95 {result['latency_p95']}s, "
+                      f"ratio {result['compression_ratio']}, {result['failed']} failed", flush=True)
+            finally:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    capabilities = get_capabilities(ffmpeg_path)
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "ffmpeg_version": capabilities["version"],
+        "gpu": capabilities["has_gpu"],
+        "profile": args.profile,
+        "process_videos_profile": batch_profile,
+        "cpu_count": os.cpu_count(),
+        "platform": platform.platform(),
+        "clips": {name: CLIPS[name] for name in clips},
+        "results": results,
+    }
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = args.output or os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved to {path}")
+
+
+def compare(baseline_path, candidate_path):
+    """Print the change in throughput, latency and size between two result files"""
+    with open(baseline_path) as f:
+        baseline = {(r["target"], r["concurrency"]): r for r in json.load(f)["results"]}
+    with open(candidate_path) as f:
+        candidate = {(r["target"], r["concurrency"]): r for r in json.load(f)["results"]}
+    metrics = ["videos_per_minute", "realtime_factor", "latency_p50", "latency_p95", "compression_ratio"]
+    for key in sorted(baseline.keys() & candidate.keys()):
+        print(f"{key[0]} @ concurrency {key[1]}")
+        for metric in metrics:
+            old, new_value = baseline[key][metric], candidate[key][metric]
+            if old is None or new_value is None:
+                continue
+            change = (new_value - old) * 100 / old if old else 0.0
+            print(f"  {metric:18} {old:>10} -> {new_value:>10} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--ffmpeg", help="FFmpeg binary (default: config.get_ffmpeg_path())")
+    parser.add_argument("--targets", nargs="+",
+                        choices=["compress_video", "compress_video_segmented", "process_videos", "api"])
+    parser.add_argument("--concurrency", nargs="+", type=int, default=CONCURRENCY_LEVELS)
+    parser.add_argument("--profile", choices=sorted(ENCODING_PROFILES),
+                        help="Encoding profile for compress_video and process_videos (default: DEFAULT_PROFILE)")
+    parser.add_argument("--api-url", help="Base URL of a running server to include the API in the run")
+    parser.add_argument("--quick", action="store_true", help="Smallest clip at concurrency 1")
+    parser.add_argument("--no-quality", action="store_true", help="Skip SSIM/PSNR measurement")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+    else:
+        run_suite(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,28 @@
 import os
+import sys
+import json
+import time
+import hashlib
+import argparse
 import subprocess
-from multiprocessing import Pool
+import threading
+from concurrent.futures import as_completed
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
+from src.config import ENCODE_MEMORY_PER_JOB, ENCODING_PROFILES, get_ffmpeg_path
+from src.scheduler import EncodeScheduler
+from src.ffmpeg_runner import run_ffmpeg
+from src.probe import probe_input
+from src.profiles import default_profile_stats
 
-def compress_video(args):
-    """
-    Compresses a video to Facebook-like specifications using FFmpeg.
-    
-    :param args: Tuple containing (input_path, output_path, ffmpeg_path, max_threads)
-    """
-    input_path, output_path, ffmpeg_path = args
-    
-    # Check if input file exists
-    if not os.path.isfile(input_path):
-        print(f"The input file {input_path} does not exist!")
-        return
-        
-    # Create output directory if it doesn't exist
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.wmv')
+MANIFEST_NAME = ".batch_manifest.json"
+SUMMARY_NAME = "batch_summary.json"
 
-    # FFmpeg command
-    ffmpeg_command = [
+def build_command(input_path, output_path, ffmpeg_path, threads=None, profile=None):
+    """FFmpeg command for one video; profile swaps the NVENC settings for one of ENCODING_PROFILES"""
+    if profile is not None:
+        return build_profile_command(input_path, output_path, ffmpeg_path, ENCODING_PROFILES[profile], threads)
+    return [
         ffmpeg_path,
         "-y",
         "-i", input_path,
@@ -38,55 +39,288 @@ def compress_video(args):
         "-tune", "hq",         # Added tune parameter for higher quality
         "-c:a", "aac",
         "-q:a", "2",
+        *(["-threads", str(threads)] if threads else []),
+        output_path
+    ]
+
+def build_profile_command(input_path, output_path, ffmpeg_path, profile, threads=None):
+    """The same output format as build_command, encoded on the CPU with an encoding profile"""
+    return [
+        ffmpeg_path,
+        "-y",
+        "-i", input_path,
+        "-vf", "scale=1280:720",
+        "-r", "25",
+        "-c:v", profile['codec'],
+        "-preset", profile['preset'],
+        "-crf", str(profile['crf']),
+        *profile.get('extra_params', []),
+        "-c:a", "aac",
+        "-b:a", "48023",
+        *(["-threads", str(threads)] if threads else []),
         output_path
     ]
 
+def settings_hash(ffmpeg_path, profile=None):
+    """Hash of the encode settings; a change re-encodes everything on the next run"""
+    command = build_command("<input>", "<output>", os.path.basename(ffmpeg_path), profile=profile)
+    return hashlib.sha256(json.dumps(command).encode()).hexdigest()[:16]
+
+def compress_video(args, threads=None, profile=None, report=None):
+    """
+    Compresses a video to Facebook-like specifications using FFmpeg.
+
+    :param args: Tuple containing (input_path, output_path, ffmpeg_path)
+    :param threads: FFmpeg thread budget given by the scheduler
+    :param profile: One of ENCODING_PROFILES instead of the NVENC settings
+    :param report: Optional dict filled with the profile, sizes and encode seconds
+    :return: (success, output path or error message)
+    """
+    input_path, output_path, ffmpeg_path = args
+    report = {} if report is None else report
+    report['profile'] = profile
+    report['path'] = 'encode'
+
+    # Check if input file exists
+    if not os.path.isfile(input_path):
+        print(f"The input file {input_path} does not exist!")
+        return False, "Input file does not exist"
+
+    # Create output directory if it doesn't exist
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+    # Encode to a partial file so an interrupted run never leaves a truncated output behind
+    root, extension = os.path.splitext(output_path)
+    partial_path = f"{root}.partial{extension}"
     try:
-        subprocess.run(ffmpeg_command, check=True)
+        started = time.time()
+        run_ffmpeg(build_command(input_path, partial_path, ffmpeg_path, threads, profile))
+        report['encode_seconds'] = round(time.time() - started, 3)
+        report['input_size'] = os.path.getsize(input_path)
+        report['output_size'] = os.path.getsize(partial_path)
+        os.replace(partial_path, output_path)
         print(f"Compression successful! Compressed video saved at {output_path}")
+        return True, output_path
     except subprocess.CalledProcessError as e:
         print(f"Error during compression of {input_path}: {e}")
+        return False, f"FFmpeg exited with {e.returncode}: {e.stderr[-2000:]}"
     except Exception as e:
         print(f"An unexpected error occurred with {input_path}: {e}")
+        return False, str(e)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+class Manifest:
+    """
+    Record of finished files keyed by relative path, with the size, mtime and
+    settings hash they were encoded with. Saved after every file so an
+    interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+    def is_current(self, key, stat, settings, statuses=('done',)):
+        """Whether key was already handled with this size, mtime and settings"""
+        entry = self.entries.get(key)
+        return (
+            entry is not None
+            and entry['status'] in statuses
+            and entry['size'] == stat.st_size
+            and entry['mtime'] == stat.st_mtime
+            and entry['settings'] == settings
+        )
+
+    def record(self, key, stat, settings, status, **details):
+        with self._lock:
+            self.entries[key] = {
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'settings': settings,
+                'status': status,
+                'finished_at': time.time(),
+                **details
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(self.entries, f, indent=1)
+            os.replace(tmp_path, self.path)
+
+def find_videos(input_folder):
+    """All videos below input_folder, recursively, in a stable order"""
+    return sorted(
+        f for f in Path(input_folder).rglob('*')
+        if f.is_file() and f.suffix.lower() in VIDEO_EXTENSIONS
+    )
+
+def process_videos(input_folder, output_folder, ffmpeg_path, max_threads = 0, force = False,
+                   summary_path = None, scheduler = None, manifest = None, files = None, profile = None):
+    """
+    Compress every video below input_folder using the same scheduler as the web app.
+
+    Files already encoded with the current settings and unchanged since (same
+    size and mtime in the manifest) are skipped. Outputs mirror the input
+    folder structure. Returns a summary dict, also written as JSON.
+
+    :param max_threads: Number of concurrent encodes (0 = size from the CPU quota and memory limit)
+    :param force: Re-encode files even if the manifest says they are current
+    :param files: Only consider these files (default: everything below input_folder)
+    :param profile: Encode with one of ENCODING_PROFILES instead of the NVENC settings; the summary
+        records its speed (seconds of video per second of encoding) next to the size ratio
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    settings = settings_hash(ffmpeg_path, profile)
+    if manifest is None:
+        manifest = Manifest(os.path.join(output_folder, MANIFEST_NAME))
+
+    # Prepare arguments for each video that still needs work
+    jobs = []
+    skipped = 0
+    for input_file in (files if files is not None else find_videos(input_folder)):
+        relative = input_file.relative_to(input_folder)
+        stat = input_file.stat()
+        if not force and manifest.is_current(str(relative), stat, settings):
+            skipped += 1
+            continue
+        output_file = Path(output_folder) / relative.parent / f"compressed_{input_file.name}"
+        jobs.append((str(relative), stat, (str(input_file), str(output_file), ffmpeg_path)))
 
-def process_videos(input_folder, output_folder, ffmpeg_path, max_threads = 10):
-    # Create list of video files to process
-    video_extensions = ('.mp4', '.avi', '.mov', '.mkv', '.wmv')
-    input_files = [f for f in Path(input_folder).glob('*') if f.suffix.lower() in video_extensions]
-    
-    # Prepare arguments for each video
-    args_list = []
-    for input_file in input_files:
-        output_file = Path(output_folder) / f"compressed_{input_file.name}"
-        args_list.append((str(input_file), str(output_file), ffmpeg_path))
-    
-    # Process videos in parallel using all available CPU cores
-    # with Pool() as pool:
-    #     pool.map(compress_video, args_list)
-
-    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+    owns_scheduler = scheduler is None
+    if owns_scheduler:
+        scheduler = EncodeScheduler.from_environment(ENCODE_MEMORY_PER_JOB, slots=max_threads)
+    started = time.time()
+    failures = []
+    bytes_in = bytes_out = 0
+    media_seconds = encode_seconds = 0.0
+    try:
         # Submit all tasks and get futures
-        futures = [executor.submit(compress_video, args) for args in args_list]
-        
+        futures = {}
+        for key, stat, args in jobs:
+            report = {}
+            futures[scheduler.submit(input_folder, compress_video, args, profile=profile, report=report)] = (
+                key, stat, report
+            )
+
         # Print total number of videos to process
         total_videos = len(futures)
-        print(f"Processing {total_videos} videos...")
-        
-        # Wait for all tasks to complete
+        print(f"Processing {total_videos} videos ({skipped} unchanged, skipped)...")
+
+        # Record each task in the manifest as soon as it completes
         completed = 0
-        for future in futures:
-            future.result()  # Wait for task to complete
+        for future in as_completed(futures):
+            key, stat, report = futures[future]
+            success, result = future.result()
             completed += 1
+            if success:
+                output_size = os.path.getsize(result)
+                bytes_in += stat.st_size
+                bytes_out += output_size
+                media = probe_input(ffmpeg_path, result)
+                if media and media['duration']:
+                    report['duration'] = media['duration']
+                    media_seconds += media['duration']
+                    encode_seconds += report['encode_seconds']
+                manifest.record(key, stat, settings, 'done', output=result, output_size=output_size)
+            else:
+                failures.append({'path': key, 'error': result})
+                manifest.record(key, stat, settings, 'failed', error=result)
+            if profile is not None:
+                default_profile_stats().record(report, success)
             print(f"Progress: {completed}/{total_videos} videos processed")
+    finally:
+        if owns_scheduler:
+            scheduler.shutdown()
+
+    wall = time.time() - started
+    succeeded = len(jobs) - len(failures)
+    summary = {
+        'input_folder': str(input_folder),
+        'output_folder': str(output_folder),
+        'settings': settings,
+        'profile': profile,
+        'found': len(jobs) + skipped,
+        'processed': succeeded,
+        'skipped': skipped,
+        'failed': len(failures),
+        'wall_seconds': round(wall, 3),
+        'videos_per_minute': round(succeeded * 60 / wall, 2) if wall and succeeded else 0.0,
+        'input_mb_per_second': round(bytes_in / (1024 * 1024) / wall, 2) if wall else 0.0,
+        'size_ratio': round(bytes_out / bytes_in, 4) if bytes_in else None,
+        'speed': round(media_seconds / encode_seconds, 3) if encode_seconds else None,
+        'failures': failures,
+    }
+    summary_path = summary_path or os.path.join(output_folder, SUMMARY_NAME)
+    with open(summary_path, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"Done: {succeeded} compressed, {skipped} skipped, {len(failures)} failed. Summary: {summary_path}")
+    return summary
+
+def watch_videos(input_folder, output_folder, ffmpeg_path, max_threads = 0, interval = 10, profile = None):
+    """
+    Keep processing input_folder as new files arrive.
+
+    A file is only picked up once its size and mtime are unchanged between two
+    polls, so files still being copied in are not encoded half-written.
+    """
+    scheduler = EncodeScheduler.from_environment(ENCODE_MEMORY_PER_JOB, slots=max_threads)
+    manifest = Manifest(os.path.join(output_folder, MANIFEST_NAME))
+    settings = settings_hash(ffmpeg_path, profile)
+    previous = {}
+    print(f"Watching {input_folder} every {interval}s (Ctrl+C to stop)")
+    try:
+        while True:
+            current = {}
+            for input_file in find_videos(input_folder):
+                stat = input_file.stat()
+                current[input_file] = (stat.st_size, stat.st_mtime)
+            # Stable files not yet handled; failed files are retried only once they change
+            pending = [
+                f for f, signature in current.items()
+                if previous.get(f) == signature
+                and not manifest.is_current(str(f.relative_to(input_folder)), f.stat(), settings,
+                                            statuses=('done', 'failed'))
+            ]
+            if pending:
+                process_videos(input_folder, output_folder, ffmpeg_path,
+                               scheduler=scheduler, manifest=manifest, files=pending, profile=profile)
+            previous = current
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        scheduler.shutdown()
 
 if __name__ == "__main__":
-    # Specify paths
-    input_folder = "input"  # Replace with your input folder path
-    output_folder = "output"  # Replace with your output folder path
-    ffmpeg_path = r"C:\ffmpeg-7.0.2-essentials_build\bin\ffmpeg.exe"
-    
+    parser = argparse.ArgumentParser(description="Batch-compress a folder of videos")
+    parser.add_argument("input_folder", nargs="?", default="input")
+    parser.add_argument("output_folder", nargs="?", default="output")
+    parser.add_argument("--ffmpeg", help="FFmpeg binary (default: found automatically)")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Concurrent encodes (default: size from the CPU quota and memory limit)")
+    parser.add_argument("--force", action="store_true", help="Re-encode files the manifest says are current")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process new files as they arrive")
+    parser.add_argument("--interval", type=int, default=10, help="Seconds between polls in watch mode")
+    parser.add_argument("--profile", choices=sorted(ENCODING_PROFILES),
+                        help="Encode on the CPU with this profile instead of the NVENC settings")
+    parser.add_argument("--summary", help=f"Where to write the JSON summary (default: <output>/{SUMMARY_NAME})")
+    args = parser.parse_args()
+
+    ffmpeg_path = args.ffmpeg or get_ffmpeg_path()
+
     # Create output folder if it doesn't exist
-    os.makedirs(output_folder, exist_ok=True)
-    
-    # Process all videos in the input folder
-    process_videos(input_folder, output_folder, ffmpeg_path, max_threads = 10)  
\ No newline at end of file
+    os.makedirs(args.output_folder, exist_ok=True)
+
+    if args.watch:
+        watch_videos(args.input_folder, args.output_folder, ffmpeg_path, args.workers, args.interval, args.profile)
+    else:
+        # Process all videos in the input folder
+        summary = process_videos(args.input_folder, args.output_folder, ffmpeg_path, args.workers,
+                                 force=args.force, summary_path=args.summary, profile=args.profile)
+        sys.exit(1 if summary['failed'] else 0)
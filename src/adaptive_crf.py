@@ -0,0 +1,194 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import tempfile
+import logging
+from .config import (
+    MAX_OUTPUT_WIDTH, CRF_CANDIDATES, CRF_SAMPLE_COUNT, CRF_SAMPLE_SECONDS, CRF_SAMPLE_PRESET, QUALITY_METRIC,
+    CRF_SEARCH_CACHE
+)
+from .ffmpeg_runner import run_ffmpeg, thread_args, decoder_thread_args
+from .storage import scratch_folder
+
+logger = logging.getLogger(__name__)
+
+_SSIM_RE = re.compile(r"SSIM .*All:([0-9.]+)")
+_PSNR_RE = re.compile(r"PSNR .*average:([0-9.]+|inf)")
+
+
+def sample_starts(duration, count=CRF_SAMPLE_COUNT, length=CRF_SAMPLE_SECONDS):
+    """Start times of count samples of length seconds spread evenly over the video"""
+    if duration <= length * count:
+        return [0.0]  # Short video: one sample covering (almost) all of it
+    step = duration / count
+    # Centre each sample in its share of the video, away from intros and end cards
+    return [round(step * i + (step - length) / 2, 3) for i in range(count)]
+
+
+def parse_score(stderr, metric):
+    """The overall SSIM (0-1) or PSNR (dB) from the summary line FFmpeg prints at the end"""
+    match = (_SSIM_RE if metric == "ssim" else _PSNR_RE).search(stderr)
+    if not match:
+        return None
+    return 100.0 if match.group(1) == "inf" else float(match.group(1))
+
+
+def score_sample(input_path, ffmpeg_path, start, length, crf, scratch_dir, metric, threads=None):
+    """
+    Encode one sample at crf with the fast preset and compare it to the source.
+
+    The reference is scaled exactly like the output so the metric measures
+    encoding loss only, not the downscale.
+    """
+    scale = f"scale='min({MAX_OUTPUT_WIDTH},iw)':'-2'"
+    sample_path = os.path.join(scratch_dir, f"sample_{start}_{crf}.mkv")
+    run_ffmpeg([
+        ffmpeg_path, "-y",
+        "-ss", str(start), "-t", str(length),
+        *decoder_thread_args(threads),
+        "-i", input_path,
+        "-vf", scale,
+        "-c:v", "libx264", "-preset", CRF_SAMPLE_PRESET, "-crf", str(crf),
+        "-an",
+        *thread_args(threads),
+        sample_path
+    ])
+    stderr = run_ffmpeg([
+        ffmpeg_path,
+        *decoder_thread_args(threads),
+        "-i", sample_path,
+        "-ss", str(start), "-t", str(length),
+        *decoder_thread_args(threads),
+        "-i", input_path,
+        "-lavfi", f"[1:v]{scale},format=yuv420p[ref];[0:v]format=yuv420p[enc];[enc][ref]{metric}",
+        *thread_args(threads),
+        "-f", "null", os.devnull
+    ])
+    os.remove(sample_path)
+    return parse_score(stderr, metric)
+
+
+def search_crf(input_path, ffmpeg_path, duration, floor, metric=QUALITY_METRIC, candidates=CRF_CANDIDATES,
+               threads=None):
+    """
+    The highest CRF whose sample encodes all reach floor, and the scores seen.
+
+    Candidates are tried from the highest (smallest file) down and the search
+    stops at the first that meets the floor on every sample, so easy content
+    costs one round of sample encodes. If none does, the lowest is used.
+    """
+    starts = sample_starts(duration or CRF_SAMPLE_SECONDS)
+    length = min(CRF_SAMPLE_SECONDS, duration) if duration else CRF_SAMPLE_SECONDS
+    scores = {}
+    with tempfile.TemporaryDirectory(prefix="crf_search_", dir=scratch_folder()) as scratch_dir:
+        for crf in sorted(candidates, reverse=True):
+            worst = None
+            for start in starts:
+                score = score_sample(input_path, ffmpeg_path, start, length, crf, scratch_dir, metric, threads)
+                if score is None:
+                    raise RuntimeError(f"FFmpeg printed no {metric} score for the sample at {start}s")
+                worst = score if worst is None else min(worst, score)
+                if worst < floor:
+                    break  # No need to score the other samples at this CRF
+            scores[crf] = round(worst, 4)
+            if worst >= floor:
+                return crf, scores
+    return min(candidates), scores
+
+
+class CrfSearchCache:
+    """
+    Chosen CRFs by input content and search settings, so re-runs and retries skip the search.
+
+    Kept in SQLite (WAL) so every worker process reads and adds to the same
+    entries: a retry that lands on another worker finds the earlier result.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS crf_search (key TEXT PRIMARY KEY, crf INTEGER NOT NULL, "
+                "scores TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._import_json(conn)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _import_json(self, conn):
+        """Take over the entries of the crf_search.json older versions kept"""
+        json_path = f"{os.path.splitext(self.db_path)[0]}.json"
+        try:
+            with open(json_path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, entry in entries.items():
+            conn.execute(
+                "INSERT OR IGNORE INTO crf_search (key, crf, scores, created_at) VALUES (?, ?, ?, ?)",
+                (key, entry['crf'], json.dumps(entry['scores']), entry['created_at'])
+            )
+        os.remove(json_path)
+
+    @staticmethod
+    def key(content_hash, floor, metric, candidates, ffmpeg_version):
+        settings = [content_hash, floor, metric, sorted(candidates), CRF_SAMPLE_COUNT, CRF_SAMPLE_SECONDS,
+                    CRF_SAMPLE_PRESET, MAX_OUTPUT_WIDTH, ffmpeg_version]
+        return hashlib.sha256(json.dumps(settings).encode()).hexdigest()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT crf, scores, created_at FROM crf_search WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return {'crf': row[0], 'scores': json.loads(row[1]), 'created_at': row[2]}
+
+    def put(self, key, crf, scores):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO crf_search (key, crf, scores, created_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET crf = excluded.crf, scores = excluded.scores, "
+                "created_at = excluded.created_at",
+                (key, crf, json.dumps(scores), time.time())
+            )
+
+
+_default_cache = None
+
+
+def default_crf_cache():
+    """The CrfSearchCache in CRF_SEARCH_CACHE, opened once per process"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = CrfSearchCache(CRF_SEARCH_CACHE)
+    return _default_cache
+
+
+def choose_crf(input_path, ffmpeg_path, content_hash, duration, floor, ffmpeg_version, metric=QUALITY_METRIC,
+               candidates=CRF_CANDIDATES, threads=None, report=None):
+    """search_crf with results cached by content hash; fills report['crf_search']"""
+    report = {} if report is None else report
+    cache = default_crf_cache()
+    key = cache.key(content_hash, floor, metric, candidates, ffmpeg_version)
+    entry = cache.get(key)
+    if entry is not None:
+        report['crf_search'] = {'cache': 'hit', 'metric': metric, 'floor': floor, 'scores': entry['scores']}
+        return entry['crf']
+
+    started = time.time()
+    crf, scores = search_crf(input_path, ffmpeg_path, duration, floor, metric, candidates, threads)
+    # JSON object keys are strings; keep them that way in memory too
+    scores = {str(k): v for k, v in scores.items()}
+    cache.put(key, crf, scores)
+    report['crf_search'] = {
+        'cache': 'miss', 'metric': metric, 'floor': floor, 'scores': scores,
+        'seconds': round(time.time() - started, 3)
+    }
+    logger.info(f"Chose CRF {crf} for {input_path} ({metric} floor {floor}: {scores})")
+    return crf
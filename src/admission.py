@@ -0,0 +1,186 @@
+import os
+import math
+import time
+import uuid
+import asyncio
+import threading
+import logging
+from urllib.parse import parse_qs
+from starlette.responses import JSONResponse
+from .config import (
+    DEFAULT_PROFILE, ADMISSION_DEFAULT_SECONDS_PER_MB, ADMISSION_DEFAULT_SPEED, ADMISSION_REFRESH
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SpeedModel:
+    """
+    Estimated encode seconds of a job per profile, from the rolling rates of
+    the last encodes of that profile (ProfileStats.recent_rates) shared by
+    all workers. Profiles without samples use the configured defaults.
+    """
+
+    def __init__(self, stats, refresh_seconds=ADMISSION_REFRESH):
+        self.stats = stats
+        self.refresh_seconds = refresh_seconds
+        self._rates = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def rates(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_seconds:
+                try:
+                    self._rates = self.stats.recent_rates()
+                except Exception as e:
+                    logger.error(f"Failed to load encode rates: {e}")
+                self._loaded_at = time.monotonic()
+            return self._rates
+
+    def estimate(self, profile=None, size=None, duration=None):
+        """Encode seconds for a job of size bytes, or of duration seconds of video when known"""
+        rate = self.rates().get(profile or DEFAULT_PROFILE, {})
+        if duration:
+            return duration / (rate.get('speed') or ADMISSION_DEFAULT_SPEED)
+        seconds_per_byte = rate.get('seconds_per_byte') or ADMISSION_DEFAULT_SECONDS_PER_MB / (1024 * 1024)
+        return (size or 0) * seconds_per_byte
+
+
+class AdmissionController:
+    """
+    Estimated completion time of new encodes from the work already ahead of them.
+
+    The backlog is the remaining estimated encode time of uploads this process
+    admitted and has not answered yet, plus this worker's share of the queued
+    and running jobs in the shared job store (running jobs only for the
+    video they have left). Divided over the encode slots it gives the
+    projected wait; a request is admitted while wait plus its own encode stays
+    within slo_seconds.
+    """
+
+    def __init__(self, model, slots, slo_seconds, jobs=None, processes=1):
+        self.model = model
+        self.slots = slots
+        self.slo_seconds = slo_seconds
+        # Returns the queued and running jobs of the shared store
+        self.jobs = jobs
+        self.processes = processes
+        self._admitted = {}
+        self._lock = threading.Lock()
+        self._job_backlog = (0, 0.0)
+        self._job_backlog_at = None
+
+    def _estimate_job(self, job):
+        """Remaining encode seconds of a job: from its probed duration once it reports progress, else its size"""
+        profile = job['options'].get('profile')
+        progress = job.get('progress') or {}
+        if progress.get('percent') and progress.get('out_seconds'):
+            remaining = progress['out_seconds'] * (100 / progress['percent'] - 1)
+            return self.model.estimate(profile, duration=remaining) if remaining > 0 else 0.0
+        try:
+            return self.model.estimate(profile, size=os.path.getsize(job['input_path']))
+        except OSError:
+            return 0.0
+
+    def job_backlog(self):
+        """(count, encode seconds) of queued and running jobs, cached for a few seconds"""
+        if self.jobs is None:
+            return 0, 0.0
+        if self._job_backlog_at is None or time.monotonic() - self._job_backlog_at > self.model.refresh_seconds:
+            try:
+                jobs = self.jobs()
+                self._job_backlog = (len(jobs), sum(self._estimate_job(job) for job in jobs))
+            except Exception as e:
+                logger.error(f"Failed to read the job backlog: {e}")
+            self._job_backlog_at = time.monotonic()
+        return self._job_backlog
+
+    def status(self):
+        """Queue depth and projected wait in seconds for a request arriving now"""
+        now = time.monotonic()
+        job_count, job_seconds = self.job_backlog()
+        with self._lock:
+            admitted = list(self._admitted.values())
+        upload_seconds = sum(max(0.0, seconds - (now - started)) for seconds, started in admitted)
+        backlog = upload_seconds + job_seconds / self.processes
+        return {
+            'queue_depth': len(admitted) + job_count,
+            'projected_wait_seconds': round(backlog / self.slots, 1),
+            'slots': self.slots,
+            'slo_seconds': self.slo_seconds,
+        }
+
+    def admit(self, profile=None, size=None):
+        """
+        Admit a request of size bytes: returns (ticket, status) with the
+        estimate in status, and ticket None when the work ahead of it would
+        make it miss the SLO
+        """
+        status = self.status()
+        estimate = self.model.estimate(profile, size=size)
+        status['estimated_seconds'] = round(estimate, 1)
+        status['estimated_completion_seconds'] = round(status['projected_wait_seconds'] + estimate, 1)
+        wait = status['projected_wait_seconds']
+        # An encode that misses the SLO on an idle box alone is still run: only load is shed
+        if self.slo_seconds and wait > 0 and status['estimated_completion_seconds'] > self.slo_seconds:
+            # Ask to come back once enough of the backlog has drained
+            overshoot = status['estimated_completion_seconds'] - self.slo_seconds
+            status['retry_after'] = max(1, math.ceil(min(wait, overshoot)))
+            return None, status
+        ticket = uuid.uuid4().hex
+        with self._lock:
+            self._admitted[ticket] = (estimate, time.monotonic())
+        return ticket, status
+
+    def release(self, ticket):
+        with self._lock:
+            self._admitted.pop(ticket, None)
+
+
+class AdmissionMiddleware:
+    """
+    Reject uploads that would miss the completion SLO with 429 and
+    Retry-After before their body is read.
+
+    The encode cost comes from Content-Length and the `profile` query
+    parameter (the form field is not parsed yet; DEFAULT_PROFILE otherwise).
+    Admitted responses carry X-Queue-Depth and X-Projected-Wait headers.
+    """
+
+    def __init__(self, app, controller, paths):
+        self.app = app
+        self.controller = controller
+        self.paths = paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            return await self.app(scope, receive, send)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        size = int(content_length) if content_length is not None and content_length.isdigit() else None
+        profile = parse_qs(scope.get("query_string", b"").decode()).get("profile", [None])[0]
+
+        ticket, status = await asyncio.to_thread(self.controller.admit, profile, size)
+        queue_headers = [
+            (b"x-queue-depth", str(status['queue_depth']).encode()),
+            (b"x-projected-wait", str(status['projected_wait_seconds']).encode()),
+        ]
+        if ticket is None:
+            logger.warning(f"Shed {scope['path']}: estimated completion in {status['estimated_completion_seconds']}s")
+            response = JSONResponse(
+                {"detail": "Encoders are saturated; retry later", **status},
+                status_code=429,
+                headers={"Retry-After": str(status['retry_after'])}
+            )
+            response.raw_headers.extend(queue_headers)
+            return await response(scope, receive, send)
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + queue_headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.controller.release(ticket)
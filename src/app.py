@@ -1,5 +1,5 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks
-from fastapi.responses import FileResponse, HTMLResponse, Response
+from fastapi import FastAPI, File, Form, Header, UploadFile, HTTPException, BackgroundTasks
+from fastapi.responses import FileResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.requests import Request
@@ -8,21 +8,59 @@ import shutil
 from werkzeug.utils import secure_filename
 import subprocess
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor
-from .video_processor import compress_video
+from .video_processor import compress_video, get_encoding_settings
+from .encoder_registry import get_capabilities, reprobe, summarize
 import logging
-from .config import get_ffmpeg_path, UPLOAD_FOLDER, OUTPUT_FOLDER, MAX_UPLOAD_SIZE
+from .config import (
+    get_ffmpeg_path, UPLOAD_FOLDER, OUTPUT_FOLDER, MAX_UPLOAD_SIZE, MAX_BATCH_UPLOAD_SIZE,
+    RESUMABLE_UPLOAD_FOLDER, JOBS_DB, RESULT_CACHE_FOLDER, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL,
+    ENCODE_SLOTS, ENCODE_THREADS, ENCODE_MEMORY_PER_JOB, DOWNLOADS_DB, DOWNLOAD_RETAIN_COUNT,
+    DOWNLOAD_RETAIN_TTL, DOWNLOAD_ACCEL_REDIRECT_PREFIX, STREAM_SNIFF_BYTES, QUALITY_FLOOR,
+    LADDER_FOLDER_PREFIX, WEB_WORKERS, CLEAR_OUTPUT_MIN_AGE, DISK_SWEEP_INTERVAL, DISK_QUOTA, UPLOAD_TTL,
+    SCRATCH_FOLDER, SCRATCH_TTL, DEFAULT_PROFILE, ADMISSION_SLO, PREVIEW_SECONDS, PREVIEW_FOLDER_PREFIX,
+    PREVIEW_SLOTS, PREVIEW_THREADS, PREVIEW_RESERVED_THREADS
+)
+from .result_cache import ResultCache
+from .scheduler import EncodeScheduler
+from .uploads import save_upload_stream, UploadTooLarge, MaxBodySizeMiddleware, ResumableUploads, BodyReader
+from .pipe_encode import PipeEncode, PipeEncodeResponse, sniff_streamability
+from starlette.requests import ClientDisconnect
+from .jobs import JobStore, JobManager, QUEUED, RUNNING, DONE, FAILED
+from .progress import ProgressHub
+from .zip_stream import stream_zip
+from .ladder import PACKAGINGS
+from .preview import PREVIEW_FILES, preview_dir
+from .delivery import RangeFileResponse, RetentionStore, ActiveReaders
+from .storage import DiskJanitor, DiskSpaceMiddleware, InsufficientSpace
+from .profiles import available_profiles, resolve_profile, default_profile_stats
+from .admission import SpeedModel, AdmissionController, AdmissionMiddleware
+from .metrics import (
+    UPLOAD_SECONDS, QUEUE_WAIT_SECONDS, DOWNLOAD_SECONDS, track_scheduler, observe_compression,
+    render_metrics, mark_process_dead
+)
+from prometheus_client import CONTENT_TYPE_LATEST
+import time
 import zipfile
 import io
 from datetime import datetime
+import uuid
 import asyncio
-from typing import List
+from typing import List, Optional
 
 logger = logging.getLogger(__name__)
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
+# Refuse oversize bodies before they are read (/upload-multiple/ also checks each file) and time the uploads
+app.add_middleware(MaxBodySizeMiddleware, on_body=UPLOAD_SECONDS.observe, limits={
+    "/upload-multiple/": MAX_BATCH_UPLOAD_SIZE,
+    "/batches": MAX_BATCH_UPLOAD_SIZE,
+    "/upload/": MAX_UPLOAD_SIZE,
+    "/jobs": MAX_UPLOAD_SIZE,
+    "/uploads": MAX_UPLOAD_SIZE,
+    "/stream/": MAX_UPLOAD_SIZE,
+})
 
 # Configuration
 UPLOAD_FOLDER = "uploads"
@@ -32,6 +70,8 @@ OUTPUT_FOLDER = "output"
 try:
     FFMPEG_PATH = get_ffmpeg_path()
     logger.info(f"Using FFmpeg at: {FFMPEG_PATH}")
+    # Probe encoders/filters once so compressions read them from the cache
+    get_capabilities(FFMPEG_PATH)
 except FileNotFoundError as e:
     logger.error(f"FFmpeg configuration error: {e}")
     raise
@@ -40,11 +80,155 @@ except FileNotFoundError as e:
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
 
-# Add max workers configuration
-MAX_WORKERS = 100  # Adjust based on your CPU cores
+# Encode concurrency is sized from the container's CPU quota and memory limit,
+# and every encode gets an explicit FFmpeg thread budget. Handlers await its
+# futures instead of blocking the event loop.
+scheduler = EncodeScheduler.from_environment(
+    ENCODE_MEMORY_PER_JOB, ENCODE_THREADS, ENCODE_SLOTS, on_wait=QUEUE_WAIT_SECONDS.observe, processes=WEB_WORKERS,
+    reserved_threads=PREVIEW_RESERVED_THREADS
+)
 
+# Identical inputs with identical settings are served from here instead of re-encoded
+result_cache = ResultCache(RESULT_CACHE_FOLDER, RESULT_CACHE_MAX_BYTES, RESULT_CACHE_TTL)
 
-async def process_video(video_file, filename):
+job_store = JobStore(JOBS_DB)
+track_scheduler(scheduler, OUTPUT_FOLDER, stored_jobs=lambda: job_store.count_by_status(QUEUED))
+# Segmented encodes borrow only slots that no job waiting in the shared store needs
+scheduler.backlog = lambda: job_store.count_by_status(QUEUED)
+progress_hub = ProgressHub()
+# Previews get a lane of their own so they never wait behind a full-length encode; its
+# threads were taken out of the CPU quota the encode slots above are sized from
+preview_scheduler = EncodeScheduler(PREVIEW_SLOTS, PREVIEW_THREADS) if PREVIEW_SECONDS else None
+job_manager = JobManager(job_store, scheduler, FFMPEG_PATH, cache=result_cache, progress=progress_hub,
+                         preview_scheduler=preview_scheduler, preview_folder=OUTPUT_FOLDER)
+resumable_uploads = ResumableUploads(RESUMABLE_UPLOAD_FOLDER, MAX_UPLOAD_SIZE)
+
+# Outputs survive interrupted and repeated downloads; they are deleted after a
+# number of completed downloads or a TTL, never while a response is reading them
+active_readers = ActiveReaders(DOWNLOADS_DB)
+retention = RetentionStore(DOWNLOADS_DB, DOWNLOAD_RETAIN_COUNT, DOWNLOAD_RETAIN_TTL, active_readers)
+
+# Abandoned uploads and scratch files expire and outputs are evicted LRU under
+# DISK_QUOTA; uploads the disk cannot take (the file plus an output up to its
+# size) are refused with 507 before their body is read
+janitor = DiskJanitor(
+    retention, UPLOAD_FOLDER, OUTPUT_FOLDER, RESUMABLE_UPLOAD_FOLDER, SCRATCH_FOLDER, DISK_QUOTA, UPLOAD_TTL,
+    SCRATCH_TTL, CLEAR_OUTPUT_MIN_AGE, active_paths=job_store.active_paths,
+    folder_prefix=(LADDER_FOLDER_PREFIX, PREVIEW_FOLDER_PREFIX)
+)
+app.add_middleware(DiskSpaceMiddleware, janitor=janitor, factors={
+    "/upload-multiple/": 2,
+    "/batches": 2,
+    "/upload/": 2,
+    "/jobs": 2,
+    "/uploads": 1,  # Resumable sessions reserve room for their output when they are created
+    "/stream/": 2,
+})
+
+# Synchronous uploads that would finish later than ADMISSION_SLO, given the
+# encode work already ahead of them, are shed with 429 before the body is read
+admission = AdmissionController(
+    SpeedModel(default_profile_stats()), scheduler.slots, ADMISSION_SLO,
+    jobs=lambda: job_store.list_by_status(QUEUED, RUNNING), processes=WEB_WORKERS
+)
+app.add_middleware(AdmissionMiddleware, controller=admission, paths={"/upload/", "/upload-multiple/"})
+
+
+def observed_compress(args, report=None, **kwargs):
+    """compress_video plus metrics for the finished compression"""
+    report = {} if report is None else report
+    success, result = compress_video(args, report=report, **kwargs)
+    observe_compression(report, success)
+    return success, result
+
+
+def observe_download(started):
+    """Background task: runs once the response body has been sent"""
+    DOWNLOAD_SECONDS.observe(time.monotonic() - started)
+
+
+def file_download(request, path, filename, background_tasks):
+    """Range/ETag-aware response for an output file that counts completed downloads"""
+    background_tasks.add_task(observe_download, time.monotonic())
+    response = RangeFileResponse(
+        path,
+        media_type="video/mp4",
+        filename=filename,
+        request_headers=request.headers,
+        readers=active_readers,
+        on_complete=retention.record_download,
+        accel_redirect_prefix=DOWNLOAD_ACCEL_REDIRECT_PREFIX
+    )
+    response.background = background_tasks
+    return response
+
+
+@app.on_event("startup")
+async def start_job_worker():
+    """
+    Start claiming jobs from the shared store, including jobs left queued or
+    running by a process that stopped (they are reclaimed once their lease expires)
+    """
+    job_manager.start()
+
+
+@app.on_event("shutdown")
+async def stop_job_worker():
+    job_manager.stop()
+    mark_process_dead()
+
+
+@app.on_event("startup")
+async def start_disk_janitor():
+    """Expire uploads, scratch files and outputs and enforce the disk quota in the background"""
+    async def sweep_forever():
+        while True:
+            try:
+                removed = await asyncio.to_thread(janitor.sweep)
+                if removed['uploads'] or removed['scratch'] or removed['expired'] or removed['evicted']:
+                    logger.info(f"Disk janitor: {removed}")
+            except Exception as e:
+                logger.error(f"Disk janitor sweep failed: {e}")
+            await asyncio.sleep(DISK_SWEEP_INTERVAL)
+
+    asyncio.create_task(sweep_forever())
+
+
+def encode_options(target_size_mb=None, target_kbps=None, adaptive_crf=False, quality_floor=None,
+                   ladder=False, packaging=None, profile=None):
+    """compress_video keyword arguments from the optional per-request form fields"""
+    if ladder or packaging:
+        if target_size_mb is not None or target_kbps is not None or adaptive_crf or quality_floor is not None:
+            raise HTTPException(status_code=400, detail="A rendition ladder uses its own bitrates per rendition")
+        if profile is not None:
+            raise HTTPException(status_code=400, detail="A rendition ladder uses its own presets per rendition")
+        if packaging not in PACKAGINGS:
+            raise HTTPException(status_code=400, detail=f"packaging must be one of {[p for p in PACKAGINGS if p]}")
+        return {"ladder": True, "packaging": packaging}
+    options = {}
+    if profile is not None:
+        try:
+            options["profile"] = resolve_profile(FFMPEG_PATH, profile)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if target_size_mb is not None and target_kbps is not None:
+        raise HTTPException(status_code=400, detail="Give either target_size_mb or target_kbps, not both")
+    if adaptive_crf or quality_floor is not None:
+        if target_size_mb is not None or target_kbps is not None:
+            raise HTTPException(status_code=400, detail="Adaptive CRF cannot be combined with a target size/bitrate")
+        options["quality_floor"] = QUALITY_FLOOR if quality_floor is None else quality_floor
+    elif target_size_mb is not None:
+        if target_size_mb <= 0:
+            raise HTTPException(status_code=400, detail="target_size_mb must be positive")
+        options["target_size"] = int(target_size_mb * 1024 * 1024)
+    elif target_kbps is not None:
+        if target_kbps <= 0:
+            raise HTTPException(status_code=400, detail="target_kbps must be positive")
+        options["target_bitrate"] = int(target_kbps * 1000)
+    return options
+
+
+async def process_video(video_file, filename, options=None):
     """Process a single video file"""
     file_path = None
     output_path = None
@@ -52,14 +236,18 @@ async def process_video(video_file, filename):
         file_path = os.path.join(UPLOAD_FOLDER, filename)
         output_path = os.path.join(OUTPUT_FOLDER, f"compressed_{filename}")
         
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(video_file.file, buffer)
+        # Save uploaded file in bounded chunks
+        try:
+            await save_upload_stream(video_file, file_path, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
         
-        # Use ThreadPoolExecutor for CPU-intensive compression
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(compress_video, (file_path, output_path, FFMPEG_PATH))
-            success, result = future.result()
+        # Run the CPU-intensive compression on the scheduler without blocking the loop
+        future = scheduler.submit(
+            uuid.uuid4().hex, observed_compress, (file_path, output_path, FFMPEG_PATH), cache=result_cache,
+            **(options or {})
+        )
+        success, result = await asyncio.wrap_future(future)
             
         if not success:
             raise HTTPException(status_code=500, detail=result)
@@ -81,14 +269,17 @@ async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
 @app.post("/upload/")
-async def upload_video(video: UploadFile = File(...)):
+async def upload_video(video: UploadFile = File(...), target_size_mb: Optional[float] = Form(None),
+                       target_kbps: Optional[float] = Form(None), adaptive_crf: bool = Form(False),
+                       quality_floor: Optional[float] = Form(None), profile: Optional[str] = Form(None)):
     """Handle single file upload with improved threading"""
     try:
         if not video.filename:
             raise HTTPException(status_code=400, detail="No file uploaded")
         
         safe_filename = secure_filename(video.filename)
-        output_path = await process_video(video, safe_filename)
+        options = encode_options(target_size_mb, target_kbps, adaptive_crf, quality_floor, profile=profile)
+        output_path = await process_video(video, safe_filename, options)
         
         return FileResponse(
             output_path,
@@ -100,108 +291,497 @@ async def upload_video(video: UploadFile = File(...)):
             raise
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/stream/{filename}")
+async def stream_video(filename: str, request: Request):
+    """
+    Compress a raw request body while it is still uploading.
+
+    The body is piped into FFmpeg's stdin and the output streamed back as
+    fragmented MP4 as soon as FFmpeg produces it, without writing the input or
+    output to disk. MP4/MOV files with the moov atom after the media data
+    cannot be read from a pipe; those are saved and compressed like /upload/.
+    """
+    safe_filename = secure_filename(filename) or "video.mp4"
+    body = request.stream().__aiter__()
+
+    # Sniff the container from the first bytes
+    head = b""
+    streamable = None
+    try:
+        while streamable is None and len(head) < STREAM_SNIFF_BYTES:
+            try:
+                head += await anext(body)
+            except StopAsyncIteration:
+                break
+            streamable = sniff_streamability(head)
+    except ClientDisconnect:
+        raise HTTPException(status_code=400, detail="Upload interrupted")
+    if not head:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+
+    if not streamable:
+        logger.info(f"{safe_filename} needs seeking (e.g. moov after mdat); compressing from disk")
+        output_path = await process_video(BodyReader(safe_filename, head, body), safe_filename)
+        return FileResponse(
+            output_path,
+            media_type="video/mp4",
+            filename=f"compressed_{safe_filename}"
+        )
+
+    encode = PipeEncode(FFMPEG_PATH, get_encoding_settings(FFMPEG_PATH))
+    future = scheduler.submit(uuid.uuid4().hex, encode.run)
+
+    async def feed_body():
+        try:
+            if await asyncio.to_thread(encode.put_input, head):
+                async for chunk in body:
+                    if not await asyncio.to_thread(encode.put_input, chunk):
+                        return  # FFmpeg stopped reading
+                await asyncio.to_thread(encode.put_input, None)
+        except (ClientDisconnect, HTTPException) as e:
+            logger.info(f"Streamed upload of {safe_filename} ended early: {e}")
+            encode.cancel()
+
+    # The request body keeps being fed while the response is streamed back
+    feeder = asyncio.create_task(feed_body())
+    first_chunk = await asyncio.to_thread(encode.get_output)
+    if first_chunk is None:
+        success, result = await asyncio.wrap_future(future)
+        feeder.cancel()
+        raise HTTPException(status_code=500, detail=result if not success else "FFmpeg produced no output")
+    return PipeEncodeResponse(encode, future, first_chunk, f"compressed_{safe_filename}")
+
 @app.post("/upload-multiple/")
-async def upload_multiple_videos(files: List[UploadFile] = File(...)):
+async def upload_multiple_videos(files: List[UploadFile] = File(...), profile: Optional[str] = Form(None)):
     """Handle multiple file uploads concurrently"""
     try:
         if not files:
             raise HTTPException(status_code=400, detail="No files uploaded")
+        options = encode_options(profile=profile)
         
         successful_files = []
+        rejected_files = []
         
-        # Process videos with a fixed thread pool
-        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
-            futures = []
-            
-            for video in files:
-                if not video.filename:
-                    continue
-                    
-                safe_filename = secure_filename(video.filename)
-                file_path = os.path.join(UPLOAD_FOLDER, safe_filename)
-                output_path = os.path.join(OUTPUT_FOLDER, f"compressed_{safe_filename}")
-                
-                # Save uploaded file
-                try:
-                    contents = await video.read()
-                    with open(file_path, "wb") as f:
-                        f.write(contents)
-                except Exception as e:
-                    logger.error(f"Failed to save uploaded file {safe_filename}: {e}")
-                    continue
+        # Process videos on the scheduler; the whole request shares one fair-queue owner
+        request_id = uuid.uuid4().hex
+        futures = []
+        
+        for video in files:
+            if not video.filename:
+                continue
                 
-                # Submit compression task
-                future = pool.submit(compress_video, (file_path, output_path, FFMPEG_PATH))
-                futures.append((future, safe_filename, file_path))
+            safe_filename = secure_filename(video.filename)
+            file_path = os.path.join(UPLOAD_FOLDER, safe_filename)
+            output_path = os.path.join(OUTPUT_FOLDER, f"compressed_{safe_filename}")
             
-            # Wait for all compressions to complete
-            for future, filename, input_path in futures:
-                try:
-                    success, result = future.result()
-                    if success:
-                        successful_files.append({
-                            "original_name": filename,
-                            "compressed_path": os.path.basename(result)  # Just return filename
-                        })
-                    else:
-                        logger.error(f"Compression failed for {filename}: {result}")
-                except Exception as e:
-                    logger.error(f"Error processing {filename}: {e}")
-                finally:
-                    # Clean up input file
-                    if os.path.exists(input_path):
-                        os.remove(input_path)
+            # Save uploaded file in bounded chunks
+            try:
+                await save_upload_stream(video, file_path, MAX_UPLOAD_SIZE)
+            except UploadTooLarge as e:
+                rejected_files.append({"original_name": safe_filename, "reason": str(e)})
+                continue
+            except Exception as e:
+                logger.error(f"Failed to save uploaded file {safe_filename}: {e}")
+                continue
+            
+            # Submit compression task
+            report = {}
+            future = scheduler.submit(
+                request_id, observed_compress, (file_path, output_path, FFMPEG_PATH),
+                cache=result_cache, report=report, **options
+            )
+            futures.append((future, safe_filename, file_path, report))
+        
+        # Wait for all compressions to complete without blocking the event loop
+        for future, filename, input_path, report in futures:
+            try:
+                success, result = await asyncio.wrap_future(future)
+                if success:
+                    successful_files.append({
+                        "original_name": filename,
+                        "compressed_path": os.path.basename(result),  # Just return filename
+                        "path": report.get("path")
+                    })
+                else:
+                    logger.error(f"Compression failed for {filename}: {result}")
+            except Exception as e:
+                logger.error(f"Error processing {filename}: {e}")
+            finally:
+                # Clean up input file
+                if os.path.exists(input_path):
+                    os.remove(input_path)
         
         if not successful_files:
+            if rejected_files:
+                raise HTTPException(status_code=413, detail=rejected_files)
             raise HTTPException(status_code=500, detail="No files were successfully processed")
             
-        return {"processed_files": successful_files}
+        return {"processed_files": successful_files, "rejected_files": rejected_files}
             
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Error during multiple file upload")
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/download/{filename}")
-async def download_video(filename: str, background_tasks: BackgroundTasks):
-    file_path = os.path.join(OUTPUT_FOLDER, filename)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+@app.post("/jobs", status_code=202)
+async def create_job(video: Optional[UploadFile] = File(None), upload_id: Optional[str] = Form(None),
+                     target_size_mb: Optional[float] = Form(None), target_kbps: Optional[float] = Form(None),
+                     adaptive_crf: bool = Form(False), quality_floor: Optional[float] = Form(None),
+                     ladder: bool = Form(False), packaging: Optional[str] = Form(None),
+                     profile: Optional[str] = Form(None)):
+    """
+    Accept a video for compression and return a job ID without waiting for the encode.
+
+    The video is either sent as the `video` form field or referenced by the
+    `upload_id` of a completed resumable upload. target_size_mb or target_kbps
+    switch to a two-pass encode that fits that size or bitrate; adaptive_crf
+    (optionally with a quality_floor) picks the CRF per video instead. ladder
+    encodes every rendition of LADDER_RENDITIONS in one pass, optionally
+    packaged as HLS or DASH (packaging). profile picks one of ENCODING_PROFILES.
+    """
+    job_id = uuid.uuid4().hex
+    options = encode_options(target_size_mb, target_kbps, adaptive_crf, quality_floor, ladder, packaging, profile)
+    
+    if upload_id:
+        upload = resumable_uploads.get(upload_id)
+        if upload is None:
+            raise HTTPException(status_code=404, detail="Upload not found")
+        if not upload["complete"]:
+            raise HTTPException(status_code=409, detail=f"Upload incomplete at byte {upload['offset']}")
+        safe_filename = secure_filename(upload["filename"]) or "video.mp4"
+    elif video and video.filename:
+        safe_filename = secure_filename(video.filename)
+    else:
+        raise HTTPException(status_code=400, detail="No file uploaded")
+    
+    # Inputs are kept under the job ID until the job finishes so a restart can resume it
+    file_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{safe_filename}")
+    output_path = os.path.join(OUTPUT_FOLDER, f"compressed_{job_id}_{safe_filename}")
+    if options.get("ladder"):
+        output_path = os.path.join(OUTPUT_FOLDER, f"{LADDER_FOLDER_PREFIX}{job_id}")
     
+    if upload_id:
+        resumable_uploads.finish(upload_id, file_path)
+    else:
+        try:
+            await save_upload_stream(video, file_path, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except Exception as e:
+            logger.error(f"Failed to save uploaded file {safe_filename}: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    
+    job_store.create(safe_filename, file_path, output_path, job_id=job_id, options=options,
+                     preview=bool(PREVIEW_SECONDS))
+    job_manager.submit(job_id)
+    return {"job_id": job_id, "status": job_store.get(job_id)["status"]}
+
+@app.post("/batches", status_code=202)
+async def create_batch(files: List[UploadFile] = File(...), target_size_mb: Optional[float] = Form(None),
+                       target_kbps: Optional[float] = Form(None), adaptive_crf: bool = Form(False),
+                       quality_floor: Optional[float] = Form(None), profile: Optional[str] = Form(None)):
+    """Queue several videos as one batch; their outputs can be fetched together as a ZIP"""
+    batch_id = uuid.uuid4().hex
+    options = encode_options(target_size_mb, target_kbps, adaptive_crf, quality_floor, profile=profile)
+    jobs = []
+    rejected_files = []
+    
+    for video in files:
+        if not video.filename:
+            continue
+        safe_filename = secure_filename(video.filename)
+        job_id = uuid.uuid4().hex
+        file_path = os.path.join(UPLOAD_FOLDER, f"{job_id}_{safe_filename}")
+        output_path = os.path.join(OUTPUT_FOLDER, f"compressed_{job_id}_{safe_filename}")
+        try:
+            await save_upload_stream(video, file_path, MAX_UPLOAD_SIZE)
+        except UploadTooLarge as e:
+            rejected_files.append({"original_name": safe_filename, "reason": str(e)})
+            continue
+        except Exception as e:
+            logger.error(f"Failed to save uploaded file {safe_filename}: {e}")
+            rejected_files.append({"original_name": safe_filename, "reason": str(e)})
+            continue
+        job_store.create(safe_filename, file_path, output_path, job_id=job_id, batch_id=batch_id, options=options,
+                         preview=bool(PREVIEW_SECONDS))
+        # The whole batch shares one fair-queue owner so it cannot starve other uploads
+        job_manager.submit(job_id, owner=batch_id)
+        jobs.append({"job_id": job_id, "filename": safe_filename})
+    
+    if not jobs:
+        raise HTTPException(status_code=400, detail={"message": "No files accepted", "rejected_files": rejected_files})
+    return {"batch_id": batch_id, "jobs": jobs, "rejected_files": rejected_files}
+
+@app.get("/batches/{batch_id}")
+async def get_batch(batch_id: str):
+    """Status of every job in a batch"""
+    jobs = job_store.list_by_batch(batch_id)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return {
+        "batch_id": batch_id,
+        "finished": all(job["status"] in (DONE, FAILED) for job in jobs),
+        "jobs": [
+            {"job_id": job["id"], "filename": job["filename"], "status": job["status"], "error": job["error"]}
+            for job in jobs
+        ],
+    }
+
+@app.get("/batches/{batch_id}/zip")
+async def download_batch_zip(batch_id: str):
+    """
+    Stream a ZIP of every output in a batch.
+
+    The response starts right away and each output is added as soon as its job
+    finishes, so the download overlaps with the rest of the batch encoding.
+    Failed jobs are listed in FAILED.txt at the end of the archive.
+    """
+    if not job_store.list_by_batch(batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+
+    async def finished_outputs():
+        sent = set()
+        failures = []
+        used_names = set()
+        while True:
+            jobs = job_store.list_by_batch(batch_id)
+            for job in jobs:
+                if job["id"] in sent or job["status"] not in (DONE, FAILED):
+                    continue
+                sent.add(job["id"])
+                if job["status"] == DONE and os.path.exists(job["output_path"]):
+                    # Two uploads with the same name get distinct entries
+                    name = f"compressed_{job['filename']}"
+                    if name in used_names:
+                        name = f"compressed_{job['id'][:8]}_{job['filename']}"
+                    used_names.add(name)
+                    yield name, job["output_path"]
+                else:
+                    failures.append(f"{job['filename']}: {job['error'] or 'output no longer available'}")
+            if len(sent) == len(jobs):
+                break
+            await asyncio.sleep(1)
+        if failures:
+            yield "FAILED.txt", ("\n".join(failures) + "\n").encode()
+
+    return StreamingResponse(
+        stream_zip(finished_outputs()),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="batch_{batch_id}.zip"'}
+    )
+
+@app.post("/uploads", status_code=201)
+async def create_resumable_upload(filename: str = Form(...), upload_length: int = Header(...)):
+    """Start a resumable upload of `Upload-Length` bytes"""
     try:
-        # Function to cleanup file after download
-        async def cleanup_after_download():
-            try:
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-                    logger.debug(f"Cleaned up compressed file: {file_path}")
-            except Exception as e:
-                logger.error(f"Failed to clean up file {file_path}: {e}")
+        await asyncio.to_thread(janitor.make_room, 2 * upload_length)
+        upload_id = resumable_uploads.create(filename, upload_length)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InsufficientSpace as e:
+        raise HTTPException(status_code=507, detail=f"Not enough disk space: {e}")
+    return Response(
+        status_code=201,
+        headers={"Location": f"/uploads/{upload_id}", "Upload-Offset": "0", "Upload-Id": upload_id}
+    )
 
-        # Add cleanup to background tasks
-        background_tasks.add_task(cleanup_after_download)
-        
-        return FileResponse(
-            file_path, 
-            media_type="video/mp4",
-            filename=filename
+@app.head("/uploads/{upload_id}")
+async def get_resumable_upload_offset(upload_id: str):
+    """Report how many bytes of a resumable upload have been received"""
+    upload = resumable_uploads.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return Response(headers={
+        "Upload-Offset": str(upload["offset"]),
+        "Upload-Length": str(upload["length"]),
+        "Cache-Control": "no-store",
+    })
+
+@app.patch("/uploads/{upload_id}")
+async def append_resumable_upload(request: Request, upload_id: str, upload_offset: int = Header(...)):
+    """Append the request body to a resumable upload starting at `Upload-Offset`"""
+    try:
+        offset = await resumable_uploads.append(upload_id, upload_offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    return Response(status_code=204, headers={"Upload-Offset": str(offset)})
+
+@app.delete("/uploads/{upload_id}")
+async def delete_resumable_upload(upload_id: str):
+    """Abandon a resumable upload"""
+    if resumable_uploads.get(upload_id) is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    resumable_uploads.discard(upload_id)
+    return {"message": "Upload discarded"}
+
+def job_preview(job):
+    """A job's preview state, with the URL of each file once it is ready"""
+    preview = job["preview"]
+    if not preview or preview.get("state") != "ready":
+        return preview
+    urls = {kind: f"/jobs/{job['id']}/preview/{name}" for kind, name in preview["files"].items()}
+    return {**preview, "urls": urls}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Report the status of a compression job"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "error": job["error"],
+        # Jobs running in another worker process report progress through the store
+        "progress": progress_hub.get(job_id) or job["progress"],
+        "report": job["report"],
+        "preview": job_preview(job),
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+@app.get("/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """Server-Sent Events with live encode progress (frame, fps, speed, out_time, percent)"""
+    if job_store.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    def finished_status():
+        job = job_store.get(job_id)
+        if job is None or job["status"] in (DONE, FAILED):
+            return job["status"] if job else FAILED
+        return None
+
+    def stored_progress():
+        job = job_store.get(job_id)
+        return job["progress"] if job else None
+
+    return StreamingResponse(
+        progress_hub.events(job_id, finished_status, fetch=stored_progress),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, request: Request, background_tasks: BackgroundTasks):
+    """Download the compressed output of a finished job (supports Range and If-None-Match)"""
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job["status"] != DONE:
+        raise HTTPException(status_code=409, detail=f"Job is {job['status']}")
+    if not os.path.exists(job["output_path"]):
+        raise HTTPException(status_code=410, detail="Result is no longer available")
+    if os.path.isdir(job["output_path"]):
+        # Rendition ladders are a folder of files; send them all as one ZIP
+        async def ladder_files():
+            for root, _, names in os.walk(job["output_path"]):
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    yield os.path.relpath(path, job["output_path"]), path
+
+        stem = os.path.splitext(job["filename"])[0]
+        return StreamingResponse(
+            stream_zip(ladder_files()),
+            media_type="application/zip",
+            headers={"Content-Disposition": f'attachment; filename="{stem}_renditions.zip"'}
         )
-        
-    except Exception as e:
-        logger.exception("Error during file download")
-        raise HTTPException(status_code=500, detail=str(e))
+    return file_download(request, job["output_path"], f"compressed_{job['filename']}", background_tasks)
+
+LADDER_MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".mpd": "application/dash+xml",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+}
+
+@app.api_route("/jobs/{job_id}/files/{path:path}", methods=["GET", "HEAD"])
+async def get_job_file(job_id: str, path: str, request: Request):
+    """
+    One file of a rendition ladder job: a rendition MP4, or the HLS/DASH
+    playlists and segments, so /jobs/{id}/files/master.m3u8 plays directly.
+    """
+    job = job_store.get(job_id)
+    if job is None or job["status"] != DONE or not os.path.isdir(job["output_path"]):
+        raise HTTPException(status_code=404, detail="No rendition ladder for this job")
+    root = os.path.realpath(job["output_path"])
+    file_path = os.path.realpath(os.path.join(root, path))
+    if not file_path.startswith(os.path.join(root, "")) or not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    media_type = LADDER_MEDIA_TYPES.get(os.path.splitext(file_path)[1], "application/octet-stream")
+    return RangeFileResponse(file_path, media_type=media_type, filename=None, request_headers=request.headers,
+                             readers=active_readers)
+
+PREVIEW_MEDIA_TYPES = {
+    PREVIEW_FILES['proxy']: "video/mp4",
+    PREVIEW_FILES['sprite']: "image/jpeg",
+    PREVIEW_FILES['thumbnails']: "text/vtt",
+}
+
+@app.api_route("/jobs/{job_id}/preview/{name}", methods=["GET", "HEAD"])
+async def get_job_preview(job_id: str, name: str, request: Request):
+    """
+    The low-res proxy (preview.mp4), thumbnail sprite (sprite.jpg) or its
+    WebVTT index (thumbnails.vtt) of a job, available before the encode
+    finishes. The VTT cues reference the sprite relative to this URL.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if name not in PREVIEW_MEDIA_TYPES:
+        raise HTTPException(status_code=404, detail="File not found")
+    preview = job["preview"] or {}
+    if preview.get("state") != "ready":
+        raise HTTPException(status_code=409, detail=f"Preview is {preview.get('state', 'not available')}")
+    file_path = os.path.join(preview_dir(OUTPUT_FOLDER, job_id), name)
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=410, detail="Preview is no longer available")
+    return RangeFileResponse(file_path, media_type=PREVIEW_MEDIA_TYPES[name], filename=None,
+                             request_headers=request.headers, readers=active_readers)
+
+@app.api_route("/download/{filename}", methods=["GET", "HEAD"])
+async def download_video(filename: str, request: Request, background_tasks: BackgroundTasks):
+    """
+    Download an output. Interrupted downloads resume with Range requests, and
+    the file is kept until DOWNLOAD_RETAIN_COUNT completed downloads or
+    DOWNLOAD_RETAIN_TTL, instead of being deleted after the first GET.
+    """
+    file_path = os.path.join(OUTPUT_FOLDER, secure_filename(filename))
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="File not found")
+    return file_download(request, file_path, filename, background_tasks)
 
 @app.get("/clear-output")
 async def clear_output():
-    """Endpoint to manually clear all files in the output directory"""
+    """
+    Endpoint to manually clear all files in the output directory.
+
+    Other worker processes share the folder, so outputs of queued or running
+    jobs, files written in the last CLEAR_OUTPUT_MIN_AGE seconds (an encode in
+    progress) and files any process is still serving are left in place.
+    """
     try:
         files = [f for f in os.listdir(OUTPUT_FOLDER) if os.path.isfile(os.path.join(OUTPUT_FOLDER, f))]
+        in_use = job_store.active_paths()
+        cutoff = time.time() - CLEAR_OUTPUT_MIN_AGE
+        cleared = 0
         for file in files:
+            path = os.path.join(OUTPUT_FOLDER, file)
             try:
-                os.remove(os.path.join(OUTPUT_FOLDER, file))
+                if path in in_use or os.path.getmtime(path) > cutoff:
+                    continue
+                # Files still being downloaded are left for the retention sweep
+                cleared += retention.remove(path, "cleared")
                 logger.debug(f"Cleared file: {file}")
             except Exception as e:
                 logger.error(f"Failed to clear file {file}: {e}")
-        return {"message": f"Cleared {len(files)} files from output directory"}
+        return {"message": f"Cleared {cleared} files from output directory"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -211,9 +791,67 @@ async def cleanup_file(filename: str):
     try:
         file_path = os.path.join(OUTPUT_FOLDER, filename)
         if os.path.exists(file_path):
-            os.remove(file_path)
+            if not retention.remove(file_path, "cleanup requested"):
+                raise HTTPException(status_code=409, detail=f"{filename} is being downloaded")
             return {"message": f"Successfully cleaned up {filename}"}
         return {"message": "File already removed"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics: per-stage timings, encode speed/size ratios, queue and disk gauges"""
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/health")
+async def health():
+    """Liveness plus saturation: running and queued encodes against the available slots, and the projected wait"""
+    active = scheduler.active
+    # Jobs wait in the shared store until a worker has a free slot
+    queued = scheduler.queued + await asyncio.to_thread(job_store.count_by_status, QUEUED)
+    disk = shutil.disk_usage(OUTPUT_FOLDER)
+    admission_status = await asyncio.to_thread(admission.status)
+    return {
+        "status": "ok",
+        "slots": scheduler.slots,
+        "threads_per_encode": scheduler.threads_per_job,
+        "active_encodes": active,
+        "queued_jobs": queued,
+        "saturation": round((active + queued) / scheduler.slots, 2),
+        "saturated": active >= scheduler.slots and queued > 0,
+        "output_disk_free_bytes": disk.free,
+        "queue_depth": admission_status["queue_depth"],
+        "projected_wait_seconds": admission_status["projected_wait_seconds"],
+        "admission_slo_seconds": ADMISSION_SLO,
+    }
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Result cache hit/miss/eviction counts and the encode time saved by hits"""
+    return result_cache.stats()
+
+@app.get("/profiles")
+async def get_profiles():
+    """Encoding profiles this FFmpeg build can run, the default, and measured speed/size ratio per profile"""
+    return {
+        "default": DEFAULT_PROFILE,
+        "profiles": available_profiles(FFMPEG_PATH),
+        "stats": await asyncio.to_thread(default_profile_stats().summary),
+    }
+
+@app.get("/encoders")
+async def get_encoders():
+    """Report the cached capabilities of the configured FFmpeg binary"""
+    return summarize(get_capabilities(FFMPEG_PATH))
+
+@app.post("/encoders/reprobe")
+async def reprobe_encoders():
+    """Re-probe FFmpeg capabilities without restarting (e.g. after upgrading FFmpeg)"""
+    try:
+        capabilities = await asyncio.to_thread(reprobe, FFMPEG_PATH)
+        return summarize(capabilities)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
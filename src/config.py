@@ -1,7 +1,9 @@
 import os
+import json
 import platform
 import shutil
 from pathlib import Path
+from .scheduler import plan_web_workers
 
 def get_ffmpeg_path():
     """Get the FFmpeg path based on the operating system"""
@@ -45,7 +47,125 @@ def get_ffmpeg_path():
         "in one of the default locations. Visit https://ffmpeg.org/download.html"
     )
 
+def get_ffprobe_path(ffmpeg_path):
+    """Get the FFprobe that ships next to an FFmpeg binary"""
+    directory, name = os.path.split(ffmpeg_path)
+    candidate = os.path.join(directory, name.replace("ffmpeg", "ffprobe"))
+    if os.path.isfile(candidate):
+        return candidate
+    ffprobe_command = shutil.which('ffprobe')
+    if ffprobe_command:
+        return ffprobe_command
+    raise FileNotFoundError(f"FFprobe not found next to {ffmpeg_path} or in PATH")
+
 # Configuration
 UPLOAD_FOLDER = "uploads"
 OUTPUT_FOLDER = "output"
-MAX_UPLOAD_SIZE = 500 * 1024 * 1024  # 500MB
+RESULT_CACHE_FOLDER = os.path.join(OUTPUT_FOLDER, ".cache")
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))  # 5GB
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 3600))  # Seconds
+# Encode concurrency; 0 means size automatically from the cgroup CPU quota and memory limit
+ENCODE_SLOTS = int(os.environ.get("MAX_WORKERS", 0))
+ENCODE_THREADS = int(os.environ.get("ENCODE_THREADS", 0))  # FFmpeg threads per encode
+ENCODE_MEMORY_PER_JOB = 512 * 1024 * 1024  # Rough peak RSS of one 720p libx264 encode
+MAX_OUTPUT_WIDTH = 1280
+# Encoding profiles, selectable per request (`profile`) and per batch run (--profile). On a GPU host the
+# libx264 tiers run on NVENC with nvenc_preset; tiers whose encoder the FFmpeg build lacks are not offered.
+ENCODING_PROFILES = {
+    "fast": {"codec": "libx264", "preset": "veryfast", "crf": 28, "nvenc_preset": "p4"},
+    "balanced": {"codec": "libx264", "preset": "medium", "crf": 28, "nvenc_preset": "p6"},
+    "archive": {"codec": "libx264", "preset": "slower", "crf": 28, "nvenc_preset": "p7"},
+    "hevc": {"codec": "libx265", "preset": "medium", "crf": 30, "extra_params": ["-tag:v", "hvc1"]},
+    "av1": {"codec": "libsvtav1", "preset": "8", "crf": 35},
+}
+DEFAULT_PROFILE = os.environ.get("ENCODING_PROFILE", "archive")
+AUDIO_BITRATE = 96000  # bits/s of the AAC track in compressed outputs
+MIN_SIZE_SAVING = 0.05  # Return the original when an encode saves less than this fraction
+
+# Videos longer than this are split at keyframes and encoded in parallel segments
+SEGMENT_MIN_DURATION = float(os.environ.get("SEGMENT_MIN_DURATION", 600))  # Seconds; 0 disables
+SEGMENT_SECONDS = int(os.environ.get("SEGMENT_SECONDS", 60))
+# Parallel segment encodes per video (0 = CPUs / FFmpeg threads per encode); all but one borrow idle slots
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", 0))
+# Target size/bitrate mode: share of the size budget kept for the MP4 container, and the lowest usable video rate
+TARGET_MUX_OVERHEAD = 0.02
+TARGET_MIN_VIDEO_BITRATE = 100_000  # bits/s
+# Adaptive CRF: sample encodes at each candidate CRF, scored against the source
+QUALITY_METRIC = os.environ.get("QUALITY_METRIC", "ssim")  # "ssim" (0-1) or "psnr" (dB)
+QUALITY_FLOOR = float(os.environ.get("QUALITY_FLOOR", 0.97 if QUALITY_METRIC == "ssim" else 38.0))
+CRF_CANDIDATES = (32, 30, 28, 26, 24, 22)
+CRF_SAMPLE_COUNT = 3
+CRF_SAMPLE_SECONDS = 4
+CRF_SAMPLE_PRESET = "veryfast"
+# Rendition ladder (one FFmpeg process, one encoder per rendition); override with JSON in LADDER_RENDITIONS
+LADDER_RENDITIONS = json.loads(os.environ.get("LADDER_RENDITIONS", "null")) or [
+    {"name": "1080p", "height": 1080, "bitrate": "4500k", "preset": "medium"},
+    {"name": "720p", "height": 720, "bitrate": "2500k", "preset": "medium"},
+    {"name": "480p", "height": 480, "bitrate": "1000k", "preset": "medium"},
+]
+LADDER_FOLDER_PREFIX = "ladder_"  # Ladder jobs write their renditions to OUTPUT_FOLDER/ladder_<job id>/
+LADDER_SEGMENT_SECONDS = 6  # HLS/DASH segment length
+LADDER_KEYFRAME_SECONDS = 2  # Keyframes at the same timestamps in every rendition
+# Instant preview of queued jobs: a low-res proxy of the first PREVIEW_SECONDS plus a keyframe thumbnail
+# sprite with a WebVTT index, from one FFmpeg process in a lane beside the encode slots; 0 disables
+PREVIEW_SECONDS = int(os.environ.get("PREVIEW_SECONDS", 30))
+PREVIEW_HEIGHT = 240
+PREVIEW_CRF = 32
+PREVIEW_SLOTS = 1  # Previews run at once per worker process, in a lane of their own
+PREVIEW_THREADS = 1  # FFmpeg threads of a preview, so it costs a fraction of an encode slot
+# CPU threads each worker process keeps for its preview lane; encode slots are sized from what is left
+PREVIEW_RESERVED_THREADS = PREVIEW_SLOTS * PREVIEW_THREADS if PREVIEW_SECONDS else 0
+PREVIEW_FOLDER_PREFIX = "preview_"  # Previews go to OUTPUT_FOLDER/preview_<job id>/
+PREVIEW_THUMB_WIDTH = 160
+PREVIEW_THUMB_INTERVAL = 10  # Minimum seconds between thumbnails; longer videos space them out further
+PREVIEW_MAX_THUMBS = 100  # Thumbnails per sprite sheet
+PREVIEW_SPRITE_COLUMNS = 10
+FFMPEG_STDERR_TAIL_LINES = 50  # Lines of FFmpeg stderr kept for error messages
+DATA_FOLDER = "data"
+JOBS_DB = os.path.join(DATA_FOLDER, "jobs.db")
+# Shared work queue: a worker renews its claim on a running job every third of the lease
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+JOB_POLL_INTERVAL = 1.0  # Seconds between checks for jobs enqueued by other processes
+JOB_MAX_ATTEMPTS = 3  # Runs that lose their worker before a job is failed
+# Web worker processes per container (0 = one per CPU of the cgroup quota); each gets an equal share of the
+# encode slots, so there are never more processes than slots
+WEB_WORKERS = plan_web_workers(
+    int(os.environ.get("UVICORN_WORKERS") or 1), ENCODE_MEMORY_PER_JOB, ENCODE_THREADS, ENCODE_SLOTS,
+    PREVIEW_RESERVED_THREADS
+)
+# First-pass logs of two-pass encodes, reused when the same input is encoded again
+PASSLOG_FOLDER = os.path.join(DATA_FOLDER, "passlogs")
+CRF_SEARCH_CACHE = os.path.join(DATA_FOLDER, "crf_search.db")  # Chosen CRFs, shared by all worker processes
+PROFILE_STATS_DB = os.path.join(DATA_FOLDER, "profile_stats.db")  # Measured speed and size ratio per profile
+PROFILE_STATS_WINDOW = 50  # Recent encodes per profile behind the rolling speed model
+# Admission control for /upload/ and /upload-multiple/: requests whose estimated completion (projected queue
+# wait plus their own encode) exceeds ADMISSION_SLO seconds get 429 before their body is read; 0 disables.
+# Until a profile has samples its encodes are assumed to take ADMISSION_DEFAULT_SECONDS_PER_MB.
+ADMISSION_SLO = int(os.environ.get("ADMISSION_SLO", 900))
+ADMISSION_DEFAULT_SECONDS_PER_MB = 1.0
+ADMISSION_DEFAULT_SPEED = 0.5  # Seconds of video encoded per second, for estimates from a probed duration
+ADMISSION_REFRESH = 5  # Seconds the speed model and the job backlog are cached between estimates
+PASSLOG_TTL = int(os.environ.get("PASSLOG_TTL", 7 * 24 * 3600))  # Seconds
+MAX_UPLOAD_SIZE = 500 * 1024 * 1024  # 500MB per file
+MAX_BATCH_UPLOAD_SIZE = 20 * MAX_UPLOAD_SIZE  # Whole /upload-multiple/ request
+UPLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes held in memory per upload while streaming to disk
+RESUMABLE_UPLOAD_FOLDER = os.path.join(UPLOAD_FOLDER, "resumable")
+STREAM_CHUNK_SIZE = 256 * 1024  # Bytes per chunk piped into and out of streamed encodes
+STREAM_SNIFF_BYTES = 1024 * 1024  # Upload head inspected to decide between piping and the disk path
+# Outputs are kept for this many completed downloads or this long, whichever comes first
+DOWNLOAD_RETAIN_COUNT = int(os.environ.get("DOWNLOAD_RETAIN_COUNT", 3))  # 0 = only the TTL applies
+DOWNLOAD_RETAIN_TTL = int(os.environ.get("DOWNLOAD_RETAIN_TTL", 24 * 3600))  # Seconds
+DOWNLOADS_DB = os.path.join(DATA_FOLDER, "downloads.db")
+CLEAR_OUTPUT_MIN_AGE = 60  # Seconds; /clear-output leaves younger files, which may still be being written
+# Disk-space janitor: abandoned uploads and scratch files expire, outputs are evicted least recently used
+# first while uploads plus outputs exceed DISK_QUOTA, and encodes are refused when they would leave less
+# than DISK_MIN_FREE on the volume
+DISK_SWEEP_INTERVAL = 300  # Seconds between janitor sweeps
+DISK_QUOTA = int(os.environ.get("DISK_QUOTA", 0))  # Bytes; 0 = no quota
+DISK_MIN_FREE = int(os.environ.get("DISK_MIN_FREE", 1024 * 1024 * 1024))  # Bytes
+UPLOAD_TTL = int(os.environ.get("UPLOAD_TTL", 6 * 3600))  # Seconds an upload no job uses is kept
+# Intermediate files of encodes (segments, CRF samples); point at a tmpfs to keep them off the data volume
+SCRATCH_FOLDER = os.environ.get("SCRATCH_FOLDER") or os.path.join(DATA_FOLDER, "scratch")
+SCRATCH_TTL = 24 * 3600  # Seconds; older scratch entries were left by killed encodes
+# Internal nginx location serving OUTPUT_FOLDER; when set, nginx sends files itself (sendfile)
+DOWNLOAD_ACCEL_REDIRECT_PREFIX = os.environ.get("DOWNLOAD_ACCEL_REDIRECT_PREFIX", "")
@@ -0,0 +1,287 @@
+import os
+import time
+import uuid
+import shutil
+import sqlite3
+import asyncio
+import logging
+from email.utils import formatdate
+from starlette.responses import Response
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_CHUNK_SIZE = 1024 * 1024
+READER_STALE_SECONDS = 6 * 3600  # Longest download we expect; older reader entries are from dead processes
+
+
+def file_etag(stat):
+    """Strong validator from the file's mtime and size"""
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parse a single `bytes=` range into an inclusive (start, end).
+
+    Returns None when the header is absent, malformed or asks for several
+    ranges (the whole file is served then, which RFC 9110 allows), and raises
+    ValueError when the range cannot be satisfied.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    if not (start or end).isdigit() or (start and end and not end.isdigit()):
+        return None
+    if start == "":
+        # Suffix range: the last N bytes
+        length = int(end)
+        if length == 0 or size == 0:
+            raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+        return max(0, size - length), size - 1
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size or end < start:
+        raise ValueError(f"Range {header} not satisfiable for {size} bytes")
+    return start, min(end, size - 1)
+
+
+class ActiveReaders:
+    """
+    Files currently being streamed by any worker process, so cleanup never
+    deletes one mid-transfer. Kept in SQLite next to the download counts; an
+    entry older than stale_seconds is ignored, as its process died mid-download.
+    """
+
+    def __init__(self, db_path, stale_seconds=READER_STALE_SECONDS):
+        self.db_path = db_path
+        self.stale_seconds = stale_seconds
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS readers (token TEXT PRIMARY KEY, path TEXT NOT NULL, "
+                "started_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS readers_path ON readers (path)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def acquire(self, path):
+        """Register a reader of path; returns the token to release it with"""
+        token = uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute("INSERT INTO readers (token, path, started_at) VALUES (?, ?, ?)", (token, path, time.time()))
+        return token
+
+    def release(self, token):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM readers WHERE token = ?", (token,))
+
+    def is_reading(self, path):
+        """Whether path, or any file below it when it is a folder, is being streamed"""
+        prefix = os.path.join(path, "")
+        cutoff = time.time() - self.stale_seconds
+        with self._connect() as conn:
+            conn.execute("DELETE FROM readers WHERE started_at < ?", (cutoff,))
+            row = conn.execute(
+                "SELECT 1 FROM readers WHERE path = ? OR substr(path, 1, ?) = ? LIMIT 1",
+                (path, len(prefix), prefix)
+            ).fetchone()
+        return row is not None
+
+
+class RetentionStore:
+    """
+    Completed-download counts per output file, kept in SQLite so they survive
+    restarts. Outputs are deleted once they reach max_downloads completed
+    downloads or are older than ttl_seconds, instead of on the first GET.
+    """
+
+    def __init__(self, db_path, max_downloads, ttl_seconds, readers):
+        self.db_path = db_path
+        self.max_downloads = max_downloads
+        self.ttl_seconds = ttl_seconds
+        self.readers = readers
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS downloads (path TEXT PRIMARY KEY, count INTEGER NOT NULL, "
+                "last_download REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def record_download(self, path):
+        """Count one completed download; deletes the file once it reached max_downloads"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO downloads (path, count, last_download) VALUES (?, 1, ?) "
+                "ON CONFLICT(path) DO UPDATE SET count = count + 1, last_download = excluded.last_download",
+                (path, time.time())
+            )
+            count = conn.execute("SELECT count FROM downloads WHERE path = ?", (path,)).fetchone()[0]
+        if self.max_downloads and count >= self.max_downloads:
+            self.remove(path, f"reached {count} downloads")
+        return count
+
+    def downloads(self, path):
+        with self._connect() as conn:
+            row = conn.execute("SELECT count FROM downloads WHERE path = ?", (path,)).fetchone()
+        return row[0] if row else 0
+
+    def last_downloads(self):
+        """Time of the last completed download per path"""
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT path, last_download FROM downloads").fetchall())
+
+    def remove(self, path, reason):
+        """Delete an output unless a response is still streaming it"""
+        if self.readers.is_reading(path):
+            return False
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            logger.debug(f"Removed {path}: {reason}")
+        except FileNotFoundError:
+            pass
+        with self._connect() as conn:
+            conn.execute("DELETE FROM downloads WHERE path = ?", (path,))
+        return True
+
+    def sweep(self, folder, folder_prefix=None):
+        """
+        Delete outputs in folder past their TTL; returns how many were removed.
+
+        Subfolders are only considered when their name starts with
+        folder_prefix (e.g. rendition ladders); others, like the result cache,
+        are left alone.
+        """
+        removed = 0
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(folder):
+            if entry.is_dir() and not (folder_prefix and entry.name.startswith(folder_prefix)):
+                continue
+            if entry.stat().st_mtime < cutoff:
+                removed += self.remove(entry.path, "TTL expired")
+        return removed
+
+
+class RangeFileResponse(Response):
+    """
+    File response with Range/206, ETag/If-None-Match and zero-copy delivery.
+
+    The body goes out through the server's `http.response.zerocopy` ASGI
+    extension (kernel sendfile) when the server offers it, or by letting a
+    fronting nginx send the file itself via X-Accel-Redirect when
+    accel_redirect_prefix is set; otherwise it is read in chunks. on_complete
+    runs after a response that completed a download of the file (never with
+    X-Accel-Redirect, as nginx does not report when it finished).
+    """
+
+    def __init__(self, path, media_type, filename, request_headers, readers=None, on_complete=None,
+                 accel_redirect_prefix=None):
+        super().__init__(media_type=media_type)
+        self.path = path
+        self.filename = filename
+        self.request_headers = request_headers
+        self.readers = readers
+        self.on_complete = on_complete
+        self.accel_redirect_prefix = accel_redirect_prefix
+
+    async def __call__(self, scope, receive, send):
+        await self._respond(scope, receive, send)
+        if self.background is not None:
+            await self.background()
+
+    async def _respond(self, scope, receive, send):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            response = Response("File not found", status_code=404)
+            return await response(scope, receive, send)
+
+        size = stat.st_size
+        etag = file_etag(stat)
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": formatdate(stat.st_mtime, usegmt=True),
+            "content-type": self.media_type,
+        }
+        if self.filename:
+            headers["content-disposition"] = f'attachment; filename="{self.filename}"'
+
+        if_none_match = self.request_headers.get("if-none-match")
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            return await self._send_headers(send, 304, {"etag": etag})
+
+        if self.accel_redirect_prefix:
+            # nginx answers Range/conditional requests itself and sends the file with sendfile. It
+            # reports nothing back, so the download is not counted: counting now could delete the
+            # file before nginx has read it. Such outputs are only removed by the TTL sweep.
+            headers["x-accel-redirect"] = f"{self.accel_redirect_prefix.rstrip('/')}/{os.path.basename(self.path)}"
+            return await self._send_headers(send, 200, headers)
+
+        status, start, end = 200, 0, size - 1
+        # If-Range: only honour the Range when the client's copy is still current
+        if_range = self.request_headers.get("if-range")
+        if not if_range or if_range == etag:
+            try:
+                byte_range = parse_range(self.request_headers.get("range"), size)
+            except ValueError:
+                return await self._send_headers(send, 416, {"content-range": f"bytes */{size}"})
+            if byte_range is not None:
+                status, (start, end) = 206, byte_range
+                headers["content-range"] = f"bytes {start}-{end}/{size}"
+        length = max(0, end - start + 1)
+        headers["content-length"] = str(length)
+
+        if scope["method"] == "HEAD":
+            return await self._send_headers(send, status, headers)
+
+        token = None
+        if self.readers is not None:
+            token = await asyncio.to_thread(self.readers.acquire, self.path)
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+            })
+            with open(self.path, "rb") as f:
+                if "http.response.zerocopy" in scope.get("extensions", {}):
+                    await send({"type": "http.response.zerocopy", "file": f.fileno(), "offset": start,
+                                "count": length, "more_body": False})
+                else:
+                    f.seek(start)
+                    remaining = length
+                    while remaining > 0:
+                        chunk = await asyncio.to_thread(f.read, min(DELIVERY_CHUNK_SIZE, remaining))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                        await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                    if remaining:
+                        # The file shrank underneath us; end the body rather than hang
+                        await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            if token is not None:
+                await asyncio.to_thread(self.readers.release, token)
+
+        # Reaching this point means every byte was handed to the server without a disconnect.
+        # A range counts only as the end of a resumed download (If-Range), not a player seeking.
+        if self.on_complete is not None and end == size - 1 and (status == 200 or if_range):
+            await asyncio.to_thread(self.on_complete, self.path)
+
+    async def _send_headers(self, send, status, headers):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(k.encode(), v.encode()) for k, v in headers.items()],
+        })
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
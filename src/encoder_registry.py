@@ -0,0 +1,130 @@
+import os
+import subprocess
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Capabilities keyed by (ffmpeg path, ffmpeg version)
+_capabilities = {}
+# Version lookups keyed by (ffmpeg path, mtime, size) so a replaced binary is re-probed
+_versions = {}
+_lock = threading.Lock()
+
+
+def _run(command):
+    """Run a probe command and return its stdout ('' on failure)"""
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=30)
+        return result.stdout if result.returncode == 0 else ""
+    except (FileNotFoundError, subprocess.TimeoutExpired, OSError):
+        return ""
+
+
+def _parse_table(output, flag_width):
+    """
+    Parse the name column of an `ffmpeg -encoders/-pix_fmts/-filters` listing.
+
+    Every listing has a legend, then rows of `<flags> <name> ...`. The legend ends
+    at the '---' separator for encoders and pix_fmts; filters have no separator so
+    rows are recognised by their flag column instead.
+    """
+    names = set()
+    lines = output.splitlines()
+    if any(line.strip().startswith("---") for line in lines):
+        start = next(i for i, line in enumerate(lines) if line.strip().startswith("---")) + 1
+        lines = lines[start:]
+    for line in lines:
+        parts = line.split()
+        if len(parts) < 2 or len(parts[0]) != flag_width or parts[1] == "=":
+            continue
+        names.add(parts[1])
+    return names
+
+
+def _ffmpeg_version(ffmpeg_path):
+    try:
+        stat = os.stat(ffmpeg_path)
+    except OSError:
+        return None
+    key = (ffmpeg_path, stat.st_mtime, stat.st_size)
+    version = _versions.get(key)
+    if version is None:
+        first_line = _run([ffmpeg_path, "-hide_banner", "-version"]).split("\n", 1)[0]
+        # "ffmpeg version 6.1.1-3ubuntu5 Copyright ..." -> "6.1.1-3ubuntu5"
+        parts = first_line.split()
+        version = parts[2] if len(parts) > 2 else "unknown"
+        _versions[key] = version
+    return version
+
+
+def _has_nvidia_gpu():
+    try:
+        return subprocess.run(['nvidia-smi'], capture_output=True, text=True).returncode == 0
+    except FileNotFoundError:
+        return False
+
+
+def probe(ffmpeg_path):
+    """Run ffmpeg once and record which encoders, pixel formats and filters it supports"""
+    version = _ffmpeg_version(ffmpeg_path)
+    encoders = _parse_table(_run([ffmpeg_path, "-hide_banner", "-encoders"]), 6)
+    pix_fmts = _parse_table(_run([ffmpeg_path, "-hide_banner", "-pix_fmts"]), 5)
+    filters = _parse_table(_run([ffmpeg_path, "-hide_banner", "-filters"]), 3)
+    has_gpu = 'h264_nvenc' in encoders and _has_nvidia_gpu()
+
+    capabilities = {
+        'ffmpeg_path': ffmpeg_path,
+        'version': version,
+        'encoders': encoders,
+        'pix_fmts': pix_fmts,
+        'filters': filters,
+        'has_gpu': has_gpu,
+        'probed_at': time.time(),
+    }
+    logger.info(
+        f"Probed FFmpeg {version} at {ffmpeg_path}: {len(encoders)} encoders, "
+        f"{len(pix_fmts)} pixel formats, {len(filters)} filters, GPU encoding: {has_gpu}"
+    )
+    return capabilities
+
+
+def get_capabilities(ffmpeg_path, refresh=False):
+    """Return cached capabilities for an FFmpeg binary, probing it on first use"""
+    with _lock:
+        key = (ffmpeg_path, _ffmpeg_version(ffmpeg_path))
+        if refresh or key not in _capabilities:
+            _capabilities[key] = probe(ffmpeg_path)
+        return _capabilities[key]
+
+
+def reprobe(ffmpeg_path):
+    """Drop everything cached for an FFmpeg binary and probe it again"""
+    with _lock:
+        for key in [k for k in _capabilities if k[0] == ffmpeg_path]:
+            del _capabilities[key]
+        for key in [k for k in _versions if k[0] == ffmpeg_path]:
+            del _versions[key]
+    return get_capabilities(ffmpeg_path)
+
+
+def has_encoder(ffmpeg_path, name):
+    return name in get_capabilities(ffmpeg_path)['encoders']
+
+
+def has_filter(ffmpeg_path, name):
+    return name in get_capabilities(ffmpeg_path)['filters']
+
+
+def summarize(capabilities):
+    """JSON-friendly view of a capabilities record"""
+    return {
+        'ffmpeg_path': capabilities['ffmpeg_path'],
+        'version': capabilities['version'],
+        'has_gpu': capabilities['has_gpu'],
+        'probed_at': capabilities['probed_at'],
+        'encoders': sorted(capabilities['encoders']),
+        'pix_fmts': sorted(capabilities['pix_fmts']),
+        'filters': sorted(capabilities['filters']),
+    }
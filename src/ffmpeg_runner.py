@@ -0,0 +1,100 @@
+import os
+import subprocess
+import threading
+import logging
+from collections import deque
+from .config import FFMPEG_STDERR_TAIL_LINES
+
+logger = logging.getLogger(__name__)
+
+
+def parse_progress(block, duration=None):
+    """Turn one block of FFmpeg `-progress` key=value output into a progress dict"""
+    out_time_us = block.get('out_time_us') or block.get('out_time_ms')  # Both are microseconds
+    try:
+        out_seconds = max(0.0, int(out_time_us) / 1_000_000) if out_time_us not in (None, 'N/A') else None
+    except ValueError:
+        out_seconds = None
+    speed = block.get('speed', '').rstrip('x').strip()
+    progress = {
+        'frame': int(block['frame']) if block.get('frame', '').isdigit() else None,
+        'fps': float(block['fps']) if block.get('fps') not in (None, 'N/A') else None,
+        'speed': float(speed) if speed and speed != 'N/A' else None,
+        'out_time': block.get('out_time'),
+        'out_seconds': out_seconds,
+        'percent': None,
+        'state': 'finished' if block.get('progress') == 'end' else 'encoding',
+    }
+    if duration and out_seconds is not None:
+        progress['percent'] = round(min(100.0, out_seconds * 100 / duration), 1)
+    if progress['state'] == 'finished':
+        progress['percent'] = 100.0
+    return progress
+
+
+def run_ffmpeg(ffmpeg_command, duration=None, on_progress=None, usage=None):
+    """
+    Run FFmpeg with machine-readable progress on stdout.
+
+    Progress blocks are parsed as they arrive and passed to on_progress; only
+    the last FFMPEG_STDERR_TAIL_LINES lines of stderr are kept. Raises
+    CalledProcessError (with the stderr tail) if FFmpeg fails. If a usage dict
+    is given, the process's user+system CPU seconds are added to
+    usage['cpu_seconds'] (POSIX only).
+    """
+    command = [ffmpeg_command[0], "-progress", "pipe:1", "-nostats", *ffmpeg_command[1:]]
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    stderr_tail = deque(maxlen=FFMPEG_STDERR_TAIL_LINES)
+    stderr_reader = threading.Thread(target=stderr_tail.extend, args=(process.stderr,), daemon=True)
+    stderr_reader.start()
+
+    block = {}
+    for line in process.stdout:
+        key, _, value = line.strip().partition("=")
+        if not key:
+            continue
+        block[key] = value.strip()
+        if key == "progress":
+            if on_progress is not None:
+                try:
+                    on_progress(parse_progress(block, duration))
+                except Exception as e:
+                    logger.error(f"Progress callback failed: {e}")
+            block = {}
+
+    if usage is not None and hasattr(os, "wait4"):
+        # Reap the process ourselves to get its own resource usage, not that of all children
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        usage['cpu_seconds'] = usage.get('cpu_seconds', 0.0) + rusage.ru_utime + rusage.ru_stime
+    returncode = process.wait()
+    stderr_reader.join()
+    stderr = "".join(stderr_tail)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+    return stderr
+
+
+def thread_args(threads):
+    """FFmpeg options that keep filtering and encoding within a thread budget (output side)"""
+    if not threads:
+        return []
+    return [
+        "-filter_threads", str(threads), "-filter_complex_threads", str(threads), "-threads", str(threads)
+    ]
+
+
+def decoder_thread_args(threads):
+    """
+    Input options that keep decoding within a thread budget: -threads before
+    an -i applies to that input's decoder, which otherwise uses every core
+    """
+    if not threads:
+        return []
+    return ["-threads", str(threads)]
@@ -0,0 +1,508 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import logging
+from .config import JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, JOB_MAX_ATTEMPTS
+from .video_processor import compress_video, compress_ladder
+from .preview import make_preview, preview_dir
+from .metrics import observe_compression
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+# Preview states (besides RUNNING and FAILED)
+PENDING = "pending"
+READY = "ready"
+
+PROGRESS_WRITE_INTERVAL = 1.0  # Seconds between progress writes to the store per job
+
+
+class JobStore:
+    """
+    Persists job state in SQLite and doubles as the work queue.
+
+    The database runs in WAL mode so every web worker process (and every
+    container sharing the data volume) can enqueue, claim, heartbeat and read
+    jobs concurrently. A claimed job carries a lease; if its worker stops
+    renewing it, another worker claims the job again once the lease expires.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            # Persistent: readers no longer block the writer and vice versa, across processes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    input_path TEXT NOT NULL,
+                    output_path TEXT NOT NULL,
+                    batch_id TEXT,
+                    options TEXT,
+                    error TEXT,
+                    report TEXT,
+                    progress TEXT,
+                    preview TEXT,
+                    preview_state TEXT,
+                    preview_worker TEXT,
+                    preview_lease_until REAL,
+                    preview_attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    lease_until REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            # Databases created by older versions lack the later columns
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]
+            for name, definition in (
+                ('batch_id', "TEXT"),
+                ('options', "TEXT"),
+                ('progress', "TEXT"),
+                ('preview', "TEXT"),
+                ('preview_state', "TEXT"),
+                ('preview_worker', "TEXT"),
+                ('preview_lease_until', "REAL"),
+                ('preview_attempts', "INTEGER NOT NULL DEFAULT 0"),
+                ('worker_id', "TEXT"),
+                ('lease_until', "REAL"),
+                ('attempts', "INTEGER NOT NULL DEFAULT 0"),
+            ):
+                if name not in columns:
+                    conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {definition}")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs (batch_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_preview_state ON jobs (preview_state, created_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL; fsyncs on checkpoint only
+        return conn
+
+    def create(self, filename, input_path, output_path, job_id=None, batch_id=None, options=None, preview=False):
+        """
+        Store a queued job; options are extra compress_video keyword arguments
+        (e.g. target_size). preview also queues its preview.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, filename, input_path, output_path, batch_id, options, "
+                "preview_state, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, input_path, output_path, batch_id,
+                 json.dumps(options) if options else None, PENDING if preview else None, now, now)
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        for name in ('report', 'progress'):
+            if name in fields and fields[name] is not None:
+                fields[name] = json.dumps(fields[name])
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def claim(self, worker_id, lease_seconds, max_attempts):
+        """
+        Atomically take the next runnable job for worker_id, or None.
+
+        Runnable means queued, or running under an expired lease (its worker
+        died). Jobs are taken fairly across owners (a batch, or a single job):
+        the owner with the fewest running jobs goes first, then the oldest
+        job. Jobs whose lease expired max_attempts times are failed instead.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            try:
+                # Take the write lock up front so two workers cannot claim the same row
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "UPDATE jobs SET status = ?, error = ?, worker_id = NULL, lease_until = NULL, updated_at = ? "
+                    "WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                    (FAILED, f"Worker lost {max_attempts} times while running this job", now,
+                     RUNNING, now, max_attempts)
+                )
+                row = conn.execute(
+                    """
+                    SELECT * FROM jobs AS j
+                    WHERE j.status = ? OR (j.status = ? AND j.lease_until < ?)
+                    ORDER BY (
+                        SELECT COUNT(*) FROM jobs AS r
+                        WHERE r.status = ? AND COALESCE(r.batch_id, r.id) = COALESCE(j.batch_id, j.id)
+                    ), j.created_at
+                    LIMIT 1
+                    """,
+                    (QUEUED, RUNNING, now, RUNNING)
+                ).fetchone()
+                if row is None:
+                    conn.execute("COMMIT")
+                    return None
+                if row['status'] == RUNNING:
+                    logger.warning(f"Job {row['id']} lease of {row['worker_id']} expired; reclaiming")
+                conn.execute(
+                    "UPDATE jobs SET status = ?, worker_id = ?, lease_until = ?, attempts = attempts + 1, "
+                    "updated_at = ? WHERE id = ?",
+                    (RUNNING, worker_id, now + lease_seconds, now, row['id'])
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        job = self._to_dict(row)
+        job.update(status=RUNNING, worker_id=worker_id)
+        return job
+
+    def heartbeat(self, worker_id, job_ids, lease_seconds):
+        """Extend worker_id's leases on job_ids; returns the IDs whose lease it no longer holds"""
+        if not job_ids:
+            return set()
+        now = time.time()
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET lease_until = ? WHERE worker_id = ? AND status = ? AND id IN ({placeholders})",
+                (now + lease_seconds, worker_id, RUNNING, *job_ids)
+            )
+            held = {row[0] for row in conn.execute(
+                f"SELECT id FROM jobs WHERE worker_id = ? AND status = ? AND id IN ({placeholders})",
+                (worker_id, RUNNING, *job_ids)
+            )}
+        return set(job_ids) - held
+
+    def complete(self, job_id, worker_id, **fields):
+        """Record a job's final state if worker_id still holds it; returns whether it did"""
+        if 'report' in fields and fields['report'] is not None:
+            fields['report'] = json.dumps(fields['report'])
+        fields.update(worker_id=None, lease_until=None, updated_at=time.time())
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ? AND worker_id = ? AND status = ?",
+                (*fields.values(), job_id, worker_id, RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def claim_preview(self, worker_id, lease_seconds, max_attempts):
+        """
+        Atomically take the oldest pending preview for worker_id, or None.
+
+        Previews carry a lease of their own, independent of the encode's:
+        one whose worker stopped renewing it is pending again once the lease
+        expires, and failed after max_attempts such losses.
+        """
+        now = time.time()
+        with self._lock:
+            conn = self._connect()
+            conn.row_factory = sqlite3.Row
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "UPDATE jobs SET preview_state = ?, preview = ?, preview_worker = NULL, "
+                    "preview_lease_until = NULL WHERE preview_state = ? AND preview_lease_until < ? "
+                    "AND preview_attempts >= ?",
+                    (FAILED, json.dumps({'error': f"Worker lost {max_attempts} times while making the preview"}),
+                     RUNNING, now, max_attempts)
+                )
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE preview_state = ? OR (preview_state = ? AND preview_lease_until < ?) "
+                    "ORDER BY created_at LIMIT 1",
+                    (PENDING, RUNNING, now)
+                ).fetchone()
+                if row is not None:
+                    conn.execute(
+                        "UPDATE jobs SET preview_state = ?, preview_worker = ?, preview_lease_until = ?, "
+                        "preview_attempts = preview_attempts + 1 WHERE id = ?",
+                        (RUNNING, worker_id, now + lease_seconds, row['id'])
+                    )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            finally:
+                conn.close()
+        return self._to_dict(row) if row is not None else None
+
+    def heartbeat_previews(self, worker_id, job_ids, lease_seconds):
+        """Extend worker_id's preview leases on job_ids"""
+        if not job_ids:
+            return
+        placeholders = ", ".join("?" for _ in job_ids)
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET preview_lease_until = ? WHERE preview_worker = ? AND preview_state = ? "
+                f"AND id IN ({placeholders})",
+                (time.time() + lease_seconds, worker_id, RUNNING, *job_ids)
+            )
+
+    def complete_preview(self, job_id, worker_id, state, preview):
+        """Record a preview's final state if worker_id still holds it; returns whether it did"""
+        with self._lock, self._connect() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET preview_state = ?, preview = ?, preview_worker = NULL, preview_lease_until = NULL "
+                "WHERE id = ? AND preview_worker = ? AND preview_state = ?",
+                (state, json.dumps(preview), job_id, worker_id, RUNNING)
+            )
+        return cursor.rowcount == 1
+
+    def get(self, job_id):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_by_status(self, *statuses):
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                f"SELECT * FROM jobs WHERE status IN ({placeholders}) ORDER BY created_at", statuses
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def count_by_status(self, *statuses):
+        placeholders = ", ".join("?" for _ in statuses)
+        with self._connect() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM jobs WHERE status IN ({placeholders})", statuses).fetchone()[0]
+
+    def list_by_batch(self, batch_id):
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(
+                "SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at", (batch_id,)
+            ).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def active_paths(self):
+        """
+        Input and output paths of queued and running jobs, and inputs of
+        unfinished previews, which must not be deleted
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT input_path, output_path FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+            ).fetchall()
+            previews = conn.execute(
+                "SELECT input_path FROM jobs WHERE preview_state IN (?, ?)", (PENDING, RUNNING)
+            ).fetchall()
+        return {path for row in rows + previews for path in row}
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job['report'] = json.loads(job['report']) if job['report'] else None
+        job['options'] = json.loads(job['options']) if job['options'] else {}
+        job['progress'] = json.loads(job['progress']) if job['progress'] else None
+        # The preview's state lives in its own column so it can be claimed; details in the JSON
+        details = json.loads(job['preview']) if job['preview'] else {}
+        job['preview'] = {'state': job['preview_state'], **details} if job['preview_state'] else None
+        return job
+
+
+class JobManager:
+    """
+    Claims jobs from a shared JobStore and runs them on this process's EncodeScheduler.
+
+    Every web worker process runs one JobManager. A dispatcher thread claims
+    jobs only while the local scheduler has a free slot, so work spreads over
+    all processes and containers sharing the database instead of queueing in
+    one of them, and a heartbeat thread renews the leases of running jobs.
+
+    Previews are claimed the same way onto preview_scheduler, a small lane of
+    its own, so they never wait behind a full-length encode.
+    """
+
+    def __init__(self, store, scheduler, ffmpeg_path, cache=None, progress=None, worker_id=None,
+                 lease_seconds=JOB_LEASE_SECONDS, poll_interval=JOB_POLL_INTERVAL, max_attempts=JOB_MAX_ATTEMPTS,
+                 preview_scheduler=None, preview_folder=None):
+        self.store = store
+        self.scheduler = scheduler
+        self.ffmpeg_path = ffmpeg_path
+        self.cache = cache
+        self.progress = progress
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.preview_scheduler = preview_scheduler
+        self.preview_folder = preview_folder
+        self._held = set()
+        self._held_previews = set()
+        self._held_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def submit(self, job_id=None, owner=None):
+        """
+        Signal that a job was stored and return immediately.
+
+        Jobs are not handed to the scheduler directly: the dispatcher of
+        whichever worker has a free slot first claims them from the store.
+        """
+        self._wake.set()
+
+    def _run_preview(self, job_id, threads=None):
+        job = self.store.get(job_id)
+        if job is None:
+            return
+        try:
+            success, result = make_preview(
+                job['input_path'], preview_dir(self.preview_folder, job_id), self.ffmpeg_path, threads=threads
+            )
+        except Exception as e:
+            logger.exception(f"Preview of job {job_id} crashed")
+            success, result = False, str(e)
+        try:
+            if success:
+                finished = self.store.complete_preview(job_id, self.worker_id, READY, result)
+            else:
+                finished = self.store.complete_preview(job_id, self.worker_id, FAILED, {'error': result})
+            if not finished:
+                logger.warning(f"Preview of job {job_id} finished here after its lease moved to another worker")
+            else:
+                self._remove_input(job_id)
+        finally:
+            with self._held_lock:
+                self._held_previews.discard(job_id)
+            self._wake.set()
+
+    def _remove_input(self, job_id):
+        """Delete a job's input once neither its encode nor its preview needs it"""
+        job = self.store.get(job_id)
+        if job is None or job['status'] not in (DONE, FAILED) or job['preview_state'] in (PENDING, RUNNING):
+            return
+        try:
+            os.remove(job['input_path'])
+        except FileNotFoundError:
+            pass
+
+    def start(self):
+        """Start claiming jobs, including any left behind by a crashed or restarted worker"""
+        self._threads = [
+            threading.Thread(target=self._dispatch, name="job-dispatcher", daemon=True),
+            threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"Job worker {self.worker_id} started")
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+
+    def _has_free_slot(self, scheduler):
+        return scheduler.active + scheduler.queued < scheduler.slots
+
+    def _dispatch(self):
+        while not self._stopped.is_set():
+            try:
+                while self._has_free_slot(self.scheduler) and not self._stopped.is_set():
+                    job = self.store.claim(self.worker_id, self.lease_seconds, self.max_attempts)
+                    if job is None:
+                        break
+                    with self._held_lock:
+                        self._held.add(job['id'])
+                    # Jobs of one batch share a fair-queue owner so a batch cannot starve other uploads
+                    self.scheduler.submit(job['batch_id'] or job['id'], self._run, job['id'])
+                while (self.preview_scheduler is not None and self._has_free_slot(self.preview_scheduler)
+                       and not self._stopped.is_set()):
+                    job = self.store.claim_preview(self.worker_id, self.lease_seconds, self.max_attempts)
+                    if job is None:
+                        break
+                    with self._held_lock:
+                        self._held_previews.add(job['id'])
+                    self.preview_scheduler.submit(job['id'], self._run_preview, job['id'])
+            except Exception as e:
+                logger.error(f"Claiming jobs failed: {e}")
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _heartbeat(self):
+        while not self._stopped.wait(self.lease_seconds / 3):
+            with self._held_lock:
+                held = list(self._held)
+                previews = list(self._held_previews)
+            try:
+                lost = self.store.heartbeat(self.worker_id, held, self.lease_seconds)
+                self.store.heartbeat_previews(self.worker_id, previews, self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Job heartbeat failed: {e}")
+                continue
+            for job_id in lost:
+                logger.warning(f"Lost the lease on job {job_id}; another worker may run it")
+
+    def _publisher(self, job_id):
+        """on_progress callback: every update to the local hub, about once a second to the store"""
+        last_write = 0.0
+
+        def publish(progress):
+            nonlocal last_write
+            if self.progress is not None:
+                self.progress.publish(job_id, progress)
+            now = time.monotonic()
+            if now - last_write >= PROGRESS_WRITE_INTERVAL or progress.get('state') == 'finished':
+                last_write = now
+                # Other worker processes serve this job's progress from the store
+                self.store.update(job_id, progress=progress)
+        return publish
+
+    def _run(self, job_id, threads=None):
+        job = self.store.get(job_id)
+        if job is None:
+            logger.error(f"Job {job_id} disappeared before it could run")
+            return
+        report = {}
+        finished = False
+        try:
+            options = dict(job['options'])
+            args = (job['input_path'], job['output_path'], self.ffmpeg_path)
+            if options.pop('ladder', False):
+                # output_path is a folder holding every rendition
+                success, result = compress_ladder(
+                    args, report=report, threads=threads, on_progress=self._publisher(job_id), **options
+                )
+            else:
+                success, result = compress_video(
+                    args, cache=self.cache, report=report, threads=threads, on_progress=self._publisher(job_id),
+                    **options
+                )
+            observe_compression(report, success)
+            if success:
+                finished = self.store.complete(job_id, self.worker_id, status=DONE, report=report)
+            else:
+                finished = self.store.complete(job_id, self.worker_id, status=FAILED, error=result, report=report)
+            if not finished:
+                logger.warning(f"Job {job_id} finished here after its lease moved to another worker")
+        except Exception as e:
+            logger.exception(f"Job {job_id} crashed")
+            finished = self.store.complete(job_id, self.worker_id, status=FAILED, error=str(e))
+        finally:
+            with self._held_lock:
+                self._held.discard(job_id)
+            # The input stays while another worker or the preview might still need it
+            if finished:
+                self._remove_input(job_id)
+            if self.progress is not None:
+                self.progress.forget_stale()
+            self._wake.set()
@@ -0,0 +1,201 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import logging
+from .config import (
+    AUDIO_BITRATE, LADDER_RENDITIONS, LADDER_SEGMENT_SECONDS, LADDER_KEYFRAME_SECONDS, TARGET_MUX_OVERHEAD
+)
+from .ffmpeg_runner import run_ffmpeg, thread_args, decoder_thread_args
+from .probe import parse_bitrate
+
+logger = logging.getLogger(__name__)
+
+PACKAGINGS = (None, "hls", "dash")
+
+
+def select_renditions(renditions, source_height):
+    """
+    The renditions worth encoding for a source: none taller than the source
+    (upscaling only wastes bits), but always at least the smallest one.
+    """
+    ordered = sorted(renditions, key=lambda r: r['height'], reverse=True)
+    if not source_height:
+        return ordered
+    fitting = [r for r in ordered if r['height'] <= source_height]
+    return fitting or ordered[-1:]
+
+
+def projected_size(renditions, duration, has_audio):
+    """Bytes a ladder of duration seconds is expected to take: every rendition at its maxrate, plus audio"""
+    bits = sum(parse_bitrate(r['bitrate']) * 1.07 for r in renditions)
+    if has_audio:
+        # Packaged ladders share one audio track; separate MP4s carry one each
+        bits += AUDIO_BITRATE * len(renditions)
+    return int(bits * duration / 8 * (1 + TARGET_MUX_OVERHEAD))
+
+
+def _rendition_video_args(rendition, index, codec):
+    """Per-output-stream encoder options for rendition number index"""
+    bitrate = parse_bitrate(rendition['bitrate'])
+    return [
+        f"-c:v:{index}", codec,
+        f"-preset:v:{index}", rendition.get('preset', 'medium'),
+        f"-b:v:{index}", str(bitrate),
+        f"-maxrate:v:{index}", str(int(bitrate * 1.07)),
+        f"-bufsize:v:{index}", str(int(bitrate * 1.5)),
+    ]
+
+
+def _audio_args():
+    return ["-c:a", "aac", "-b:a", f"{AUDIO_BITRATE // 1000}k", "-ac", "2", "-ar", "44100"]
+
+
+def build_ladder_command(input_path, output_dir, ffmpeg_path, renditions, has_audio, packaging=None,
+                         codec="libx264", threads=None):
+    """
+    One FFmpeg command that decodes the source once and encodes every rendition.
+
+    The decoded video is fanned out with `split` to one scaler and encoder per
+    rendition. Keyframes are forced on the same timestamps in every rendition
+    so players can switch between them at any segment boundary. Without
+    packaging each rendition becomes its own MP4; with "hls" or "dash" they are
+    segmented with a master playlist/manifest and a single shared audio track.
+    Returns (command, outputs) where outputs maps rendition names (and
+    "master") to paths relative to output_dir.
+    """
+    count = len(renditions)
+    graph = [f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))]
+    for i, rendition in enumerate(renditions):
+        graph.append(f"[v{i}]scale=-2:{rendition['height']}[v{i}out]")
+    command = [
+        ffmpeg_path, "-y",
+        *decoder_thread_args(threads),
+        "-i", input_path,
+        "-filter_complex", ";".join(graph),
+    ]
+    keyframes = ["-force_key_frames", f"expr:gte(t,n_forced*{LADDER_KEYFRAME_SECONDS})", "-sc_threshold", "0"]
+    outputs = {}
+
+    if packaging is None:
+        for i, rendition in enumerate(renditions):
+            name = f"{rendition['name']}.mp4"
+            outputs[rendition['name']] = name
+            command += [
+                "-map", f"[v{i}out]",
+                *(["-map", "0:a:0"] if has_audio else []),
+                *_rendition_video_args(rendition, 0, codec),
+                *keyframes,
+                *(_audio_args() if has_audio else []),
+                *thread_args(threads),
+                "-movflags", "+faststart",
+                os.path.join(output_dir, name),
+            ]
+        return command, outputs
+
+    for i in range(count):
+        command += ["-map", f"[v{i}out]"]
+    if has_audio:
+        command += ["-map", "0:a:0"]
+    for i, rendition in enumerate(renditions):
+        command += _rendition_video_args(rendition, i, codec)
+    command += [*keyframes, *(_audio_args() if has_audio else []), *thread_args(threads)]
+
+    if packaging == "hls":
+        # Every variant references the one audio rendition through an audio group
+        stream_map = [f"v:{i},agroup:audio,name:{r['name']}" if has_audio else f"v:{i},name:{r['name']}"
+                      for i, r in enumerate(renditions)]
+        if has_audio:
+            stream_map.append("a:0,agroup:audio,name:audio")
+        command += [
+            "-f", "hls",
+            "-hls_time", str(LADDER_SEGMENT_SECONDS),
+            "-hls_playlist_type", "vod",
+            "-hls_segment_type", "fmp4",
+            "-hls_segment_filename", os.path.join(output_dir, "%v", "segment_%05d.m4s"),
+            "-master_pl_name", "master.m3u8",
+            "-var_stream_map", " ".join(stream_map),
+            os.path.join(output_dir, "%v", "index.m3u8"),
+        ]
+        outputs = {r['name']: f"{r['name']}/index.m3u8" for r in renditions}
+        outputs['master'] = "master.m3u8"
+    elif packaging == "dash":
+        command += [
+            "-f", "dash",
+            "-seg_duration", str(LADDER_SEGMENT_SECONDS),
+            "-use_template", "1", "-use_timeline", "1",
+            "-adaptation_sets", "id=0,streams=v id=1,streams=a" if has_audio else "id=0,streams=v",
+            os.path.join(output_dir, "manifest.mpd"),
+        ]
+        outputs = {'master': "manifest.mpd"}
+    else:
+        raise ValueError(f"Unknown packaging {packaging!r}; use one of {PACKAGINGS}")
+    return command, outputs
+
+
+def encode_ladder(input_path, output_dir, ffmpeg_path, renditions, has_audio, packaging=None, codec="libx264",
+                  threads=None, duration=None, on_progress=None, report=None):
+    """
+    Encode a rendition ladder into output_dir with one FFmpeg process.
+
+    Fills report with the renditions, outputs, wall time and the CPU seconds
+    FFmpeg used. Raises CalledProcessError on failure.
+    """
+    report = {} if report is None else report
+    os.makedirs(output_dir, exist_ok=True)
+    if packaging == "hls":
+        for name in [r['name'] for r in renditions] + (["audio"] if has_audio else []):
+            os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+    command, outputs = build_ladder_command(
+        input_path, output_dir, ffmpeg_path, renditions, has_audio, packaging, codec, threads
+    )
+    usage = {}
+    started = time.time()
+    run_ffmpeg(command, duration, on_progress, usage=usage)
+    report['renditions'] = [r['name'] for r in renditions]
+    report['packaging'] = packaging
+    report['outputs'] = outputs
+    report['encode_seconds'] = round(time.time() - started, 3)
+    report['cpu_seconds'] = round(usage['cpu_seconds'], 3) if 'cpu_seconds' in usage else None
+    return outputs
+
+
+def encode_separately(input_path, output_dir, ffmpeg_path, renditions, has_audio, codec="libx264", threads=None):
+    """The same renditions as plain MP4s, one FFmpeg process each; for comparison"""
+    usage = {}
+    started = time.time()
+    for rendition in renditions:
+        command, _ = build_ladder_command(
+            input_path, output_dir, ffmpeg_path, [rendition], has_audio, None, codec, threads
+        )
+        run_ffmpeg(command, usage=usage)
+    return round(time.time() - started, 3), round(usage.get('cpu_seconds', 0.0), 3)
+
+
+if __name__ == "__main__":
+    # Compare one ladder process against one process per rendition:
+    #   python -m src.ladder input.mp4
+    from .config import get_ffmpeg_path
+    from .probe import probe_input
+
+    logging.basicConfig(level=logging.INFO)
+    source = sys.argv[1]
+    ffmpeg = get_ffmpeg_path()
+    media = probe_input(ffmpeg, source)
+    renditions = select_renditions(LADDER_RENDITIONS, media['video']['height'] if media and media['video'] else None)
+    has_audio = bool(media and media['audio'])
+    out_dir = tempfile.mkdtemp(prefix="ladder_compare_")
+    try:
+        ladder_report = {}
+        encode_ladder(source, os.path.join(out_dir, "ladder"), ffmpeg, renditions, has_audio, report=ladder_report)
+        os.makedirs(os.path.join(out_dir, "separate"))
+        separate_wall, separate_cpu = encode_separately(
+            source, os.path.join(out_dir, "separate"), ffmpeg, renditions, has_audio
+        )
+        names = ", ".join(ladder_report['renditions'])
+        print(f"one process ({names}): {ladder_report['encode_seconds']}s wall, "
+              f"{ladder_report['cpu_seconds']}s CPU")
+        print(f"{len(renditions)} separate processes: {separate_wall}s wall, {separate_cpu}s CPU")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
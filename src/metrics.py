@@ -0,0 +1,147 @@
+import os
+import logging
+from prometheus_client import (
+    Histogram, Gauge, Counter, CollectorRegistry, REGISTRY, generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+from .profiles import default_profile_stats
+
+logger = logging.getLogger(__name__)
+
+# With several worker processes every one writes its metrics to files in PROMETHEUS_MULTIPROC_DIR and
+# /metrics aggregates them (prometheus_client multiprocess mode); without it each process reports its own
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+_SECONDS_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+
+UPLOAD_SECONDS = Histogram(
+    "video_upload_seconds", "Time to receive an upload's request body, from its first to its last chunk",
+    buckets=_SECONDS_BUCKETS
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "video_queue_wait_seconds", "Time an encode waited for a scheduler slot",
+    buckets=_SECONDS_BUCKETS
+)
+FFMPEG_SECONDS = Histogram(
+    "video_ffmpeg_seconds", "FFmpeg wall time per compression",
+    ["encoder", "preset", "outcome"], buckets=_SECONDS_BUCKETS
+)
+FFMPEG_SPEED = Histogram(
+    "video_ffmpeg_speed_factor", "Seconds of video processed per second of FFmpeg wall time",
+    ["encoder", "preset", "outcome"], buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+)
+SIZE_RATIO = Histogram(
+    "video_output_size_ratio", "Output size divided by input size",
+    ["encoder", "preset", "outcome"], buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9, 1.0, 1.5)
+)
+DOWNLOAD_SECONDS = Histogram(
+    "video_download_seconds", "Time to send a compressed file to the client",
+    buckets=_SECONDS_BUCKETS
+)
+COMPRESSIONS = Counter(
+    "video_compressions_total", "Finished compressions",
+    ["encoder", "preset", "outcome"]
+)
+# Summed over the live worker processes
+ACTIVE_ENCODES = Gauge("video_active_encodes", "Encodes currently running", multiprocess_mode="livesum")
+SCHEDULER_QUEUED = Gauge(
+    "video_scheduler_queued", "Encodes waiting in the workers' schedulers (synchronous uploads, previews)",
+    multiprocess_mode="livesum"
+)
+
+
+def folder_size(folder):
+    total = 0
+    for directory, _, files in os.walk(folder):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, name))
+            except OSError:
+                pass  # Deleted while walking
+    return total
+
+
+class SharedStateCollector:
+    """
+    Gauges read at scrape time from state all workers share, so they are
+    reported once rather than summed per process: jobs queued in the job
+    store and the bytes in the output folder.
+    """
+
+    def __init__(self, output_folder, stored_jobs=None):
+        self.output_folder = output_folder
+        self.stored_jobs = stored_jobs
+
+    def collect(self):
+        # Jobs wait in the store, not in a scheduler, until a worker has a free slot
+        yield GaugeMetricFamily(
+            "video_queued_jobs", "Jobs waiting in the job store for a scheduler slot",
+            value=self.stored_jobs() if self.stored_jobs else 0
+        )
+        yield GaugeMetricFamily(
+            "video_output_disk_bytes", "Bytes used by files in OUTPUT_FOLDER", value=folder_size(self.output_folder)
+        )
+
+
+_shared_state = None
+
+
+def track_scheduler(scheduler, output_folder, stored_jobs=None):
+    """
+    Keep the encode gauges in step with the scheduler, and report the job
+    store's queue (stored_jobs returns its length) and the output folder
+    size at scrape time.
+    """
+    global _shared_state
+
+    def update(active, queued):
+        ACTIVE_ENCODES.set(active)
+        SCHEDULER_QUEUED.set(queued)
+
+    scheduler.on_load = update
+    _shared_state = SharedStateCollector(output_folder, stored_jobs)
+    if not MULTIPROCESS:
+        REGISTRY.register(_shared_state)
+
+
+def render_metrics():
+    """The exposition text: every worker's metrics in multiprocess mode, else this process's"""
+    if not MULTIPROCESS:
+        return generate_latest()
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    if _shared_state is not None:
+        registry.register(_shared_state)
+    return generate_latest(registry)
+
+
+def mark_process_dead():
+    """Drop this process's live gauges from the aggregate when it exits"""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+def observe_compression(report, success):
+    """Record a finished compress_video call from its report"""
+    encoder = report.get('encoder', 'unknown')
+    preset = report.get('preset', 'unknown')
+    if not success:
+        outcome = 'failed'
+    elif report.get('cache') == 'hit':
+        outcome = 'cache_hit'
+    else:
+        outcome = report.get('path', 'encode')
+    labels = (encoder, preset, outcome)
+    COMPRESSIONS.labels(*labels).inc()
+
+    seconds = report.get('encode_seconds')
+    if seconds is not None:
+        FFMPEG_SECONDS.labels(*labels).observe(seconds)
+        if report.get('duration') and seconds > 0:
+            FFMPEG_SPEED.labels(*labels).observe(report['duration'] / seconds)
+    if report.get('input_size') and report.get('output_size') is not None:
+        SIZE_RATIO.labels(*labels).observe(report['output_size'] / report['input_size'])
+    try:
+        default_profile_stats().record(report, success)
+    except Exception as e:
+        logger.error(f"Failed to record profile stats: {e}")
@@ -0,0 +1,227 @@
+import queue
+import struct
+import asyncio
+import subprocess
+import threading
+import logging
+from collections import deque
+from starlette.requests import ClientDisconnect
+from starlette.responses import Response
+from .config import FFMPEG_STDERR_TAIL_LINES, STREAM_CHUNK_SIZE
+from .ffmpeg_runner import thread_args, decoder_thread_args
+from .video_processor import video_encode_args, audio_encode_args
+
+logger = logging.getLogger(__name__)
+
+# ISO BMFF (MP4/MOV/3GP) top-level boxes that may precede the moov/mdat decision
+_SKIPPABLE_BOXES = {b"ftyp", b"free", b"skip", b"wide", b"uuid", b"pdin", b"styp", b"sidx"}
+
+
+def sniff_streamability(head):
+    """
+    Decide from the first bytes of an upload whether FFmpeg can read it from a pipe.
+
+    MP4-family files are only readable front to back when the moov atom comes
+    before the media data (faststart) or the file is fragmented; a moov after
+    mdat needs seeking to the end. Other containers (Matroska/WebM, MPEG-TS,
+    FLV, ...) are demuxed sequentially. Returns True or False, or None while
+    more bytes are needed.
+    """
+    if len(head) < 8:
+        return None
+    if head[4:8] not in _SKIPPABLE_BOXES | {b"moov", b"mdat", b"moof"}:
+        return True  # Not ISO BMFF
+    offset = 0
+    while offset + 8 <= len(head):
+        size, box_type = struct.unpack(">I4s", head[offset:offset + 8])
+        if box_type in (b"moov", b"moof"):
+            return True
+        if box_type == b"mdat":
+            return False
+        if box_type not in _SKIPPABLE_BOXES:
+            return False  # Unknown layout; let FFmpeg seek in a file
+        if size == 1:  # 64-bit size follows the type
+            if offset + 16 > len(head):
+                return None
+            size = struct.unpack(">Q", head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False  # size 0 means "to end of file", i.e. no moov ahead
+        offset += size
+    return None
+
+
+def build_stream_command(ffmpeg_path, encode_settings, threads=None):
+    """FFmpeg command reading the upload from stdin and writing fragmented MP4 to stdout"""
+    video_args = video_encode_args(encode_settings)
+    # +faststart rewrites the finished file, which a pipe cannot do; fragments need no moov at the end
+    for i, arg in enumerate(video_args):
+        if arg == "-movflags":
+            del video_args[i:i + 2]
+            break
+    return [
+        ffmpeg_path,
+        "-hide_banner",
+        *decoder_thread_args(threads),
+        "-i", "pipe:0",
+        *video_args,
+        *audio_encode_args(),
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        *thread_args(threads),
+        "-movflags", "frag_keyframe+empty_moov+default_base_moof",
+        "-f", "mp4",
+        "pipe:1"
+    ]
+
+
+class PipeEncode:
+    """
+    One FFmpeg process fed from and drained to bounded queues.
+
+    The request handler puts body chunks on `input` (None ends the input) and
+    takes output chunks from `output` (None ends the output); run() executes on
+    a scheduler slot so streamed encodes share the same concurrency limit as
+    file encodes. Both queues are bounded, so a slow uploader or a slow
+    downloader stalls FFmpeg instead of buffering the video in memory.
+    """
+
+    def __init__(self, ffmpeg_path, encode_settings, queue_chunks=8):
+        self.ffmpeg_path = ffmpeg_path
+        self.encode_settings = encode_settings
+        self.input = queue.Queue(maxsize=queue_chunks)
+        self.output = queue.Queue(maxsize=queue_chunks)
+        self.process = None
+        self.stderr = ""
+        self._cancelled = threading.Event()
+        self._input_closed = threading.Event()
+
+    def put_input(self, chunk):
+        """Blocking put of one body chunk (None ends the input); False once FFmpeg stopped reading"""
+        while not self._input_closed.is_set() and not self._cancelled.is_set():
+            try:
+                self.input.put(chunk, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _feed(self, stdin):
+        try:
+            while not self._cancelled.is_set() and self.process.poll() is None:
+                try:
+                    chunk = self.input.get(timeout=1)
+                except queue.Empty:
+                    continue
+                if chunk is None:
+                    break
+                stdin.write(chunk)
+        except (BrokenPipeError, OSError):
+            pass  # FFmpeg exited early; its exit status says why
+        finally:
+            self._input_closed.set()
+            try:
+                stdin.close()
+            except OSError:
+                pass
+
+    def get_output(self):
+        """Blocking get of one output chunk; None at the end of the output or after cancel()"""
+        while not self._cancelled.is_set():
+            try:
+                return self.output.get(timeout=1)
+            except queue.Empty:
+                continue
+        return None
+
+    def _put_output(self, chunk):
+        while not self._cancelled.is_set():
+            try:
+                self.output.put(chunk, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def run(self, threads=None):
+        """Run FFmpeg until the input ends; returns (success, stderr tail or error)"""
+        if self._cancelled.is_set():
+            return False, "Cancelled before the encode started"
+        command = build_stream_command(self.ffmpeg_path, self.encode_settings, threads)
+        self.process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stderr_tail = deque(maxlen=FFMPEG_STDERR_TAIL_LINES)
+        stderr_reader = threading.Thread(
+            target=lambda: stderr_tail.extend(line.decode(errors="replace") for line in self.process.stderr),
+            daemon=True
+        )
+        feeder = threading.Thread(target=self._feed, args=(self.process.stdin,), daemon=True)
+        stderr_reader.start()
+        feeder.start()
+        try:
+            while True:
+                chunk = self.process.stdout.read1(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                self._put_output(chunk)
+            returncode = self.process.wait()
+        finally:
+            if self.process.poll() is None:
+                self.process.kill()
+                self.process.wait()
+            feeder.join()
+            stderr_reader.join()
+            self.stderr = "".join(stderr_tail)
+            self._put_output(None)
+        if returncode != 0 and not self._cancelled.is_set():
+            logger.error(f"Streamed encode failed with {returncode}: {self.stderr[-2000:]}")
+            return False, f"FFmpeg exited with {returncode}: {self.stderr[-2000:]}"
+        return True, self.stderr
+
+    def cancel(self):
+        """Stop FFmpeg, e.g. after the client disconnected"""
+        self._cancelled.set()
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+
+
+class PipeEncodeResponse(Response):
+    """
+    Streams a PipeEncode's fragmented MP4 output as it is produced.
+
+    Unlike StreamingResponse this does not listen for http.disconnect while
+    sending, because the request body is still being received and fed to
+    FFmpeg at the same time; a disconnect shows up as a failed send instead.
+    If the encode fails after the first bytes went out, the connection is
+    aborted so the client sees a truncated response rather than a short file.
+    """
+
+    def __init__(self, encode, future, first_chunk, filename):
+        super().__init__(media_type="video/mp4")
+        self.encode = encode
+        self.future = future
+        self.first_chunk = first_chunk
+        self.filename = filename
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"video/mp4"),
+                    (b"content-disposition", f'attachment; filename="{self.filename}"'.encode()),
+                ],
+            })
+            chunk = self.first_chunk
+            while chunk is not None:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                chunk = await asyncio.to_thread(self.encode.get_output)
+        except (OSError, ClientDisconnect):
+            logger.info(f"Client went away during the streamed encode of {self.filename}")
+            self.encode.cancel()
+            return
+
+        success, result = await asyncio.wrap_future(self.future)
+        if not success:
+            raise RuntimeError(f"Streamed encode of {self.filename} failed: {result}")
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
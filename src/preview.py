@@ -0,0 +1,175 @@
+import os
+import re
+import math
+import time
+import shutil
+import subprocess
+import logging
+from .config import (
+    PREVIEW_SECONDS, PREVIEW_HEIGHT, PREVIEW_CRF, PREVIEW_THUMB_WIDTH, PREVIEW_THUMB_INTERVAL, PREVIEW_MAX_THUMBS,
+    PREVIEW_SPRITE_COLUMNS, PREVIEW_FOLDER_PREFIX
+)
+from .ffmpeg_runner import run_ffmpeg, thread_args, decoder_thread_args
+from .probe import probe_input
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_FILES = {'proxy': "preview.mp4", 'sprite': "sprite.jpg", 'thumbnails': "thumbnails.vtt"}
+THUMB_TIMES_FILE = "thumbs.txt"  # Timestamps of the sprite's frames, written by the metadata filter
+
+
+def preview_dir(output_folder, job_id):
+    """Folder holding job_id's preview files"""
+    return os.path.join(output_folder, f"{PREVIEW_FOLDER_PREFIX}{job_id}")
+
+
+def sprite_layout(duration, interval=PREVIEW_THUMB_INTERVAL, max_thumbs=PREVIEW_MAX_THUMBS,
+                  columns=PREVIEW_SPRITE_COLUMNS):
+    """
+    (interval, columns, rows) of a sprite sheet for duration seconds of video:
+    a thumbnail every interval seconds, spaced further apart when that many
+    would not fit in max_thumbs.
+    """
+    if not duration:
+        return interval, columns, math.ceil(max_thumbs / columns)
+    interval = max(interval, duration / max_thumbs)
+    count = max(1, min(max_thumbs, math.ceil(duration / interval)))
+    columns = min(columns, count)
+    return interval, columns, math.ceil(count / columns)
+
+
+def _even(value):
+    return max(2, int(value) // 2 * 2)
+
+
+def _filter_path(path):
+    """path as a filter option value (colons would end the option)"""
+    return path.replace("\\", "/").replace(":", r"\\:")
+
+
+def build_preview_command(input_path, output_dir, ffmpeg_path, media=None, threads=None):
+    """
+    One FFmpeg command producing the proxy and the thumbnail sprite.
+
+    The source is opened twice in the same process: once limited to the first
+    PREVIEW_SECONDS (-t stops reading there) for an ultrafast low-res proxy,
+    and once with -skip_frame nokey so only keyframes are decoded for the
+    sprite. select keeps a keyframe at most every interval seconds and the
+    metadata filter records the timestamp of each. Returns (command, layout)
+    where layout holds the sprite's interval, grid and thumbnail size.
+    """
+    video = media['video'] if media else None
+    interval, columns, rows = sprite_layout(media['duration'] if media else None)
+    thumb_width = PREVIEW_THUMB_WIDTH
+    thumb_height = _even(thumb_width * video['height'] / video['width']) if video and video.get('width') else 90
+    proxy_height = _even(min(PREVIEW_HEIGHT, video.get('height') or PREVIEW_HEIGHT)) if video else PREVIEW_HEIGHT
+    times_path = _filter_path(os.path.join(output_dir, THUMB_TIMES_FILE))
+
+    graph = [
+        f"[0:v]scale=-2:{proxy_height},format=yuv420p[proxy]",
+        f"[1:v]select='isnan(prev_selected_t)+gte(t-prev_selected_t\\,{interval:.3f})',"
+        f"metadata=mode=add:key=thumbnail:value=1,metadata=mode=print:file={times_path},"
+        f"scale={thumb_width}:{thumb_height},tile={columns}x{rows}[sprite]",
+    ]
+    command = [
+        ffmpeg_path, "-y",
+        "-t", str(PREVIEW_SECONDS), *decoder_thread_args(threads), "-i", input_path,
+        "-skip_frame", "nokey", *decoder_thread_args(threads), "-i", input_path,
+        "-filter_complex", ";".join(graph),
+        *thread_args(threads),
+        "-map", "[proxy]", "-map", "0:a:0?",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", str(PREVIEW_CRF),
+        "-c:a", "aac", "-b:a", "64k", "-ac", "2",
+        "-movflags", "+faststart",
+        os.path.join(output_dir, PREVIEW_FILES['proxy']),
+        "-map", "[sprite]", "-frames:v", "1", "-update", "1", "-q:v", "5",
+        os.path.join(output_dir, PREVIEW_FILES['sprite']),
+    ]
+    layout = {'interval': interval, 'columns': columns, 'rows': rows, 'width': thumb_width, 'height': thumb_height}
+    return command, layout
+
+
+def parse_thumbnail_times(path):
+    """pts_time of every frame the metadata filter printed to path"""
+    times = []
+    try:
+        with open(path) as f:
+            for line in f:
+                match = re.search(r"pts_time:(\S+)", line)
+                if match:
+                    try:
+                        times.append(float(match.group(1)))
+                    except ValueError:
+                        continue
+    except FileNotFoundError:
+        pass
+    return times
+
+
+def _vtt_time(seconds):
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def write_thumbnail_vtt(path, times, layout, duration=None, sprite=PREVIEW_FILES['sprite']):
+    """
+    WebVTT thumbnail track: one cue per thumbnail, pointing at its tile of
+    the sprite with a media fragment (sprite.jpg#xywh=x,y,w,h)
+    """
+    times = times[:layout['columns'] * layout['rows']]
+    lines = ["WEBVTT", ""]
+    for i, start in enumerate(times):
+        end = times[i + 1] if i + 1 < len(times) else max(duration or 0, start + layout['interval'])
+        x = i % layout['columns'] * layout['width']
+        y = i // layout['columns'] * layout['height']
+        lines += [
+            f"{_vtt_time(start)} --> {_vtt_time(end)}",
+            f"{sprite}#xywh={x},{y},{layout['width']},{layout['height']}",
+            "",
+        ]
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+    return len(times)
+
+
+def make_preview(input_path, output_dir, ffmpeg_path, threads=None):
+    """
+    Write the proxy, sprite and thumbnails.vtt of input_path to output_dir.
+
+    :return: (success, preview dict with files, thumbnail count and seconds taken, or error message)
+    """
+    if not os.path.isfile(input_path):
+        return False, "The input is no longer available"
+    started = time.time()
+    try:
+        media = probe_input(ffmpeg_path, input_path)
+        if media is not None and not media['video']:
+            return False, "Input has no video stream"
+        os.makedirs(output_dir, exist_ok=True)
+        command, layout = build_preview_command(input_path, output_dir, ffmpeg_path, media, threads)
+        run_ffmpeg(command)
+        times_path = os.path.join(output_dir, THUMB_TIMES_FILE)
+        thumbnails = write_thumbnail_vtt(
+            os.path.join(output_dir, PREVIEW_FILES['thumbnails']), parse_thumbnail_times(times_path), layout,
+            media['duration'] if media else None
+        )
+        if os.path.exists(times_path):
+            os.remove(times_path)
+        logger.info(f"Preview of {input_path} ready in {time.time() - started:.1f}s")
+        return True, {
+            'files': dict(PREVIEW_FILES),
+            'thumbnails': thumbnails,
+            'thumbnail_interval': round(layout['interval'], 3),
+            'seconds': round(time.time() - started, 3),
+        }
+    except subprocess.CalledProcessError as e:
+        error_msg = f"FFmpeg error: {e.stderr}"
+        logger.error(error_msg)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return False, error_msg
+    except Exception as e:
+        error_msg = f"Unexpected error: {str(e)}"
+        logger.error(error_msg)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return False, error_msg
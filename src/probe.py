@@ -0,0 +1,135 @@
+import json
+import subprocess
+import logging
+from .config import get_ffprobe_path, AUDIO_BITRATE
+
+logger = logging.getLogger(__name__)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _to_int(value):
+    number = _to_float(value)
+    return int(number) if number is not None else None
+
+
+def _frame_rate(value):
+    # ffprobe reports rates as fractions, e.g. "30000/1001"
+    try:
+        numerator, denominator = value.split("/")
+        return float(numerator) / float(denominator) if float(denominator) else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def probe_media(ffprobe_path, input_path):
+    """
+    Read container and stream information with ffprobe.
+
+    Returns a dict with duration (seconds), size, bit_rate, format_name and the
+    first video and audio streams (None when absent), or None if probing fails.
+    """
+    command = [
+        ffprobe_path, "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        input_path
+    ]
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=60, check=True)
+        data = json.loads(result.stdout)
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired, FileNotFoundError, ValueError) as e:
+        logger.warning(f"Could not probe {input_path}: {e}")
+        return None
+
+    fmt = data.get("format", {})
+    streams = data.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"
+                  and not s.get("disposition", {}).get("attached_pic")), None)
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), None)
+
+    info = {
+        'duration': _to_float(fmt.get("duration")),
+        'size': _to_int(fmt.get("size")),
+        'bit_rate': _to_int(fmt.get("bit_rate")),
+        'format_name': fmt.get("format_name"),
+        'video': None,
+        'audio': None,
+    }
+    if video:
+        info['video'] = {
+            'codec': video.get("codec_name"),
+            'width': video.get("width"),
+            'height': video.get("height"),
+            'pix_fmt': video.get("pix_fmt"),
+            'bit_rate': _to_int(video.get("bit_rate")),
+            'fps': _frame_rate(video.get("avg_frame_rate")),
+        }
+    if audio:
+        info['audio'] = {
+            'codec': audio.get("codec_name"),
+            'bit_rate': _to_int(audio.get("bit_rate")),
+            'channels': audio.get("channels"),
+            'sample_rate': _to_int(audio.get("sample_rate")),
+        }
+    return info
+
+
+def probe_input(ffmpeg_path, input_path):
+    """probe_media using the FFprobe next to ffmpeg_path; None if FFprobe is unavailable"""
+    try:
+        ffprobe_path = get_ffprobe_path(ffmpeg_path)
+    except FileNotFoundError as e:
+        logger.warning(str(e))
+        return None
+    return probe_media(ffprobe_path, input_path)
+
+
+def parse_bitrate(value):
+    """Parse an FFmpeg bitrate such as '1000k' or '2M' into bits/s"""
+    value = str(value).strip().lower()
+    multiplier = {'k': 1000, 'm': 1000 * 1000}.get(value[-1:], 1)
+    number = value[:-1] if multiplier != 1 else value
+    return int(float(number) * multiplier)
+
+
+# Codec (as ffprobe names it) each encoder produces
+ENCODER_CODECS = {'libx264': 'h264', 'h264_nvenc': 'h264', 'libx265': 'hevc', 'libsvtav1': 'av1'}
+
+
+def plan_compression(media, max_width, max_video_bitrate, codec='h264'):
+    """
+    Decide how much work an input needs from its probe results.
+
+    'remux'      - video already in codec within max_width and max_video_bitrate
+                   and AAC stereo audio at or below the target: copy both streams
+    'audio_only' - the video meets the target but the audio does not
+    'encode'     - everything else, including inputs that could not be probed
+    """
+    if not media or not media['video'] or codec is None:
+        return 'encode'
+    video = media['video']
+    # Fall back to the container bitrate when the stream does not report one
+    video_bitrate = video['bit_rate'] or media['bit_rate']
+    video_ok = (
+        video['codec'] == codec
+        and video['pix_fmt'] in ('yuv420p', None)
+        and video['width'] is not None and video['width'] <= max_width
+        and max_video_bitrate is not None
+        and video_bitrate is not None and video_bitrate <= max_video_bitrate
+    )
+    if not video_ok:
+        return 'encode'
+
+    audio = media['audio']
+    audio_ok = audio is None or (
+        audio['codec'] == 'aac'
+        and (audio['channels'] or 0) <= 2
+        and audio['bit_rate'] is not None and audio['bit_rate'] <= AUDIO_BITRATE * 1.25
+    )
+    return 'remux' if audio_ok else 'audio_only'
@@ -0,0 +1,144 @@
+import os
+import time
+import sqlite3
+import logging
+from .config import ENCODING_PROFILES, DEFAULT_PROFILE, PROFILE_STATS_DB, PROFILE_STATS_WINDOW
+from .encoder_registry import get_capabilities
+
+logger = logging.getLogger(__name__)
+
+
+def available_profiles(ffmpeg_path):
+    """The ENCODING_PROFILES whose encoder this FFmpeg build has"""
+    encoders = get_capabilities(ffmpeg_path)['encoders']
+    return {name: profile for name, profile in ENCODING_PROFILES.items() if profile['codec'] in encoders}
+
+
+def resolve_profile(ffmpeg_path, name=None):
+    """The profile name to encode with (DEFAULT_PROFILE when None); raises ValueError if unavailable"""
+    name = name or DEFAULT_PROFILE
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown profile {name!r}; use one of {sorted(ENCODING_PROFILES)}")
+    if name not in available_profiles(ffmpeg_path):
+        raise ValueError(f"Profile {name!r} needs the {ENCODING_PROFILES[name]['codec']} encoder, "
+                         f"which this FFmpeg build lacks")
+    return name
+
+
+class ProfileStats:
+    """
+    Running totals of finished encodes per profile, kept in SQLite so every
+    worker process adds to the same numbers and they survive restarts.
+
+    Only real encodes count: remuxes and result cache hits say nothing about a
+    profile's speed or compression. The last window encodes of each profile
+    are also kept one by one for rolling rates (see recent_rates).
+    """
+
+    def __init__(self, db_path, window=PROFILE_STATS_WINDOW):
+        self.db_path = db_path
+        self.window = window
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS profile_stats (profile TEXT PRIMARY KEY, "
+                "encodes INTEGER NOT NULL DEFAULT 0, failures INTEGER NOT NULL DEFAULT 0, "
+                "encode_seconds REAL NOT NULL DEFAULT 0, media_seconds REAL NOT NULL DEFAULT 0, "
+                "input_bytes INTEGER NOT NULL DEFAULT 0, output_bytes INTEGER NOT NULL DEFAULT 0, "
+                "updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS profile_samples (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "profile TEXT NOT NULL, encode_seconds REAL NOT NULL, media_seconds REAL NOT NULL, "
+                "input_bytes INTEGER NOT NULL, finished_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS profile_samples_profile ON profile_samples (profile, id)")
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def record(self, report, success):
+        """Add one compress_video report"""
+        profile = report.get('profile')
+        if profile is None or report.get('cache') == 'hit' or report.get('path') not in ('encode', 'original'):
+            return
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO profile_stats (profile) VALUES (?)", (profile,))
+            if not success:
+                conn.execute(
+                    "UPDATE profile_stats SET failures = failures + 1, updated_at = ? WHERE profile = ?",
+                    (time.time(), profile)
+                )
+                return
+            conn.execute(
+                "UPDATE profile_stats SET encodes = encodes + 1, encode_seconds = encode_seconds + ?, "
+                "media_seconds = media_seconds + ?, input_bytes = input_bytes + ?, "
+                "output_bytes = output_bytes + ?, updated_at = ? WHERE profile = ?",
+                (report.get('encode_seconds') or 0, report.get('duration') or 0, report.get('input_size') or 0,
+                 report.get('output_size') or 0, time.time(), profile)
+            )
+            if report.get('encode_seconds') and report.get('input_size'):
+                conn.execute(
+                    "INSERT INTO profile_samples (profile, encode_seconds, media_seconds, input_bytes, finished_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (profile, report['encode_seconds'], report.get('duration') or 0, report['input_size'],
+                     time.time())
+                )
+                conn.execute(
+                    "DELETE FROM profile_samples WHERE profile = ? AND id <= (SELECT id FROM profile_samples "
+                    "WHERE profile = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (profile, profile, self.window)
+                )
+
+    def recent_rates(self):
+        """
+        Per profile over its last window encodes: encode seconds per input
+        byte, and speed (seconds of video per encode second; None if no
+        sample had a duration)
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT profile, SUM(encode_seconds), SUM(input_bytes), "
+                "SUM(CASE WHEN media_seconds > 0 THEN encode_seconds ELSE 0 END), SUM(media_seconds), COUNT(*) "
+                "FROM profile_samples GROUP BY profile"
+            ).fetchall()
+        rates = {}
+        for profile, seconds, size, timed_seconds, media_seconds, samples in rows:
+            rates[profile] = {
+                'seconds_per_byte': seconds / size,
+                'speed': media_seconds / timed_seconds if timed_seconds else None,
+                'samples': samples,
+            }
+        return rates
+
+    def summary(self):
+        """
+        Per profile: encode count, failures, speed (seconds of video per
+        second of encoding) and size ratio (output bytes over input bytes)
+        """
+        with self._connect() as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute("SELECT * FROM profile_stats ORDER BY profile").fetchall()
+        summary = {}
+        for row in rows:
+            summary[row['profile']] = {
+                'encodes': row['encodes'],
+                'failures': row['failures'],
+                'speed': round(row['media_seconds'] / row['encode_seconds'], 3) if row['encode_seconds'] else None,
+                'size_ratio': round(row['output_bytes'] / row['input_bytes'], 4) if row['input_bytes'] else None,
+                'mean_encode_seconds': round(row['encode_seconds'] / row['encodes'], 3) if row['encodes'] else None,
+                'updated_at': row['updated_at'],
+            }
+        return summary
+
+
+_default_stats = None
+
+
+def default_profile_stats():
+    """The ProfileStats in PROFILE_STATS_DB shared by all encodes of this process"""
+    global _default_stats
+    if _default_stats is None:
+        _default_stats = ProfileStats(PROFILE_STATS_DB)
+    return _default_stats
@@ -0,0 +1,63 @@
+import json
+import time
+import asyncio
+import threading
+
+
+class ProgressHub:
+    """
+    Latest encode progress per job, published from worker threads and read by
+    the event-stream endpoint. Only the most recent update is kept per job.
+    """
+
+    def __init__(self, retention_seconds=300):
+        self.retention_seconds = retention_seconds
+        self._lock = threading.Lock()
+        self._progress = {}  # job_id -> (version, progress dict, updated_at)
+
+    def publish(self, job_id, progress):
+        with self._lock:
+            version = self._progress.get(job_id, (0, None, 0))[0] + 1
+            self._progress[job_id] = (version, progress, time.time())
+
+    def get(self, job_id):
+        with self._lock:
+            entry = self._progress.get(job_id)
+        return entry[1] if entry else None
+
+    def _get_versioned(self, job_id):
+        with self._lock:
+            return self._progress.get(job_id, (0, None, 0))[:2]
+
+    def forget_stale(self):
+        """Drop progress of jobs that have not reported for retention_seconds"""
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            for job_id in [j for j, entry in self._progress.items() if entry[2] < cutoff]:
+                del self._progress[job_id]
+
+    async def events(self, job_id, is_finished, interval=0.5, fetch=None):
+        """
+        Yield Server-Sent Events for a job: a `progress` event for each new update,
+        then one `end` event once is_finished() returns a final status.
+
+        When the job runs in another process nothing is published here; fetch()
+        then supplies its latest progress (e.g. from the job store) instead.
+        """
+        last_version = 0
+        last_fetched = None
+        while True:
+            version, progress = self._get_versioned(job_id)
+            if version != last_version and progress is not None:
+                last_version = version
+                yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            elif version == 0 and fetch is not None:
+                progress = await asyncio.to_thread(fetch)
+                if progress is not None and progress != last_fetched:
+                    last_fetched = progress
+                    yield f"event: progress\ndata: {json.dumps(progress)}\n\n"
+            status = is_finished()
+            if status:
+                yield f"event: end\ndata: {json.dumps({'status': status})}\n\n"
+                return
+            await asyncio.sleep(interval)
@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import shutil
+import uuid
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+ORPHAN_MIN_AGE = 3600  # Seconds; younger unindexed files may be an entry another worker is storing
+
+
+def hash_file(path):
+    """SHA-256 of a file's content, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, ffmpeg_args):
+    """Key for an encode: the input content plus the effective FFmpeg arguments"""
+    digest = hashlib.sha256(content_hash.encode())
+    digest.update(json.dumps(ffmpeg_args).encode())
+    return digest.hexdigest()
+
+
+def link_or_copy(source, destination):
+    """Hard-link source to destination (same volume), falling back to a copy"""
+    if os.path.exists(destination):
+        os.remove(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+class ResultCache:
+    """
+    Content-addressed cache of compressed outputs.
+
+    Entries live in a folder inside OUTPUT_FOLDER so hits are hard-linked
+    straight into the output folder without copying. The cache is bounded by
+    max_bytes (least recently used entries go first) and entries older than
+    ttl_seconds are dropped. The index and the hit/miss counters are kept in
+    SQLite so every worker process shares them.
+    """
+
+    def __init__(self, folder, max_bytes, ttl_seconds):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.db_path = os.path.join(folder, "index.db")
+        os.makedirs(folder, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, last_access REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0, "
+                "encode_seconds REAL NOT NULL)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value REAL NOT NULL)")
+            self._import_json_index(conn)
+            self._remove_orphans(conn)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def _import_json_index(self, conn):
+        """Take over the entries of the index.json older versions kept"""
+        json_path = os.path.join(self.folder, "index.json")
+        try:
+            with open(json_path) as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        for key, entry in entries.items():
+            if os.path.exists(self._path(key)):
+                conn.execute(
+                    "INSERT OR IGNORE INTO entries (key, size, created_at, last_access, hits, encode_seconds) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, entry['size'], entry['created_at'], entry['last_access'], entry['hits'],
+                     entry['encode_seconds'])
+                )
+        os.remove(json_path)
+
+    def _remove_orphans(self, conn, min_age=ORPHAN_MIN_AGE):
+        """Delete cached files no entry points at, left by a crash between storing a file and its entry"""
+        known = {row[0] for row in conn.execute("SELECT key FROM entries")}
+        cutoff = time.time() - min_age
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith((".mp4", ".tmp")) or entry.name.split(".")[0] in known:
+                continue
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.mp4")
+
+    @staticmethod
+    def _count(conn, name, amount=1):
+        conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (name, amount)
+        )
+
+    def _remove(self, conn, key):
+        if conn.execute("DELETE FROM entries WHERE key = ?", (key,)).rowcount:
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            self._count(conn, 'evictions')
+
+    def _evict(self, conn):
+        cutoff = time.time() - self.ttl_seconds
+        for (key,) in conn.execute("SELECT key FROM entries WHERE created_at < ?", (cutoff,)).fetchall():
+            self._remove(conn, key)
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            total -= size
+            self._remove(conn, key)
+
+    def lookup(self, key, output_path):
+        """Serve a cached result to output_path; returns True on a hit"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT created_at, encode_seconds FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is not None and time.time() - row[0] > self.ttl_seconds:
+                self._remove(conn, key)
+                row = None
+            if row is not None:
+                try:
+                    link_or_copy(self._path(key), output_path)
+                except FileNotFoundError:
+                    # Evicted by another worker, or deleted behind the index's back; encode again
+                    logger.warning(f"Result cache entry {key} is missing; dropping it")
+                    conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    row = None
+            if row is None:
+                self._count(conn, 'misses')
+                return False
+            conn.execute(
+                "UPDATE entries SET last_access = ?, hits = hits + 1 WHERE key = ?", (time.time(), key)
+            )
+            self._count(conn, 'hits')
+            self._count(conn, 'saved_encode_seconds', row[1])
+        logger.info(f"Result cache hit for {output_path}")
+        return True
+
+    def store(self, key, output_path, encode_seconds):
+        """Add a freshly encoded output to the cache"""
+        size = os.path.getsize(output_path)
+        if size > self.max_bytes:
+            return
+        # Linked under a temporary name first: another worker may be serving the same key right now
+        tmp_path = f"{self._path(key)}.{uuid.uuid4().hex[:8]}.tmp"
+        link_or_copy(output_path, tmp_path)
+        os.replace(tmp_path, self._path(key))
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, created_at, last_access, hits, encode_seconds) "
+                "VALUES (?, ?, ?, ?, 0, ?)",
+                (key, size, now, now, encode_seconds)
+            )
+            self._evict(conn)
+
+    def stats(self):
+        with self._connect() as conn:
+            counters = dict(conn.execute("SELECT name, value FROM counters").fetchall())
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        hits = int(counters.get('hits', 0))
+        misses = int(counters.get('misses', 0))
+        lookups = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': int(counters.get('evictions', 0)),
+            'hit_ratio': round(hits / lookups, 3) if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'ttl_seconds': self.ttl_seconds,
+            'saved_encode_seconds': round(counters.get('saved_encode_seconds', 0.0), 3),
+        }
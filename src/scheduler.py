@@ -0,0 +1,241 @@
+import os
+import time
+import threading
+import logging
+from collections import deque, OrderedDict
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+_current = threading.local()
+
+
+def current_scheduler():
+    """The EncodeScheduler whose worker thread is running the caller, or None"""
+    return getattr(_current, 'scheduler', None)
+
+
+def _read_first_line(path):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def detect_cpu_limit():
+    """CPUs available to this process: the cgroup quota if one is set, else the affinity mask"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS/Windows
+        cpus = os.cpu_count() or 1
+
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    cpu_max = _read_first_line("/sys/fs/cgroup/cpu.max")
+    if cpu_max:
+        quota, _, period = cpu_max.partition(" ")
+        if quota != "max" and period:
+            return max(1, min(cpus, int(int(quota) / int(period))))
+        return cpus
+
+    # cgroup v1
+    quota = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")
+    period = _read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+    if quota and period and int(quota) > 0:
+        return max(1, min(cpus, int(int(quota) / int(period))))
+    return cpus
+
+
+def detect_memory_limit():
+    """Memory limit of this process's cgroup in bytes, or None when unlimited"""
+    limit = _read_first_line("/sys/fs/cgroup/memory.max")
+    if limit is None:
+        limit = _read_first_line("/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    if not limit or limit == "max":
+        return None
+    limit = int(limit)
+    # cgroup v1 reports "unlimited" as a huge page-aligned number
+    return None if limit >= 1 << 60 else limit
+
+
+def plan_concurrency(cpus, memory_bytes, memory_per_job, threads_per_job=0, slots=0, processes=1,
+                     reserved_threads=0):
+    """
+    Decide how many encodes run at once and how many threads each FFmpeg gets.
+
+    By default each encode gets two threads (x264 scales poorly per thread beyond
+    that on small boxes), and there are as many slots as fit in the CPU quota and
+    the memory limit, shared equally by the processes of the container.
+    reserved_threads are threads every process keeps for other FFmpeg work (the
+    preview lane); they come out of the CPU quota before it is divided into slots.
+    Explicit non-zero values override either choice.
+    """
+    if not threads_per_job:
+        threads_per_job = max(1, min(2, cpus))
+    if not slots:
+        slots = max(1, (cpus - reserved_threads * processes) // threads_per_job)
+        if memory_bytes:
+            slots = max(1, min(slots, memory_bytes // memory_per_job))
+        slots = max(1, slots // processes)
+    return slots, threads_per_job
+
+
+def plan_web_workers(requested, memory_per_job, threads_per_job=0, slots=0, reserved_threads=0):
+    """
+    Web worker processes for this container: requested, or one per CPU of the
+    cgroup quota when 0, but never more than the container's encode slots.
+    Every process gets at least one slot (plus its reserved_threads), so more
+    processes than fit would run more FFmpeg threads than the CPU quota and
+    memory limit allow.
+    """
+    cpus = detect_cpu_limit()
+    total, threads_per_job = plan_concurrency(cpus, detect_memory_limit(), memory_per_job, threads_per_job, slots)
+    if not slots:
+        total = min(total, max(1, cpus // (threads_per_job + reserved_threads)))
+    return max(1, min(requested or cpus, total))
+
+
+class EncodeScheduler:
+    """
+    Runs encode jobs on a fixed number of worker threads, queued fairly per owner.
+
+    Each owner (typically one HTTP request or one batch run) has its own queue and
+    workers take from the owners in round-robin order, so one large batch cannot
+    starve single uploads. Jobs are called with a `threads` keyword carrying the
+    FFmpeg thread budget of a slot. A running job can borrow idle slots for
+    extra FFmpeg processes (reserve/release); they count as active until
+    handed back.
+    """
+
+    def __init__(self, slots, threads_per_job, on_wait=None):
+        self.slots = slots
+        self.threads_per_job = threads_per_job
+        # Called with the seconds each job spent queued before a slot picked it up
+        self.on_wait = on_wait
+        # Called with (active, queued) whenever either changes, e.g. to update gauges
+        self.on_load = None
+        # Returns how much work waits outside this scheduler for its slots (e.g. the job store's queue)
+        self.backlog = None
+        self._queues = OrderedDict()
+        self._condition = threading.Condition()
+        self._active = 0
+        self._reserved = 0
+        self._shutdown = False
+        self._workers = [
+            threading.Thread(target=self._worker, name=f"encode-{i}", daemon=True) for i in range(slots)
+        ]
+        for worker in self._workers:
+            worker.start()
+        logger.info(f"Encode scheduler: {slots} slots x {threads_per_job} FFmpeg threads")
+
+    @classmethod
+    def from_environment(cls, memory_per_job, threads_per_job=0, slots=0, on_wait=None, processes=1,
+                         reserved_threads=0):
+        """
+        Size a scheduler from the cgroup CPU quota and memory limit, split over
+        processes, less reserved_threads per process (see plan_concurrency)
+        """
+        cpus = detect_cpu_limit()
+        memory = detect_memory_limit()
+        slots, threads_per_job = plan_concurrency(
+            cpus, memory, memory_per_job, threads_per_job, slots, processes, reserved_threads
+        )
+        logger.info(f"Detected {cpus} CPUs and memory limit {memory or 'unlimited'}")
+        return cls(slots, threads_per_job, on_wait)
+
+    def submit(self, owner, fn, *args, **kwargs):
+        """Queue fn(*args, threads=..., **kwargs) under owner and return a Future"""
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError("Scheduler is shut down")
+            self._queues.setdefault(owner, deque()).append((future, fn, args, kwargs, time.monotonic()))
+            self._report_load()
+            self._condition.notify()
+        return future
+
+    def _next_task(self):
+        # Take the head of the first owner's queue, then move that owner to the back
+        owner, queue = next(iter(self._queues.items()))
+        task = queue.popleft()
+        del self._queues[owner]
+        if queue:
+            self._queues[owner] = queue
+        return task
+
+    def _worker(self):
+        _current.scheduler = self
+        while True:
+            with self._condition:
+                while (not self._queues or self._active + self._reserved >= self.slots) and not self._shutdown:
+                    self._condition.wait()
+                if self._shutdown and not self._queues:
+                    return
+                future, fn, args, kwargs, queued_at = self._next_task()
+                self._active += 1
+                self._report_load()
+            if self.on_wait is not None:
+                self.on_wait(time.monotonic() - queued_at)
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, threads=self.threads_per_job, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._active -= 1
+                    self._report_load()
+
+    def reserve(self, wanted):
+        """
+        Borrow up to wanted idle slots for extra FFmpeg processes of the
+        calling job; returns how many were taken. Slots that queued jobs
+        are waiting for, here or in the backlog, are not idle. Hand them
+        back with release().
+        """
+        waiting = 0
+        if self.backlog is not None:
+            try:
+                waiting = self.backlog()
+            except Exception as e:
+                logger.error(f"Scheduler backlog callback failed: {e}")
+                return 0
+        with self._condition:
+            idle = self.slots - self._active - self._reserved - self.queued - waiting
+            taken = max(0, min(wanted, idle))
+            self._reserved += taken
+            self._report_load()
+            return taken
+
+    def release(self, count):
+        with self._condition:
+            self._reserved -= count
+            self._report_load()
+            self._condition.notify_all()
+
+    @property
+    def active(self):
+        """Running jobs plus borrowed slots"""
+        return self._active + self._reserved
+
+    @property
+    def queued(self):
+        with self._condition:
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _report_load(self):
+        # Called with the condition held (it is reentrant, so queued can take it again)
+        if self.on_load is not None:
+            try:
+                self.on_load(self.active, self.queued)
+            except Exception as e:
+                logger.error(f"Scheduler load callback failed: {e}")
+
+    def shutdown(self, wait=True):
+        with self._condition:
+            self._shutdown = True
+            self._condition.notify_all()
+        if wait:
+            for worker in self._workers:
+                worker.join()
@@ -0,0 +1,193 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+from collections import deque
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from .ffmpeg_runner import run_ffmpeg, thread_args, decoder_thread_args
+
+logger = logging.getLogger(__name__)
+
+
+def split_at_keyframes(ffmpeg_path, input_path, segment_dir, segment_seconds):
+    """
+    Split the first video stream into roughly segment_seconds long pieces.
+
+    The stream is copied, so cuts can only land on keyframes and every segment
+    starts with one. Audio is left out; it is encoded in one piece separately.
+    """
+    pattern = os.path.join(segment_dir, "source_%05d.mkv")
+    run_ffmpeg([
+        ffmpeg_path, "-y",
+        "-i", input_path,
+        "-map", "0:v:0",
+        "-c", "copy",
+        "-an",
+        "-f", "segment",
+        "-segment_time", str(segment_seconds),
+        "-reset_timestamps", "1",
+        pattern
+    ])
+    return sorted(
+        os.path.join(segment_dir, name) for name in os.listdir(segment_dir) if name.startswith("source_")
+    )
+
+
+def write_concat_list(list_path, paths):
+    """
+    Write a concat demuxer list of paths.
+
+    The demuxer resolves relative entries against the list's own folder, so
+    every entry is made absolute (scratch folders are usually relative).
+    """
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+
+def compress_segmented(input_path, output_path, ffmpeg_path, video_args, audio_args, has_audio,
+                       workers, threads=None, duration=None, on_progress=None, report=None,
+                       segment_seconds=60, scratch_dir=None, scheduler=None):
+    """
+    Encode a long video as keyframe-aligned segments in parallel FFmpeg processes.
+
+    Segments are encoded video-only with the same settings and joined losslessly
+    with the concat demuxer. The audio track is encoded once over its full length
+    alongside the segments and muxed in at the end, so there are no gaps or
+    priming samples at segment boundaries. Raises CalledProcessError on failure.
+
+    One worker runs on the caller's own slot. With a scheduler, the other
+    workers - up to workers in all - borrow an idle slot for each segment and
+    hand it back when the segment is done, so jobs queued meanwhile get the
+    slot at the next segment boundary; a worker that finds none idle stops.
+    """
+    if report is None:
+        report = {}
+    segment_dir = tempfile.mkdtemp(prefix="segments_", dir=scratch_dir)
+    try:
+        started = time.time()
+        sources = split_at_keyframes(ffmpeg_path, input_path, segment_dir, segment_seconds)
+        report['segments'] = len(sources)
+        report['segment_workers'] = workers
+        logger.info(f"Encoding {input_path} as {len(sources)} segments with {workers} workers")
+
+        # Combine per-segment progress into one figure for the whole video
+        done_seconds = {}
+        lock = threading.Lock()
+
+        def segment_progress(index):
+            def publish(progress):
+                with lock:
+                    done_seconds[index] = progress['out_seconds'] or 0.0
+                    total = sum(done_seconds.values())
+                combined = dict(progress, out_seconds=total, state='encoding')
+                combined['percent'] = round(min(100.0, total * 100 / duration), 1) if duration else None
+                on_progress(combined)
+            return publish if on_progress else None
+
+        def encode_segment(index, source):
+            encoded = os.path.join(segment_dir, f"encoded_{index:05d}.mp4")
+            run_ffmpeg([
+                ffmpeg_path, "-y",
+                *decoder_thread_args(threads),
+                "-i", source,
+                *video_args,
+                "-an",
+                *thread_args(threads),
+                encoded
+            ], on_progress=segment_progress(index))
+            return encoded
+
+        def encode_audio():
+            audio_path = os.path.join(segment_dir, "audio.m4a")
+            run_ffmpeg([
+                ffmpeg_path, "-y",
+                "-i", input_path,
+                "-map", "0:a:0",
+                "-vn",
+                *audio_args,
+                audio_path
+            ])
+            return audio_path
+
+        pending = deque(enumerate(sources))
+        encoded = [None] * len(sources)
+
+        def run_segments(borrowed):
+            while True:
+                if borrowed and scheduler is not None and not scheduler.reserve(1):
+                    return
+                try:
+                    with lock:
+                        if not pending:
+                            return
+                        index, source = pending.popleft()
+                    encoded[index] = encode_segment(index, source)
+                finally:
+                    if borrowed and scheduler is not None:
+                        scheduler.release(1)
+
+        with ThreadPoolExecutor(max_workers=workers + (1 if has_audio else 0)) as pool:
+            audio_future = pool.submit(encode_audio) if has_audio else None
+            worker_futures = [pool.submit(run_segments, i > 0) for i in range(min(workers, len(sources)))]
+            for future in worker_futures:
+                future.result()
+            audio_path = audio_future.result() if audio_future else None
+
+        list_path = os.path.join(segment_dir, "segments.txt")
+        write_concat_list(list_path, encoded)
+
+        run_ffmpeg([
+            ffmpeg_path, "-y",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            *(["-i", audio_path] if audio_path else []),
+            "-map", "0:v:0",
+            *(["-map", "1:a:0"] if audio_path else []),
+            "-c", "copy",
+            "-movflags", "+faststart",
+            output_path
+        ])
+        report['encode_seconds'] = round(time.time() - started, 3)
+        if on_progress:
+            on_progress({'frame': None, 'fps': None, 'speed': None, 'out_time': None,
+                         'out_seconds': duration, 'percent': 100.0, 'state': 'finished'})
+        return output_path
+    finally:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    # Compare single-process and segment-parallel latency on one file:
+    #   python -m src.segmented input.mp4
+    from .config import get_ffmpeg_path, SEGMENT_SECONDS
+    from .scheduler import detect_cpu_limit
+    from .video_processor import compress_video, get_encoding_settings, video_encode_args, audio_encode_args
+    from .probe import probe_input
+
+    logging.basicConfig(level=logging.INFO)
+    source = sys.argv[1]
+    ffmpeg = get_ffmpeg_path()
+    media = probe_input(ffmpeg, source)
+    out_dir = tempfile.mkdtemp(prefix="segment_compare_")
+    try:
+        single_report = {}
+        compress_video((source, os.path.join(out_dir, "single.mp4"), ffmpeg),
+                       report=single_report, segmented=False)
+        cpus = detect_cpu_limit()
+        segmented_report = {}
+        compress_segmented(
+            source, os.path.join(out_dir, "segmented.mp4"), ffmpeg,
+            video_encode_args(get_encoding_settings(ffmpeg)), audio_encode_args(),
+            bool(media and media['audio']), workers=max(1, cpus // 2), threads=2,
+            duration=media['duration'] if media else None, report=segmented_report,
+            segment_seconds=SEGMENT_SECONDS
+        )
+        print(f"single process: {single_report.get('encode_seconds')}s")
+        print(f"segmented ({segmented_report['segments']} segments, "
+              f"{segmented_report['segment_workers']} workers): {segmented_report['encode_seconds']}s")
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
@@ -0,0 +1,219 @@
+import os
+import time
+import shutil
+import asyncio
+import logging
+from starlette.responses import JSONResponse
+from .config import SCRATCH_FOLDER, DISK_MIN_FREE
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientSpace(Exception):
+    """Raised when the volume cannot hold the projected output of an encode"""
+
+
+def scratch_folder():
+    """SCRATCH_FOLDER, created if needed, for intermediate files of an encode"""
+    os.makedirs(SCRATCH_FOLDER, exist_ok=True)
+    return SCRATCH_FOLDER
+
+
+def entry_size(path, seen=None):
+    """
+    Bytes used by a file, or by all files below a folder.
+
+    Hard links (result cache hits) are counted once per inode across calls
+    sharing seen.
+    """
+    seen = set() if seen is None else seen
+    paths = [path] if not os.path.isdir(path) else (
+        os.path.join(directory, name) for directory, _, names in os.walk(path) for name in names
+    )
+    total = 0
+    for file_path in paths:
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            continue  # Deleted while walking
+        if (stat.st_dev, stat.st_ino) not in seen:
+            seen.add((stat.st_dev, stat.st_ino))
+            total += stat.st_size
+    return total
+
+
+def ensure_free_space(folder, needed, min_free=DISK_MIN_FREE):
+    """Raise InsufficientSpace unless folder's volume has needed bytes to spare above min_free"""
+    free = shutil.disk_usage(folder).free
+    if free - needed < min_free:
+        raise InsufficientSpace(
+            f"{needed // (1024 * 1024)}MB needed but only {max(free - min_free, 0) // (1024 * 1024)}MB "
+            f"free in {folder}"
+        )
+
+
+class DiskJanitor:
+    """
+    Keeps uploads, outputs and scratch files from filling the volume.
+
+    Each sweep deletes uploads and resumable upload sessions untouched for
+    upload_ttl, scratch entries older than scratch_ttl (left by killed
+    encodes), outputs past the retention TTL, and then evicts outputs least
+    recently used first (last download, else modification) while uploads and
+    outputs together exceed quota bytes. The result cache is bounded on its own
+    and not counted. Paths of queued or running jobs, files modified in the last
+    min_age seconds and files any process is still serving are never deleted.
+    """
+
+    def __init__(self, retention, upload_folder, output_folder, resumable_folder, scratch_folder, quota,
+                 upload_ttl, scratch_ttl, min_age, active_paths=None, folder_prefix=None):
+        self.retention = retention
+        self.upload_folder = upload_folder
+        self.output_folder = output_folder
+        self.resumable_folder = resumable_folder
+        self.scratch_folder = scratch_folder
+        self.quota = quota
+        self.upload_ttl = upload_ttl
+        self.scratch_ttl = scratch_ttl
+        self.min_age = min_age
+        self.active_paths = active_paths or set
+        self.folder_prefix = folder_prefix
+        os.makedirs(scratch_folder, exist_ok=True)
+
+    def _outputs(self):
+        """Output files and output folders (e.g. rendition ladders) the janitor manages"""
+        entries = []
+        for entry in os.scandir(self.output_folder):
+            if entry.name.startswith("."):  # The result cache
+                continue
+            if entry.is_dir() and not (self.folder_prefix and entry.name.startswith(self.folder_prefix)):
+                continue
+            entries.append(entry.path)
+        return entries
+
+    def _uploads(self):
+        return [entry.path for entry in os.scandir(self.upload_folder) if entry.is_file()]
+
+    def usage(self):
+        """Bytes used by uploads and outputs, resumable sessions included"""
+        seen = set()
+        paths = self._uploads() + self._outputs() + [self.resumable_folder]
+        return sum(entry_size(path, seen) for path in paths if os.path.exists(path))
+
+    def _remove_if_idle(self, path, cutoff, in_use):
+        """Delete path if it was last modified before cutoff and no job uses it"""
+        try:
+            if path in in_use or os.path.getmtime(path) > cutoff:
+                return False
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def sweep(self):
+        """One pass of every rule; returns counts of what was removed and the usage left"""
+        now = time.time()
+        in_use = self.active_paths()
+        removed = {'uploads': 0, 'scratch': 0, 'expired': 0, 'evicted': 0}
+
+        for path in self._uploads():
+            removed['uploads'] += self._remove_if_idle(path, now - self.upload_ttl, in_use)
+        if os.path.isdir(self.resumable_folder):
+            # Every PATCH appends to the session's .part; its .json goes with it
+            for entry in os.scandir(self.resumable_folder):
+                if not entry.name.endswith(".part"):
+                    continue
+                if self._remove_if_idle(entry.path, now - self.upload_ttl, in_use):
+                    removed['uploads'] += 1
+                    meta_path = entry.path[:-len(".part")] + ".json"
+                    if os.path.exists(meta_path):
+                        os.remove(meta_path)
+        for entry in os.scandir(self.scratch_folder):
+            removed['scratch'] += self._remove_if_idle(entry.path, now - self.scratch_ttl, in_use)
+
+        removed['expired'] = self.retention.sweep(self.output_folder, self.folder_prefix)
+        removed['evicted'] = self.evict(self.quota, in_use) if self.quota else 0
+        removed['usage'] = self.usage()
+        return removed
+
+    def evict(self, limit, in_use=None, needed=0):
+        """
+        Delete outputs, least recently used first, until usage plus needed
+        bytes fits in limit; returns how many were removed.
+        """
+        in_use = self.active_paths() if in_use is None else in_use
+        usage = self.usage()
+        if usage + needed <= limit:
+            return 0
+        last_downloads = self.retention.last_downloads()
+        cutoff = time.time() - self.min_age
+        candidates = []
+        for path in self._outputs():
+            try:
+                mtime = os.path.getmtime(path)
+            except FileNotFoundError:
+                continue
+            if path in in_use or mtime > cutoff:
+                continue
+            candidates.append((max(mtime, last_downloads.get(path, 0)), path))
+
+        evicted = 0
+        for _, path in sorted(candidates):
+            if usage + needed <= limit:
+                break
+            size = entry_size(path)
+            if self.retention.remove(path, "disk quota"):
+                usage -= size
+                evicted += 1
+        if evicted:
+            logger.info(f"Evicted {evicted} outputs to stay within {limit // (1024 * 1024)}MB")
+        return evicted
+
+    def make_room(self, needed, min_free=DISK_MIN_FREE):
+        """
+        Check the output volume can take needed more bytes (within the quota
+        too), evicting least recently used outputs first if that helps.
+        Raises InsufficientSpace otherwise.
+        """
+        if self.quota:
+            self.evict(self.quota, needed=needed)
+            if self.usage() + needed > self.quota:
+                raise InsufficientSpace(f"{needed // (1024 * 1024)}MB would exceed the disk quota")
+        free = shutil.disk_usage(self.output_folder).free
+        if free - needed < min_free:
+            # Freeing the shortfall is the same as fitting in the current usage minus it
+            self.evict(self.usage() - (min_free + needed - free), needed=0)
+        ensure_free_space(self.output_folder, needed, min_free)
+
+
+class DiskSpaceMiddleware:
+    """
+    Refuse uploads the disk cannot take before their body is read.
+
+    A request announcing a Content-Length gets 507 when the janitor cannot
+    make room for that many bytes times the factor for its path (the upload
+    plus the output it will produce).
+    """
+
+    def __init__(self, app, janitor, factors):
+        self.app = app
+        self.janitor = janitor
+        self.factors = factors
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+        factor = next((f for prefix, f in self.factors.items() if scope["path"].startswith(prefix)), None)
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if factor is None or content_length is None or not content_length.isdigit():
+            return await self.app(scope, receive, send)
+        try:
+            await asyncio.to_thread(self.janitor.make_room, int(int(content_length) * factor))
+        except InsufficientSpace as e:
+            logger.warning(f"Refused {scope['path']}: {e}")
+            response = JSONResponse({"detail": f"Not enough disk space: {e}"}, status_code=507)
+            return await response(scope, receive, send)
+        await self.app(scope, receive, send)
@@ -0,0 +1,168 @@
+import os
+import time
+import hashlib
+import logging
+from .config import AUDIO_BITRATE, TARGET_MUX_OVERHEAD, TARGET_MIN_VIDEO_BITRATE, PASSLOG_FOLDER, PASSLOG_TTL
+from .ffmpeg_runner import run_ffmpeg, thread_args, decoder_thread_args
+
+logger = logging.getLogger(__name__)
+
+
+def video_bitrate_for_target(duration, target_size=None, target_bitrate=None, has_audio=True):
+    """
+    Video bitrate in bits/s that makes an encode of duration seconds hit a target.
+
+    target_size is the whole file in bytes: the container overhead
+    (TARGET_MUX_OVERHEAD) and the audio track (AUDIO_BITRATE) are taken out of
+    the budget first. target_bitrate is the total bits/s of video plus audio.
+    Raises ValueError when the target leaves less than TARGET_MIN_VIDEO_BITRATE
+    for the video.
+    """
+    if not duration:
+        raise ValueError("Target size/bitrate encoding needs a known duration")
+    audio = AUDIO_BITRATE if has_audio else 0
+    if target_size is not None:
+        total = target_size * 8 * (1 - TARGET_MUX_OVERHEAD) / duration
+    else:
+        total = target_bitrate
+    video = int(total - audio)
+    if video < TARGET_MIN_VIDEO_BITRATE:
+        raise ValueError(
+            f"Target leaves {max(video, 0) // 1000}k for {duration:.0f}s of video; "
+            f"at least {TARGET_MIN_VIDEO_BITRATE // 1000}k is needed"
+        )
+    return video
+
+
+def _without_options(args, *names):
+    """args with the named options and their values removed"""
+    kept = []
+    args = iter(args)
+    for arg in args:
+        if arg in names:
+            next(args, None)
+            continue
+        kept.append(arg)
+    return kept
+
+
+def rate_control_args(encode_settings, video_bitrate):
+    """
+    The encoder options with CRF/CQ rate control swapped for an average bitrate.
+
+    The bitrate cap allows short peaks above the average (1.5x) so two-pass
+    x264 can still move bits to complex scenes.
+    """
+    kept = _without_options(encode_settings['extra_params'], '-crf', '-cq', '-rc', '-b:v', '-maxrate', '-bufsize')
+    args = ['-b:v', str(video_bitrate), '-maxrate', str(int(video_bitrate * 1.5)),
+            '-bufsize', str(video_bitrate * 2)]
+    if 'nvenc' in encode_settings['codec']:
+        # NVENC does its two passes internally instead of through a stats file
+        args = ['-rc', 'vbr', '-multipass', 'fullres', *args]
+    return [*args, *kept]
+
+
+class PassLogStore:
+    """
+    First-pass analysis logs kept by content, so a retried or repeated
+    target encode of the same input skips straight to the second pass.
+
+    The x264 stats describe the source frames, not the bitrate, so one log is
+    reused across different targets for the same input and filter chain.
+    """
+
+    def __init__(self, folder, ttl_seconds):
+        self.folder = folder
+        self.ttl_seconds = ttl_seconds
+        os.makedirs(folder, exist_ok=True)
+
+    def prefix(self, content_hash, first_pass_args):
+        """-passlogfile prefix for this input and these analysis settings"""
+        key = hashlib.sha256(f"{content_hash}\0{chr(0).join(first_pass_args)}".encode()).hexdigest()
+        return os.path.join(self.folder, key)
+
+    @staticmethod
+    def is_complete(prefix):
+        # x264 writes <prefix>-0.log and, with mbtree (the default), <prefix>-0.log.mbtree
+        return os.path.isfile(f"{prefix}-0.log") and os.path.isfile(f"{prefix}-0.log.mbtree")
+
+    def prune(self):
+        """Remove logs not used within the TTL"""
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.folder):
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                try:
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+
+
+_default_store = None
+
+
+def default_passlog_store():
+    """The PassLogStore in PASSLOG_FOLDER shared by all encodes of this process"""
+    global _default_store
+    if _default_store is None:
+        _default_store = PassLogStore(PASSLOG_FOLDER, PASSLOG_TTL)
+    return _default_store
+
+
+def _pass_progress(on_progress, first):
+    """on_progress for one pass of a two-pass encode: each pass is reported as half of the job"""
+    if on_progress is None:
+        return None
+
+    def publish(progress):
+        if progress['percent'] is not None and (first or progress['state'] != 'finished'):
+            progress = {**progress, 'percent': round(progress['percent'] / 2 + (0 if first else 50), 1)}
+        if first:
+            # The analysis pass ending is not the job finishing
+            progress = {**progress, 'state': 'encoding'}
+        on_progress(progress)
+    return publish
+
+
+def two_pass_encode(input_path, output_path, ffmpeg_path, video_args, audio_args, passlogs, content_hash,
+                    threads=None, duration=None, on_progress=None, report=None):
+    """
+    Encode with x264 two-pass rate control, reusing a stored first pass.
+
+    video_args must already use bitrate rate control (see rate_control_args).
+    The first pass is analysis only (no audio, output discarded); its log is
+    kept in passlogs and reused when the same content is encoded again.
+    """
+    report = {} if report is None else report
+    # The first pass depends on the filter chain, codec and preset but not on the bitrate
+    prefix = passlogs.prefix(content_hash, _without_options(video_args, '-b:v', '-maxrate', '-bufsize'))
+
+    if passlogs.is_complete(prefix):
+        report['passlog'] = 'reused'
+        for suffix in ("-0.log", "-0.log.mbtree"):
+            os.utime(f"{prefix}{suffix}")
+    else:
+        report['passlog'] = 'new'
+        run_ffmpeg([
+            ffmpeg_path, "-y",
+            *decoder_thread_args(threads),
+            "-i", input_path,
+            *_without_options(video_args, '-movflags'),  # Muxer options mean nothing to the null muxer
+            "-pass", "1", "-passlogfile", prefix,
+            "-an",
+            *thread_args(threads),
+            "-f", "null", os.devnull
+        ], duration, _pass_progress(on_progress, first=True))
+
+    run_ffmpeg([
+        ffmpeg_path, "-y",
+        *decoder_thread_args(threads),
+        "-i", input_path,
+        *video_args,
+        "-pass", "2", "-passlogfile", prefix,
+        *audio_args,
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        *thread_args(threads),
+        output_path
+    ], duration, _pass_progress(on_progress, first=False) if report['passlog'] == 'new' else on_progress)
+    passlogs.prune()
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import logging
+import aiofiles
+from fastapi import HTTPException
+from starlette.requests import ClientDisconnect
+from starlette.responses import JSONResponse
+from .config import UPLOAD_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds the configured size limit"""
+
+
+async def save_upload_stream(upload_file, file_path, max_size):
+    """
+    Copy an UploadFile to disk chunk by chunk so memory use stays bounded.
+
+    The partial file is removed and UploadTooLarge raised as soon as more than
+    max_size bytes have been read. Returns the number of bytes written.
+    """
+    written = 0
+    try:
+        async with aiofiles.open(file_path, "wb") as out:
+            while True:
+                chunk = await upload_file.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_size:
+                    raise UploadTooLarge(
+                        f"{upload_file.filename} exceeds the {max_size // (1024 * 1024)}MB upload limit"
+                    )
+                await out.write(chunk)
+    except BaseException:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        raise
+    return written
+
+
+class BodyReader:
+    """
+    UploadFile-like reader over a raw request body whose first bytes were
+    already consumed (e.g. to sniff the container), for save_upload_stream.
+    """
+
+    def __init__(self, filename, head, chunks):
+        self.filename = filename
+        self._buffer = bytearray(head)
+        self._chunks = chunks
+
+    async def read(self, size):
+        while len(self._buffer) < size:
+            try:
+                self._buffer += await anext(self._chunks)
+            except StopAsyncIteration:
+                break
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class MaxBodySizeMiddleware:
+    """
+    Reject request bodies larger than a per-path limit before they are parsed.
+
+    Requests announcing a too-large Content-Length get 413 without any body being
+    read; chunked bodies are counted as they stream in and cut off at the limit.
+    on_body, if given, is called with the seconds from the first receive to
+    the last chunk of every body that arrives in full, i.e. the upload itself.
+    """
+
+    def __init__(self, app, limits, on_body=None):
+        self.app = app
+        self.limits = limits
+        self.on_body = on_body
+
+    def _limit_for(self, path):
+        for prefix, limit in self.limits.items():
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("POST", "PUT", "PATCH"):
+            return await self.app(scope, receive, send)
+        limit = self._limit_for(scope["path"])
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope["headers"])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            response = JSONResponse({"detail": "Upload too large"}, status_code=413)
+            return await response(scope, receive, send)
+
+        received = 0
+        started = None
+
+        async def limited_receive():
+            nonlocal received, started
+            if started is None:
+                started = time.monotonic()
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    raise HTTPException(status_code=413, detail="Upload too large")
+                if not message.get("more_body", False) and self.on_body is not None:
+                    self.on_body(time.monotonic() - started)
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+class ResumableUploads:
+    """
+    Resumable uploads: a client creates a session with the total size, then
+    appends the body in one or more PATCH requests at the current offset.
+
+    Bytes are appended to a .part file as they arrive, so when a connection drops
+    the client asks for the offset and continues from the last byte received.
+    """
+
+    def __init__(self, folder, max_size):
+        self.folder = folder
+        self.max_size = max_size
+        os.makedirs(folder, exist_ok=True)
+
+    def _meta_path(self, upload_id):
+        return os.path.join(self.folder, f"{upload_id}.json")
+
+    def part_path(self, upload_id):
+        return os.path.join(self.folder, f"{upload_id}.part")
+
+    def create(self, filename, length):
+        if length > self.max_size:
+            raise UploadTooLarge(f"{filename} exceeds the {self.max_size // (1024 * 1024)}MB upload limit")
+        upload_id = uuid.uuid4().hex
+        with open(self._meta_path(upload_id), "w") as f:
+            json.dump({"filename": filename, "length": length}, f)
+        open(self.part_path(upload_id), "wb").close()
+        return upload_id
+
+    def get(self, upload_id):
+        """Return the session metadata with its current offset, or None if unknown"""
+        if not upload_id.isalnum():
+            return None
+        try:
+            with open(self._meta_path(upload_id)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return None
+        meta["upload_id"] = upload_id
+        meta["offset"] = os.path.getsize(self.part_path(upload_id))
+        meta["complete"] = meta["offset"] == meta["length"]
+        return meta
+
+    async def append(self, upload_id, offset, stream):
+        """
+        Append a request body stream at offset; returns the new offset.
+
+        A client disconnect is not an error: everything received so far is kept.
+        """
+        meta = self.get(upload_id)
+        if meta is None:
+            raise KeyError(upload_id)
+        if offset != meta["offset"]:
+            raise ValueError(f"Upload offset is {meta['offset']}, not {offset}")
+
+        current = offset
+        async with aiofiles.open(self.part_path(upload_id), "ab") as out:
+            try:
+                async for chunk in stream:
+                    if current + len(chunk) > meta["length"]:
+                        raise UploadTooLarge("Body is longer than the declared Upload-Length")
+                    await out.write(chunk)
+                    current += len(chunk)
+            except ClientDisconnect:
+                logger.info(f"Upload {upload_id} interrupted at byte {current}")
+        return current
+
+    def finish(self, upload_id, destination):
+        """Move a complete upload to destination and forget the session"""
+        os.replace(self.part_path(upload_id), destination)
+        os.remove(self._meta_path(upload_id))
+
+    def discard(self, upload_id):
+        for path in (self.part_path(upload_id), self._meta_path(upload_id)):
+            if os.path.exists(path):
+                os.remove(path)
@@ -1,34 +1,51 @@
 import os
 import subprocess
-from pathlib import Path
+import time
+import shutil
+import uuid
 import logging
+from .ffmpeg_runner import run_ffmpeg, thread_args, decoder_thread_args
+from .probe import probe_input, plan_compression, parse_bitrate, ENCODER_CODECS
+from .config import (
+    SEGMENT_MIN_DURATION, SEGMENT_SECONDS, SEGMENT_WORKERS, MAX_OUTPUT_WIDTH, AUDIO_BITRATE, MIN_SIZE_SAVING,
+    LADDER_RENDITIONS, ENCODING_PROFILES
+)
+from .scheduler import detect_cpu_limit, current_scheduler
+from .segmented import compress_segmented
+from .encoder_registry import get_capabilities
+from .result_cache import hash_file, cache_key
+from .adaptive_crf import choose_crf
+from .ladder import PACKAGINGS, select_renditions, encode_ladder, projected_size
+from .storage import InsufficientSpace, ensure_free_space, scratch_folder
+from .profiles import resolve_profile
+from .target_encode import video_bitrate_for_target, rate_control_args, two_pass_encode, default_passlog_store
 
 logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
-def check_gpu_support():
-    """Check if NVIDIA GPU encoding is available"""
-    try:
-        result = subprocess.run(['nvidia-smi'], capture_output=True, text=True)
-        if result.returncode == 0:
-            probe = subprocess.run(['ffmpeg', '-encoders'], capture_output=True, text=True)
-            return 'h264_nvenc' in probe.stdout
-        return False
-    except FileNotFoundError:
-        return False
+def check_gpu_support(ffmpeg_path):
+    """Check if NVIDIA GPU encoding is available (probed once per FFmpeg binary)"""
+    return get_capabilities(ffmpeg_path)['has_gpu']
 
-def get_encoding_settings():
-    """Get encoding settings based on available hardware"""
-    has_gpu = check_gpu_support()
-    logger.info(f"GPU encoding available: {has_gpu}")
+def get_encoding_settings(ffmpeg_path, profile=None):
+    """
+    Get encoding settings for a profile (DEFAULT_PROFILE when None) based on available hardware.
+
+    Raises ValueError for an unknown profile or one whose encoder FFmpeg lacks.
+    """
+    name = resolve_profile(ffmpeg_path, profile)
+    profile = ENCODING_PROFILES[name]
+    has_gpu = check_gpu_support(ffmpeg_path)
+    logger.debug(f"GPU encoding available: {has_gpu}")
     
     # Base quality settings
-    crf = "28"  # Higher CRF = more compression (range 18-28 is good, 23 is default)
+    crf = str(profile['crf'])  # Higher CRF = more compression (range 18-28 is good, 23 is default)
     
-    if has_gpu:
+    if has_gpu and profile['codec'] == 'libx264':
         return {
+            'profile': name,
             'codec': 'h264_nvenc',
-            'preset': 'p7',  # More compression-focused preset
+            'preset': profile['nvenc_preset'],  # p7 is the most compression-focused preset
             'extra_params': [
                 '-rc', 'vbr',  # Variable bitrate mode
                 '-cq', '27',   # Quality-based VBR (higher = more compression)
@@ -39,21 +56,153 @@ def get_encoding_settings():
         }
     else:
         return {
-            'codec': 'libx264',
-            'preset': 'slower',  # Better compression than 'veryfast'
+            'profile': name,
+            'codec': profile['codec'],
+            'preset': profile['preset'],  # e.g. 'slower' compresses better than 'veryfast'
             'extra_params': [
                 '-crf', crf,
                 '-maxrate', '1000k',
                 '-bufsize', '2000k',
+                *profile.get('extra_params', []),
                 '-movflags', '+faststart'
             ]
         }
 
-def compress_video(args):
+def video_encode_args(encode_settings):
+    """Scaling and video encoder options shared by every encode path"""
+    return [
+        "-vf", f"scale='min({MAX_OUTPUT_WIDTH},iw)':'-2'",  # Maintain aspect ratio
+        "-c:v", encode_settings['codec'],
+        "-preset", encode_settings['preset'],
+        *encode_settings['extra_params'],  # Unpack extra encoding parameters
+    ]
+
+def audio_encode_args():
+    """Audio encoder options shared by every encode path"""
+    return [
+        "-c:a", "aac",
+        "-b:a", f"{AUDIO_BITRATE // 1000}k",  # Reduced audio bitrate
+        "-ac", "2",           # Convert to stereo
+        "-ar", "44100",       # Standard audio sample rate
+    ]
+
+def build_ffmpeg_command(input_path, output_path, ffmpeg_path, encode_settings, threads=None):
+    """Build the FFmpeg command line for a compression"""
+    return [
+        ffmpeg_path,
+        "-y",
+        *decoder_thread_args(threads),
+        "-i", input_path,
+        *video_encode_args(encode_settings),
+        *audio_encode_args(),
+        "-map", "0:v:0",      # Take first video stream
+        "-map", "0:a:0?",     # Take first audio stream if it exists
+        *thread_args(threads),
+        output_path
+    ]
+
+def build_passthrough_command(input_path, output_path, ffmpeg_path, reencode_audio, codec='h264'):
+    """Copy the video stream as-is; re-encode the audio or copy it too (plain remux)"""
+    return [
+        ffmpeg_path,
+        "-y",
+        "-i", input_path,
+        "-c:v", "copy",
+        *(["-tag:v", "hvc1"] if codec == 'hevc' else []),  # As the hevc profile tags it, for Apple players
+        *(audio_encode_args() if reencode_audio else ["-c:a", "copy"]),
+        "-map", "0:v:0",
+        "-map", "0:a:0?",
+        "-movflags", "+faststart",
+        output_path
+    ]
+
+def target_video_bitrate(encode_settings):
+    """The -maxrate of the encoding settings in bits/s (None if unset)"""
+    params = encode_settings['extra_params']
+    if '-maxrate' not in params:
+        return None
+    return parse_bitrate(params[params.index('-maxrate') + 1])
+
+def with_crf(encode_settings, crf):
+    """The extra_params of encoding settings with -crf set to crf"""
+    params = list(encode_settings['extra_params'])
+    params[params.index('-crf') + 1] = str(crf)
+    return params
+
+def effective_ffmpeg_args(ffmpeg_command, ffmpeg_path):
+    """The parts of a command that determine the output: everything but the paths, plus FFmpeg's version"""
+    input_path = ffmpeg_command[ffmpeg_command.index("-i") + 1]
+    output_path = ffmpeg_command[-1]
+    args = ["<input>" if a == input_path else "<output>" if a == output_path else a for a in ffmpeg_command[1:]]
+    return [get_capabilities(ffmpeg_path)['version'], *args]
+
+def use_segments(duration, encode_settings, segmented=None):
+    """Whether to encode in parallel segments: forced by segmented, else long CPU encodes"""
+    if segmented is not None:
+        return segmented
+    if not SEGMENT_MIN_DURATION or duration is None or 'nvenc' in encode_settings['codec']:
+        return False
+    return duration >= SEGMENT_MIN_DURATION
+
+def partial_output_path(output_path):
+    """A fresh path next to output_path, with the same extension so FFmpeg picks the same muxer"""
+    stem, ext = os.path.splitext(output_path)
+    return f"{stem}.partial-{uuid.uuid4().hex[:8]}{ext}"
+
+def compress_video(args, cache=None, report=None, threads=None, on_progress=None, segmented=None,
+                   target_size=None, target_bitrate=None, quality_floor=None, profile=None):
     """
     Compresses a video using FFmpeg with optimized settings for better compression.
+
+    threads caps the FFmpeg threads used (None lets FFmpeg pick) and on_progress
+    receives live progress dicts (see parse_progress). When a ResultCache is
+    given, identical inputs encoded with identical settings are served from it
+    instead of being encoded again. If a report dict is given it is filled with
+    details about how the output was produced, including report['path']:
+    'encode', 'audio_only' or 'remux' (video already meets the target and is
+    copied), or 'original' (encoding would not have made the file smaller).
+
+    Inputs longer than SEGMENT_MIN_DURATION are encoded as parallel segments
+    (see segmented.compress_segmented); segmented=True/False forces either mode.
+
+    target_size (bytes) or target_bitrate (bits/s, audio included) switch from
+    CRF to a two-pass encode at the video bitrate that hits the target for the
+    probed duration; report['target_size'] and report['size_vs_target'] then
+    show how close the output came.
+
+    quality_floor picks the CRF per video instead: the highest candidate whose
+    fast sample encodes still score at least quality_floor (QUALITY_METRIC),
+    see adaptive_crf.choose_crf. libx264 only; ignored in target mode.
+
+    profile names one of ENCODING_PROFILES (DEFAULT_PROFILE when None) and is
+    recorded in report['profile'].
+
+    The output is written to a fresh file and moved over output_path once it
+    is complete: output_path may still be a hard link to a result cache entry
+    (an earlier hit under the same name), which writing in place would change.
     """
     input_path, output_path, ffmpeg_path = args
+    partial_path = partial_output_path(output_path)
+    try:
+        success, result = _compress_video(
+            (input_path, partial_path, ffmpeg_path), cache, report, threads, on_progress, segmented,
+            target_size, target_bitrate, quality_floor, profile
+        )
+        if not success:
+            return False, result
+        os.replace(partial_path, output_path)
+        logger.info(f"Successfully compressed video to: {output_path}")
+        return True, output_path
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+def _compress_video(args, cache=None, report=None, threads=None, on_progress=None, segmented=None,
+                    target_size=None, target_bitrate=None, quality_floor=None, profile=None):
+    """compress_video writing straight to the output path in args"""
+    input_path, output_path, ffmpeg_path = args
+    if report is None:
+        report = {}
     
     logger.debug(f"Starting compression with input: {input_path}")
     
@@ -72,38 +221,141 @@ def compress_video(args):
     # Create output directory if it doesn't exist
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
 
-    encode_settings = get_encoding_settings()
-    ffmpeg_command = [
-        ffmpeg_path,
-        "-y",
-        "-i", input_path,
-        "-vf", "scale='min(1280,iw)':'-2'",  # Maintain aspect ratio
-        "-c:v", encode_settings['codec'],
-        "-preset", encode_settings['preset'],
-        *encode_settings['extra_params'],  # Unpack extra encoding parameters
-        "-c:a", "aac",
-        "-b:a", "96k",        # Reduced audio bitrate
-        "-ac", "2",           # Convert to stereo
-        "-ar", "44100",       # Standard audio sample rate
-        "-map", "0:v:0",      # Take first video stream
-        "-map", "0:a:0?",     # Take first audio stream if it exists
-        output_path
-    ]
+    try:
+        encode_settings = get_encoding_settings(ffmpeg_path, profile)
+    except ValueError as e:
+        logger.error(str(e))
+        return False, str(e)
+    ffmpeg_command = build_ffmpeg_command(input_path, output_path, ffmpeg_path, encode_settings, threads)
+    report['profile'] = encode_settings['profile']
+    report['encoder'] = encode_settings['codec']
+    report['preset'] = encode_settings['preset']
 
     try:
-        logger.debug(f"Running FFmpeg command: {' '.join(ffmpeg_command)}")
-        
-        # Run FFmpeg with both stdout and stderr captured
-        process = subprocess.run(
-            ffmpeg_command,
-            check=True,
-            capture_output=True,
-            text=True
-        )
+        # Probe codec, resolution, bitrate and duration to pick the cheapest path
+        media = probe_input(ffmpeg_path, input_path)
+        duration = media['duration'] if media else None
+        report['duration'] = duration
+        # A requested profile must return its own codec; without one any H.264 input that fits is kept
+        codec = 'h264' if profile is None else ENCODER_CODECS.get(encode_settings['codec'])
+        report['path'] = plan_compression(media, MAX_OUTPUT_WIDTH, target_video_bitrate(encode_settings), codec)
+        report['input_size'] = os.path.getsize(input_path)
+
+        targeted = target_size is not None or target_bitrate is not None
+        if targeted:
+            # Stream copies cannot hit a size, so target mode always encodes
+            report['path'] = 'encode'
+            has_audio = bool(media and media['audio'])
+            try:
+                video_bitrate = video_bitrate_for_target(duration, target_size, target_bitrate, has_audio)
+            except ValueError as e:
+                logger.error(f"Cannot encode {input_path} to target: {e}")
+                return False, str(e)
+            report['video_bitrate'] = video_bitrate
+            report['target_bitrate'] = target_bitrate
+            report['target_size'] = target_size or int(target_bitrate * duration / 8)
+            encode_settings = {**encode_settings, 'extra_params': rate_control_args(encode_settings, video_bitrate)}
+            ffmpeg_command = build_ffmpeg_command(input_path, output_path, ffmpeg_path, encode_settings, threads)
+
+        # Outputs larger than the input are replaced by the original, so the input size bounds them
+        needed_space = report.get('target_size') or report['input_size']
+
+        if report['path'] in ('remux', 'audio_only'):
+            ensure_free_space(os.path.dirname(output_path) or ".", needed_space)
+            # The video stream already meets the target: copy it instead of re-encoding
+            started = time.time()
+            run_ffmpeg(
+                build_passthrough_command(
+                    input_path, output_path, ffmpeg_path, report['path'] == 'audio_only', codec
+                ),
+                duration, on_progress
+            )
+            report['encode_seconds'] = round(time.time() - started, 3)
+        else:
+            key = None
+            content_hash = None
+            if cache is not None or targeted or quality_floor is not None:
+                content_hash = hash_file(input_path)
+
+            if quality_floor is not None and not targeted:
+                if encode_settings['codec'] != 'libx264':
+                    report['crf_search'] = {'skipped': f"not supported with {encode_settings['codec']}"}
+                else:
+                    try:
+                        crf = choose_crf(
+                            input_path, ffmpeg_path, content_hash, duration, quality_floor,
+                            get_capabilities(ffmpeg_path)['version'], threads=threads, report=report
+                        )
+                        report['crf'] = crf
+                        encode_settings = {**encode_settings, 'extra_params': with_crf(encode_settings, crf)}
+                        ffmpeg_command = build_ffmpeg_command(
+                            input_path, output_path, ffmpeg_path, encode_settings, threads
+                        )
+                    except Exception as e:
+                        # The search is an optimisation; the default CRF still gives a usable encode
+                        logger.error(f"CRF search failed for {input_path}, using the default CRF: {e}")
+                        report['crf_search'] = {'error': str(e)}
+            if cache is not None:
+                key = cache_key(content_hash, effective_ffmpeg_args(ffmpeg_command, ffmpeg_path))
+                if cache.lookup(key, output_path):
+                    report['cache'] = 'hit'
+                    report['output_size'] = os.path.getsize(output_path)
+                    if targeted:
+                        report['size_vs_target'] = round(report['output_size'] / report['target_size'], 3)
+                    return True, output_path
+                report['cache'] = 'miss'
+
+            ensure_free_space(os.path.dirname(output_path) or ".", needed_space)
+            logger.debug(f"Running FFmpeg command: {' '.join(ffmpeg_command)}")
+            started = time.time()
+            if targeted and encode_settings['codec'] == 'libx264':
+                report['mode'] = 'two_pass'
+                two_pass_encode(
+                    input_path, output_path, ffmpeg_path, video_encode_args(encode_settings), audio_encode_args(),
+                    default_passlog_store(), content_hash, threads=threads, duration=duration,
+                    on_progress=on_progress, report=report
+                )
+            elif targeted:
+                # NVENC runs its two passes inside one process (-multipass); x265/SVT-AV1 use one-pass ABR
+                report['mode'] = 'single'
+                run_ffmpeg(ffmpeg_command, duration, on_progress)
+            elif use_segments(duration, encode_settings, segmented) and media and media['video']:
+                report['mode'] = 'segmented'
+                wanted = SEGMENT_WORKERS or max(1, detect_cpu_limit() // (threads or 1))
+                # The split source and the encoded segments each take about the input size in scratch
+                scratch_dir = scratch_folder()
+                ensure_free_space(scratch_dir, 2 * report['input_size'], min_free=0)
+                # Segments beyond the first run on idle slots borrowed one segment at a time from the
+                # scheduler running this encode, so they stay within its concurrency limit and thread budget
+                compress_segmented(
+                    input_path, output_path, ffmpeg_path,
+                    video_encode_args(encode_settings), audio_encode_args(), media['audio'] is not None,
+                    wanted, threads=threads, duration=duration, on_progress=on_progress, report=report,
+                    segment_seconds=SEGMENT_SECONDS, scratch_dir=scratch_dir, scheduler=current_scheduler()
+                )
+            else:
+                report['mode'] = 'single'
+                run_ffmpeg(ffmpeg_command, duration, on_progress)
+            report['encode_seconds'] = round(time.time() - started, 3)
+
+            # Hand back the original when re-encoding did not make it meaningfully smaller
+            # (in target mode only if the original fits the target too)
+            if (os.path.exists(output_path)
+                    and os.path.getsize(output_path) > report['input_size'] * (1 - MIN_SIZE_SAVING)
+                    and (not targeted or report['input_size'] <= report['target_size'])):
+                logger.info(f"Encode of {input_path} saved less than {MIN_SIZE_SAVING:.0%}; keeping the original")
+                shutil.copyfile(input_path, output_path)
+                report['path'] = 'original'
+
+            if key is not None and os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+                cache.store(key, output_path, report['encode_seconds'])
         
         # Check if output file was created and has size > 0
         if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-            logger.info(f"Successfully compressed video to: {output_path}")
+            report['output_size'] = os.path.getsize(output_path)
+            if 'target_size' in report:
+                report['size_vs_target'] = round(report['output_size'] / report['target_size'], 3)
+            logger.debug(f"Compressed {input_path} to {output_path} ({report['path']})")
             return True, output_path
         else:
             error_msg = "Output file was not created or is empty"
@@ -114,8 +366,72 @@ def compress_video(args):
         error_msg = f"FFmpeg error: {e.stderr}"
         logger.error(error_msg)
         return False, error_msg
+
+    except InsufficientSpace as e:
+        error_msg = f"Not enough disk space: {e}"
+        logger.error(error_msg)
+        return False, error_msg
         
     except Exception as e:
         error_msg = f"Unexpected error: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
+
+def compress_ladder(args, packaging=None, renditions=None, report=None, threads=None, on_progress=None):
+    """
+    Encode a rendition ladder (LADDER_RENDITIONS by default) into a folder.
+
+    The source is decoded once and fed to one libx264 encoder per rendition
+    (see ladder.build_ladder_command); renditions taller than the source are
+    skipped. packaging is None (one MP4 per rendition), "hls" or "dash".
+
+    :param args: Tuple containing (input_path, output_dir, ffmpeg_path)
+    :return: (success, output_dir or error message)
+    """
+    input_path, output_dir, ffmpeg_path = args
+    if report is None:
+        report = {}
+    if not os.path.isfile(input_path):
+        error_msg = f"The input file {input_path} does not exist!"
+        logger.error(error_msg)
+        return False, error_msg
+    if packaging not in PACKAGINGS:
+        return False, f"Unknown packaging {packaging!r}"
+
+    report['encoder'] = 'libx264'
+    report['preset'] = 'ladder'
+    report['path'] = 'ladder'
+    try:
+        media = probe_input(ffmpeg_path, input_path)
+        if not media or not media['video']:
+            return False, "Input has no video stream"
+        report['duration'] = media['duration']
+        report['input_size'] = os.path.getsize(input_path)
+        selected = select_renditions(renditions or LADDER_RENDITIONS, media['video']['height'])
+        ensure_free_space(
+            os.path.dirname(output_dir) or ".",
+            projected_size(selected, media['duration'] or 0, media['audio'] is not None)
+        )
+        encode_ladder(
+            input_path, output_dir, ffmpeg_path, selected, media['audio'] is not None, packaging,
+            threads=threads, duration=media['duration'], on_progress=on_progress, report=report
+        )
+        report['output_size'] = sum(
+            os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(output_dir) for name in names
+        )
+        logger.info(f"Encoded {', '.join(report['renditions'])} of {input_path} into {output_dir}")
+        return True, output_dir
+    except subprocess.CalledProcessError as e:
+        error_msg = f"FFmpeg error: {e.stderr}"
+        logger.error(error_msg)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return False, error_msg
+    except InsufficientSpace as e:
+        error_msg = f"Not enough disk space: {e}"
+        logger.error(error_msg)
+        return False, error_msg
+    except Exception as e:
+        error_msg = f"Unexpected error: {str(e)}"
+        logger.error(error_msg)
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return False, error_msg
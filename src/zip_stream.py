@@ -0,0 +1,62 @@
+import io
+import os
+import time
+import asyncio
+import zipfile
+
+ZIP_CHUNK_SIZE = 1024 * 1024
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only, unseekable buffer that is emptied after every chunk"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+
+async def stream_zip(entries):
+    """
+    Build a ZIP archive on the fly from an async iterable of (arcname, path),
+    where path may also be bytes for small generated entries.
+
+    Entries are STORED (MP4s are already compressed, so deflating them again only
+    burns CPU). The archive is written to an unseekable sink, which makes zipfile
+    emit data descriptors instead of seeking back, and the sink is drained after
+    every chunk, so memory use stays at about one chunk however many or however
+    large the files are. Entries may be produced while earlier ones are streaming.
+    """
+    sink = _ChunkSink()
+    archive = zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED, allowZip64=True)
+    async for arcname, path in entries:
+        if isinstance(path, bytes):
+            # Small in-memory entries, e.g. a list of files that failed
+            archive.writestr(arcname, path)
+            yield sink.drain()
+            continue
+        info = zipfile.ZipInfo(arcname, date_time=time.localtime(os.path.getmtime(path))[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        size = os.path.getsize(path)
+        with open(path, "rb") as source, \
+                archive.open(info, "w", force_zip64=size > zipfile.ZIP64_LIMIT) as target:
+            while True:
+                chunk = await asyncio.to_thread(source.read, ZIP_CHUNK_SIZE)
+                if not chunk:
+                    break
+                target.write(chunk)
+                yield sink.drain()
+        yield sink.drain()
+    archive.close()
+    yield sink.drain()
+
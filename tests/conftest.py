@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The app is imported as the src package, as uvicorn does (src.app:app)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
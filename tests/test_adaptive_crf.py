@@ -0,0 +1,73 @@
+import json
+
+import pytest
+
+from src import adaptive_crf
+from src.adaptive_crf import CrfSearchCache, parse_score, sample_starts, search_crf
+from src.config import CRF_SAMPLE_COUNT
+
+
+def test_samples_are_centred_in_equal_shares():
+    assert sample_starts(100, count=4, length=5) == [10.0, 35.0, 60.0, 85.0]
+
+
+def test_short_videos_get_one_sample():
+    assert sample_starts(12, count=3, length=4) == [0.0]
+
+
+@pytest.mark.parametrize("stderr, metric, expected", [
+    ("[Parsed_ssim_4 @ 0x1] SSIM Y:0.981 (17.2) U:0.99 V:0.99 All:0.984213 (18.0)\n", "ssim", 0.984213),
+    ("[Parsed_psnr_4 @ 0x1] PSNR y:41.2 u:44.0 v:44.1 average:42.137 min:38.1 max:47.0\n", "psnr", 42.137),
+    ("[Parsed_psnr_4 @ 0x1] PSNR y:inf u:inf v:inf average:inf min:inf max:inf\n", "psnr", 100.0),
+    ("Conversion failed!\n", "ssim", None),
+])
+def test_parse_score(stderr, metric, expected):
+    assert parse_score(stderr, metric) == expected
+
+
+@pytest.fixture
+def scores(monkeypatch, tmp_path):
+    """Fake sample scores by CRF; records the (start, crf) pairs encoded"""
+    by_crf, encoded = {}, []
+
+    def score_sample(input_path, ffmpeg_path, start, length, crf, scratch_dir, metric, threads=None):
+        encoded.append((start, crf))
+        return by_crf[crf][len([1 for _, c in encoded if c == crf]) - 1]
+    monkeypatch.setattr(adaptive_crf, "score_sample", score_sample)
+    monkeypatch.setattr(adaptive_crf, "scratch_folder", lambda: str(tmp_path))
+    return by_crf, encoded
+
+
+def test_search_stops_at_the_highest_crf_that_meets_the_floor(scores):
+    by_crf, encoded = scores
+    by_crf.update({32: [0.99, 0.90], 28: [0.97] * (CRF_SAMPLE_COUNT - 1) + [0.96], 24: [0.99] * CRF_SAMPLE_COUNT})
+    crf, seen = search_crf("in.mp4", "ffmpeg", 100, 0.95, metric="ssim", candidates=[24, 28, 32])
+    assert (crf, seen) == (28, {32: 0.9, 28: 0.96})
+    # The other samples at CRF 32 are skipped once one misses the floor; CRF 24 is never tried
+    assert [c for _, c in encoded] == [32, 32] + [28] * CRF_SAMPLE_COUNT
+
+
+def test_search_falls_back_to_the_lowest_crf(scores):
+    by_crf, _ = scores
+    by_crf.update({28: [0.80], 24: [0.90]})  # Each stops at its first sample
+    assert search_crf("in.mp4", "ffmpeg", 100, 0.95, metric="ssim", candidates=[24, 28])[0] == 24
+
+
+def test_cache_is_shared_and_updated(tmp_path):
+    path = str(tmp_path / "crf_search.db")
+    key = CrfSearchCache.key("content", 0.95, "ssim", [24, 28], "6.1")
+    assert key != CrfSearchCache.key("content", 0.96, "ssim", [24, 28], "6.1")
+    CrfSearchCache(path).put(key, 28, {"28": 0.96})
+    other = CrfSearchCache(path)
+    assert other.get(key)['crf'] == 28
+    other.put(key, 24, {"24": 0.99})
+    assert CrfSearchCache(path).get(key)['scores'] == {"24": 0.99}
+    assert other.get("missing") is None
+
+
+def test_cache_imports_the_old_json_file(tmp_path):
+    with open(tmp_path / "crf_search.json", "w") as f:
+        json.dump({"key": {'crf': 30, 'scores': {"30": 0.97}, 'created_at': 1.0}}, f)
+    cache = CrfSearchCache(str(tmp_path / "crf_search.db"))
+    assert cache.get("key") == {'crf': 30, 'scores': {"30": 0.97}, 'created_at': 1.0}
+    assert not (tmp_path / "crf_search.json").exists()
@@ -0,0 +1,85 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.admission import AdmissionController, AdmissionMiddleware, SpeedModel
+from src.config import ADMISSION_DEFAULT_SECONDS_PER_MB, ADMISSION_DEFAULT_SPEED, DEFAULT_PROFILE
+
+MB = 1024 * 1024
+
+
+class FakeStats:
+    def __init__(self, rates):
+        self.rates = rates
+        self.loads = 0
+
+    def recent_rates(self):
+        self.loads += 1
+        return self.rates
+
+
+@pytest.fixture
+def model():
+    # 1s per MB, 2s of video per encode second
+    return SpeedModel(FakeStats({DEFAULT_PROFILE: {'seconds_per_byte': 1 / MB, 'speed': 2.0, 'samples': 5}}))
+
+
+def test_estimates_from_the_rolling_rates(model):
+    assert model.estimate(size=10 * MB) == pytest.approx(10.0)
+    assert model.estimate(duration=60) == 30.0
+    # Profiles without samples use the defaults
+    assert model.estimate("fast", size=10 * MB) == pytest.approx(10 * ADMISSION_DEFAULT_SECONDS_PER_MB)
+    assert model.estimate("fast", duration=60) == 60 / ADMISSION_DEFAULT_SPEED
+    assert model.stats.loads == 1  # Cached for refresh_seconds
+
+
+def test_requests_are_shed_once_the_backlog_would_miss_the_slo(model):
+    controller = AdmissionController(model, slots=2, slo_seconds=30)
+    first, status = controller.admit(size=40 * MB)  # Over the SLO on its own, but nothing is ahead of it
+    assert first is not None
+    assert status['estimated_completion_seconds'] == 40.0
+    second, status = controller.admit(size=5 * MB)
+    assert second is not None
+    assert status['projected_wait_seconds'] == 20.0
+    third, status = controller.admit(size=10 * MB)
+    assert third is None
+    assert status['queue_depth'] == 2
+    assert status['retry_after'] == 3  # Until 22.5s of wait plus its 10s fits in 30s
+    controller.release(first)
+    controller.release(second)
+    assert controller.admit(size=10 * MB)[0] is not None
+
+
+def test_stored_jobs_count_for_what_they_have_left(model, tmp_path):
+    upload = tmp_path / "in.mp4"
+    upload.write_bytes(b"x" * MB)
+    jobs = [
+        {'options': {}, 'input_path': str(upload), 'progress': None},
+        # 30s of video done at 25%: 90s left at 2x
+        {'options': {}, 'input_path': str(upload), 'progress': {'percent': 25.0, 'out_seconds': 30.0}},
+        {'options': {}, 'input_path': str(tmp_path / "gone.mp4"), 'progress': None},
+    ]
+    controller = AdmissionController(model, slots=1, slo_seconds=0, jobs=lambda: jobs, processes=2)
+    assert controller.job_backlog() == (3, pytest.approx(46.0))
+    # Each worker takes its share of the shared store's jobs
+    assert controller.status()['projected_wait_seconds'] == 23.0
+
+
+def test_middleware_answers_429_before_the_body_is_read(model):
+    async def upload(request):
+        return JSONResponse({"received": len(await request.body())})
+    controller = AdmissionController(model, slots=1, slo_seconds=30)
+    app = AdmissionMiddleware(Starlette(routes=[Route("/upload/", upload, methods=["POST"])]), controller,
+                              paths={"/upload/"})
+    client = TestClient(app)
+    ticket, _ = controller.admit(size=25 * MB)
+    response = client.post("/upload/", content=b"x" * 10 * MB)
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "5"
+    assert response.headers["x-queue-depth"] == "1"
+    controller.release(ticket)
+    response = client.post("/upload/", content=b"x" * 1000)
+    assert response.json() == {"received": 1000}
+    assert response.headers["x-projected-wait"] == "0.0"
@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import new
+from new import Manifest, find_videos, process_videos
+
+
+@pytest.fixture
+def encodes(monkeypatch):
+    """Replace FFmpeg with a copy of the input, recording the inputs"""
+    inputs = []
+
+    def run_ffmpeg(command):
+        source = command[command.index("-i") + 1]
+        inputs.append(os.path.basename(source))
+        shutil.copyfile(source, command[-1])
+    monkeypatch.setattr(new, "run_ffmpeg", run_ffmpeg)
+    monkeypatch.setattr(new, "probe_input", lambda ffmpeg_path, path: None)
+    return inputs
+
+
+def test_manifest_survives_a_restart(tmp_path):
+    video = tmp_path / "a.mp4"
+    video.write_bytes(b"video")
+    path = str(tmp_path / "manifest.json")
+    Manifest(path).record("a.mp4", video.stat(), "settings", "done", output="out.mp4")
+    manifest = Manifest(path)
+    assert manifest.is_current("a.mp4", video.stat(), "settings")
+    assert not manifest.is_current("a.mp4", video.stat(), "other settings")
+    assert not manifest.is_current("b.mp4", video.stat(), "settings")
+    video.write_bytes(b"changed video")
+    assert not manifest.is_current("a.mp4", video.stat(), "settings")
+
+
+def test_failed_files_are_not_current(tmp_path):
+    video = tmp_path / "a.mp4"
+    video.write_bytes(b"video")
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    manifest.record("a.mp4", video.stat(), "settings", "failed", error="boom")
+    assert not manifest.is_current("a.mp4", video.stat(), "settings")
+    assert manifest.is_current("a.mp4", video.stat(), "settings", statuses=('done', 'failed'))
+
+
+def test_find_videos_is_recursive_and_sorted(tmp_path):
+    (tmp_path / "b").mkdir()
+    for name in ("b/c.MOV", "a.mp4", "notes.txt"):
+        (tmp_path / name).write_bytes(b"x")
+    assert [p.relative_to(tmp_path).as_posix() for p in find_videos(tmp_path)] == ["a.mp4", "b/c.MOV"]
+
+
+def test_process_videos_skips_unchanged_files(tmp_path, encodes):
+    source, output = tmp_path / "in", tmp_path / "out"
+    (source / "sub").mkdir(parents=True)
+    (source / "a.mp4").write_bytes(b"a" * 10)
+    (source / "sub" / "b.mp4").write_bytes(b"b" * 10)
+
+    summary = process_videos(source, str(output), "ffmpeg", max_threads=1)
+    assert (summary['processed'], summary['skipped'], summary['failed']) == (2, 0, 0)
+    assert (output / "sub" / "compressed_b.mp4").read_bytes() == b"b" * 10
+
+    (source / "a.mp4").write_bytes(b"a" * 20)
+    summary = process_videos(source, str(output), "ffmpeg", max_threads=1)
+    assert (summary['processed'], summary['skipped']) == (1, 1)
+    assert sorted(encodes[:2]) == ["a.mp4", "b.mp4"]
+    assert encodes[2:] == ["a.mp4"]
+    with open(output / new.SUMMARY_NAME) as f:
+        assert json.load(f)['processed'] == 1
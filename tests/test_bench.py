@@ -0,0 +1,25 @@
+from benchmarks import bench
+
+
+def test_percentile():
+    assert bench.percentile([], 0.5) is None
+    assert bench.percentile([3, 1, 2], 0.5) == 2
+    assert bench.percentile([4, 1, 3, 2], 0.95) == 4
+
+
+def test_summarize_counts_successful_outputs_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(bench, "CLIPS_DIR", str(tmp_path))
+    for name in ("360p_10s_audio", "720p_10s_audio"):
+        (tmp_path / f"{name}.mp4").write_bytes(b"x" * 1000)
+    output = tmp_path / "out.mp4"
+    output.write_bytes(b"x" * 250)
+    result = bench.summarize(
+        "compress_video", 2, ["360p_10s_audio", "720p_10s_audio"], [1.0, 3.0], 10.0,
+        {"360p_10s_audio": str(output), "720p_10s_audio": None}, "ffmpeg", quality=False,
+        peak_rss={"self": 50.0, "children": 80.0}
+    )
+    assert result["failed"] == 1
+    assert result["videos_per_minute"] == 6.0
+    assert result["realtime_factor"] == 1.0
+    assert result["compression_ratio"] == 0.25
+    assert result["peak_rss_mb"] == {"self": 50.0, "children": 80.0}
@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.delivery import ActiveReaders, RangeFileResponse, RetentionStore, parse_range
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-99", (0, 99)),
+    ("bytes=100-", (100, 999)),
+    ("bytes=-100", (900, 999)),
+    ("bytes=-5000", (0, 999)),
+    ("bytes=900-5000", (900, 999)),
+    ("bytes=999-999", (999, 999)),
+    ("bytes= 0-9", (0, 9)),
+])
+def test_parse_range(header, expected):
+    assert parse_range(header, 1000) == expected
+
+
+@pytest.mark.parametrize("header", [
+    None, "", "items=0-9", "bytes=0-9,20-29", "bytes=-", "bytes=a-9", "bytes=0-b", "bytes=1-2-3",
+])
+def test_parse_range_serves_whole_file(header):
+    assert parse_range(header, 1000) is None
+
+
+@pytest.mark.parametrize("header, size", [
+    ("bytes=1000-", 1000), ("bytes=5-4", 1000), ("bytes=-0", 1000), ("bytes=-10", 0), ("bytes=0-", 0),
+])
+def test_parse_range_not_satisfiable(header, size):
+    with pytest.raises(ValueError):
+        parse_range(header, size)
+
+
+@pytest.fixture
+def readers(tmp_path):
+    return ActiveReaders(str(tmp_path / "data" / "downloads.db"))
+
+
+def file_app(path, readers, completed):
+    async def download(request):
+        return RangeFileResponse(path, "video/mp4", "out.mp4", request.headers, readers=readers,
+                                 on_complete=completed.append)
+    return TestClient(Starlette(routes=[Route("/download", download, methods=["GET", "HEAD"])]))
+
+
+def test_range_and_etag_responses(tmp_path, readers):
+    path = tmp_path / "out.mp4"
+    path.write_bytes(bytes(range(100)))
+    completed = []
+    client = file_app(str(path), readers, completed)
+
+    full = client.get("/download")
+    assert full.status_code == 200
+    assert full.content == bytes(range(100))
+    assert completed == [str(path)]
+
+    part = client.get("/download", headers={"range": "bytes=10-19"})
+    assert part.status_code == 206
+    assert part.headers["content-range"] == "bytes 10-19/100"
+    assert part.content == bytes(range(10, 20))
+    # A player seeking is not a completed download, even when it reads the last byte
+    client.get("/download", headers={"range": "bytes=90-"})
+    assert len(completed) == 1
+    # Resuming with If-Range is
+    client.get("/download", headers={"range": "bytes=90-", "if-range": full.headers["etag"]})
+    assert len(completed) == 2
+
+    assert client.get("/download", headers={"if-none-match": full.headers["etag"]}).status_code == 304
+    assert client.get("/download", headers={"range": "bytes=100-"}).status_code == 416
+    # A stale If-Range gets the whole file
+    assert client.get("/download", headers={"range": "bytes=0-9", "if-range": '"old"'}).status_code == 200
+    assert not readers.is_reading(str(path))
+
+
+def test_outputs_are_removed_after_max_downloads(tmp_path, readers):
+    retention = RetentionStore(str(tmp_path / "data" / "downloads.db"), max_downloads=2, ttl_seconds=3600,
+                               readers=readers)
+    path = tmp_path / "out.mp4"
+    path.write_bytes(b"x")
+    assert retention.record_download(str(path)) == 1
+    assert path.exists()
+    retention.record_download(str(path))
+    assert not path.exists()
+    assert retention.downloads(str(path)) == 0
+
+
+def test_files_being_streamed_are_kept(tmp_path, readers):
+    retention = RetentionStore(str(tmp_path / "data" / "downloads.db"), max_downloads=1, ttl_seconds=3600,
+                               readers=readers)
+    ladder = tmp_path / "ladder_abc"
+    ladder.mkdir()
+    (ladder / "720p.m3u8").write_bytes(b"x")
+    token = readers.acquire(str(ladder / "720p.m3u8"))
+    assert not retention.remove(str(ladder), "test")
+    readers.release(token)
+    assert retention.remove(str(ladder), "test")
+    assert not ladder.exists()
+
+
+def test_sweep_removes_expired_outputs_and_prefixed_folders(tmp_path, readers):
+    retention = RetentionStore(str(tmp_path / "data" / "downloads.db"), max_downloads=0, ttl_seconds=60,
+                               readers=readers)
+    output = tmp_path / "output"
+    for name in ("ladder_old", "cache"):
+        (output / name).mkdir(parents=True)
+    for name in ("old.mp4", "new.mp4"):
+        (output / name).write_bytes(b"x")
+    old = time.time() - 120
+    for name in ("old.mp4", "ladder_old", "cache"):
+        os.utime(output / name, (old, old))
+    assert retention.sweep(str(output), folder_prefix="ladder_") == 2
+    assert sorted(os.listdir(output)) == ["cache", "new.mp4"]
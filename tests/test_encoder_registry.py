@@ -0,0 +1,82 @@
+import os
+import stat
+
+from src import encoder_registry
+from src.encoder_registry import _parse_table, get_capabilities
+
+ENCODERS = """Encoders:
+ V..... = Video
+ A..... = Audio
+ S..... = Subtitle
+ .F.... = Frame-level multithreading
+ ------
+ V....D libx264              libx264 H.264 / AVC / MPEG-4 AVC / MPEG-4 part 10 (codec h264)
+ V....D h264_nvenc           NVIDIA NVENC H.264 encoder (codec h264)
+ A....D aac                  AAC (Advanced Audio Coding)
+"""
+
+PIX_FMTS = """Pixel formats:
+I.... = Supported Input  format for conversion
+..... = Hardware accelerated format
+FLAGS NAME            NB_COMPONENTS BITS_PER_PIXEL BIT_DEPTHS
+-----
+IO... yuv420p                3             12      8-8-8
+IO... yuv420p10le            3             15      10-10-10
+"""
+
+FILTERS = """Filters:
+  T.. = Timeline support
+  .S. = Slice threading
+  A = Audio input/output
+  | = Source or sink filter
+ TSC scale             V->V       Scale the input video size and/or convert the image format.
+ ... split             V->N       Pass on the input to N video outputs.
+ T.C ssim              VV->V      Calculate the SSIM between two video streams.
+"""
+
+
+def test_parse_encoders():
+    assert _parse_table(ENCODERS, 6) == {"libx264", "h264_nvenc", "aac"}
+
+
+def test_parse_pix_fmts():
+    assert _parse_table(PIX_FMTS, 5) == {"yuv420p", "yuv420p10le"}
+
+
+def test_parse_filters_without_separator():
+    # The legend lines ("A = Audio", "| = Source or sink filter") are not filters
+    assert _parse_table(FILTERS, 3) == {"scale", "split", "ssim"}
+
+
+def test_parse_empty_output():
+    assert _parse_table("", 6) == set()
+
+
+def fake_ffmpeg(path, calls, version="6.1.1"):
+    """A shell script answering the probe commands and counting the listings it prints"""
+    with open(path, "w") as f:
+        f.write(f"""#!/bin/sh
+case "$*" in
+*-version*) echo "ffmpeg version {version} Copyright (c) 2000-2023";;
+*-encoders*) echo x >> {calls}; printf '{ENCODERS}';;
+*) ;;
+esac
+""")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+def test_capabilities_are_probed_once_per_binary_and_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(encoder_registry, "_capabilities", {})
+    monkeypatch.setattr(encoder_registry, "_versions", {})
+    ffmpeg, calls = str(tmp_path / "ffmpeg"), tmp_path / "calls"
+    fake_ffmpeg(ffmpeg, calls)
+    first = get_capabilities(ffmpeg)
+    assert first["version"] == "6.1.1"
+    assert "libx264" in first["encoders"]
+    assert get_capabilities(ffmpeg) is first
+    assert calls.read_text().count("x") == 1
+
+    # A replaced binary is probed again
+    fake_ffmpeg(ffmpeg, calls, version="7.0.2-upgraded")
+    assert get_capabilities(ffmpeg)["version"] == "7.0.2-upgraded"
+    assert calls.read_text().count("x") == 2
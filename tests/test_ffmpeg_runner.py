@@ -0,0 +1,50 @@
+from src.ffmpeg_runner import decoder_thread_args, parse_progress, thread_args
+
+
+def test_thread_args_cap_filters_and_encoder():
+    assert thread_args(3) == ["-filter_threads", "3", "-filter_complex_threads", "3", "-threads", "3"]
+    assert decoder_thread_args(3) == ["-threads", "3"]
+
+
+def test_no_thread_budget_adds_no_options():
+    assert thread_args(0) == []
+    assert decoder_thread_args(None) == []
+
+
+def test_parse_progress():
+    block = {
+        'frame': '240', 'fps': '48.5', 'speed': '2.01x', 'out_time': '00:00:10.000000',
+        'out_time_us': '10000000', 'progress': 'continue',
+    }
+    assert parse_progress(block, duration=40) == {
+        'frame': 240, 'fps': 48.5, 'speed': 2.01, 'out_time': '00:00:10.000000', 'out_seconds': 10.0,
+        'percent': 25.0, 'state': 'encoding',
+    }
+
+
+def test_parse_progress_without_duration_has_no_percent():
+    assert parse_progress({'out_time_us': '5000000'})['percent'] is None
+
+
+def test_parse_progress_reads_out_time_ms_as_microseconds():
+    assert parse_progress({'out_time_ms': '2500000'})['out_seconds'] == 2.5
+
+
+def test_parse_progress_before_the_first_frame():
+    progress = parse_progress({'frame': '0', 'fps': 'N/A', 'speed': 'N/A', 'out_time_us': 'N/A'}, duration=10)
+    assert progress['fps'] is None
+    assert progress['speed'] is None
+    assert progress['out_seconds'] is None
+    assert progress['percent'] is None
+
+
+def test_parse_progress_clamps():
+    # FFmpeg reports a negative out_time before the first packet, and can run past the probed duration
+    assert parse_progress({'out_time_us': '-9223372036854775807'}, duration=10)['out_seconds'] == 0.0
+    assert parse_progress({'out_time_us': '12000000'}, duration=10)['percent'] == 100.0
+
+
+def test_parse_progress_end_is_finished():
+    progress = parse_progress({'out_time_us': '1000000', 'progress': 'end'}, duration=10)
+    assert progress['state'] == 'finished'
+    assert progress['percent'] == 100.0
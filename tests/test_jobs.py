@@ -0,0 +1,154 @@
+import sqlite3
+import time
+
+import pytest
+
+from src.jobs import JobStore, QUEUED, RUNNING, DONE, FAILED, PENDING, READY
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.db"))
+
+
+def create(store, name, **kwargs):
+    time.sleep(0.002)  # Distinct created_at, so claim order is deterministic
+    return store.create(f"{name}.mp4", f"uploads/{name}.mp4", f"output/{name}.mp4", job_id=name, **kwargs)
+
+
+def test_create_and_get(store):
+    job_id = store.create("a.mp4", "uploads/a.mp4", "output/a.mp4", options={'target_size': 1000})
+    job = store.get(job_id)
+    assert (job['status'], job['filename'], job['options']) == (QUEUED, "a.mp4", {'target_size': 1000})
+    assert job['report'] is None
+    assert store.get("missing") is None
+
+
+def test_update_encodes_json_fields(store):
+    create(store, "a")
+    store.update("a", status=FAILED, error="boom", report={'path': 'encode'}, progress={'percent': 50.0})
+    job = store.get("a")
+    assert (job['status'], job['error']) == (FAILED, "boom")
+    assert job['report'] == {'path': 'encode'}
+    assert job['progress'] == {'percent': 50.0}
+
+
+def test_lists(store):
+    create(store, "a", batch_id="batch")
+    create(store, "b", batch_id="batch")
+    create(store, "c")
+    store.update("b", status=DONE)
+    assert [job['id'] for job in store.list_by_batch("batch")] == ["a", "b"]
+    assert [job['id'] for job in store.list_by_status(QUEUED)] == ["a", "c"]
+    assert [job['id'] for job in store.list_by_status(QUEUED, DONE)] == ["a", "b", "c"]
+
+
+def test_old_database_gains_new_columns(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute(
+            "CREATE TABLE jobs (id TEXT PRIMARY KEY, status TEXT NOT NULL, filename TEXT NOT NULL, "
+            "input_path TEXT NOT NULL, output_path TEXT NOT NULL, error TEXT, report TEXT, "
+            "created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("INSERT INTO jobs VALUES ('old', 'done', 'a.mp4', 'in', 'out', NULL, NULL, 1, 1)")
+    store = JobStore(path)
+    assert store.get("old")['status'] == DONE
+    assert store.get("old")['options'] == {}
+    create(store, "new", batch_id="batch")
+    assert store.list_by_batch("batch")[0]['id'] == "new"
+
+
+def test_claim_takes_the_oldest_queued_job(store):
+    create(store, "a")
+    create(store, "b")
+    job = store.claim("w1", 60, 3)
+    assert (job['id'], job['status'], job['worker_id']) == ("a", RUNNING, "w1")
+    stored = store.get("a")
+    assert (stored['status'], stored['worker_id'], stored['attempts']) == (RUNNING, "w1", 1)
+    assert store.claim("w2", 60, 3)['id'] == "b"
+    assert store.claim("w3", 60, 3) is None
+
+
+def test_claim_is_fair_across_owners(store):
+    for name in ("batch1", "batch2", "batch3"):
+        create(store, name, batch_id="batch")
+    create(store, "single")
+    claimed = [store.claim("w", 60, 3)['id'] for _ in range(4)]
+    assert claimed == ["batch1", "single", "batch2", "batch3"]
+
+
+def test_expired_lease_is_reclaimed(store):
+    create(store, "a")
+    store.claim("dead", -1, 3)  # Lease already expired
+    job = store.claim("w2", 60, 3)
+    assert job['id'] == "a"
+    assert store.get("a")['attempts'] == 2
+    # The first worker lost the job: its heartbeat says so and its result is discarded
+    assert store.heartbeat("dead", ["a"], 60) == {"a"}
+    assert not store.complete("a", "dead", status=DONE)
+    assert store.complete("a", "w2", status=DONE, report={'path': 'encode'})
+    done = store.get("a")
+    assert (done['status'], done['worker_id'], done['report']) == (DONE, None, {'path': 'encode'})
+
+
+def test_heartbeat_keeps_the_lease(store):
+    create(store, "a")
+    store.claim("w1", -1, 3)
+    assert store.heartbeat("w1", ["a"], 60) == set()
+    assert store.claim("w2", 60, 3) is None
+
+
+def test_job_fails_after_max_attempts(store):
+    create(store, "a")
+    store.claim("w1", -1, 2)
+    store.claim("w2", -1, 2)
+    assert store.claim("w3", 60, 2) is None
+    failed = store.get("a")
+    assert failed['status'] == FAILED
+    assert "2 times" in failed['error']
+
+
+def test_count_by_status_counts_the_shared_queue(store):
+    for name in ("a", "b", "c"):
+        create(store, name)
+    store.claim("w", 60, 3)
+    assert store.count_by_status(QUEUED) == 2
+    assert store.count_by_status(QUEUED, RUNNING) == 3
+
+
+def test_preview_lease(store):
+    create(store, "a", preview=True)
+    create(store, "b")
+    assert store.get("a")['preview'] == {'state': PENDING}
+    assert store.get("b")['preview'] is None
+    assert store.claim_preview("w1", 60, 3)['id'] == "a"
+    assert store.get("a")['preview'] == {'state': RUNNING}
+    assert store.claim_preview("w2", 60, 3) is None
+    assert not store.complete_preview("a", "w2", READY, {'thumbnails': 3})
+    assert store.complete_preview("a", "w1", READY, {'thumbnails': 3})
+    assert store.get("a")['preview'] == {'state': READY, 'thumbnails': 3}
+
+
+def test_preview_of_a_dead_worker_is_retried_then_failed(store):
+    create(store, "a", preview=True)
+    store.claim_preview("dead", -1, 2)
+    store.heartbeat_previews("dead", ["a"], -1)
+    assert store.claim_preview("w2", -1, 2)['id'] == "a"
+    assert store.claim_preview("w3", 60, 2) is None
+    preview = store.get("a")['preview']
+    assert preview['state'] == FAILED
+    assert "2 times" in preview['error']
+
+
+def test_active_paths_keep_inputs_of_unfinished_previews(store):
+    create(store, "a", preview=True)
+    create(store, "b")
+    store.claim("w", 60, 3)
+    store.claim("w", 60, 3)
+    store.complete("a", "w", status=DONE)
+    store.complete("b", "w", status=DONE)
+    assert store.active_paths() == {"uploads/a.mp4"}
+    store.claim_preview("w", 60, 3)
+    store.complete_preview("a", "w", FAILED, {'error': "no video"})
+    assert store.active_paths() == set()
@@ -0,0 +1,65 @@
+import pytest
+
+from src.config import LADDER_KEYFRAME_SECONDS
+from src.ladder import build_ladder_command, projected_size, select_renditions
+
+RENDITIONS = [
+    {'name': '360p', 'height': 360, 'bitrate': '800k'},
+    {'name': '1080p', 'height': 1080, 'bitrate': '5M'},
+    {'name': '720p', 'height': 720, 'bitrate': '2800k'},
+]
+
+
+def values(command, option):
+    return [command[i + 1] for i, arg in enumerate(command) if arg == option]
+
+
+@pytest.mark.parametrize("source_height, expected", [
+    (1080, ['1080p', '720p', '360p']),
+    (800, ['720p', '360p']),
+    (240, ['360p']),  # Never empty
+    (None, ['1080p', '720p', '360p']),
+])
+def test_select_renditions_never_upscales(source_height, expected):
+    assert [r['name'] for r in select_renditions(RENDITIONS, source_height)] == expected
+
+
+def test_projected_size_counts_audio_per_rendition():
+    assert projected_size(RENDITIONS[:1], 10, True) > projected_size(RENDITIONS[:1], 10, False)
+    assert projected_size(RENDITIONS, 20, False) == pytest.approx(2 * projected_size(RENDITIONS, 10, False), abs=1)
+
+
+def test_separate_mp4s_share_one_decode():
+    renditions = select_renditions(RENDITIONS, 1080)
+    command, outputs = build_ladder_command("in.mp4", "out", "ffmpeg", renditions, has_audio=True, threads=2)
+    assert command.count("-i") == 1
+    assert values(command, "-filter_complex") == [
+        "[0:v]split=3[v0][v1][v2];[v0]scale=-2:1080[v0out];[v1]scale=-2:720[v1out];[v2]scale=-2:360[v2out]"
+    ]
+    assert outputs == {'1080p': '1080p.mp4', '720p': '720p.mp4', '360p': '360p.mp4'}
+    assert values(command, "-b:v:0") == ["5000000", "2800000", "800000"]
+    # The same keyframe timestamps in every rendition
+    assert values(command, "-force_key_frames") == [f"expr:gte(t,n_forced*{LADDER_KEYFRAME_SECONDS})"] * 3
+    assert values(command, "-map") == ["[v0out]", "0:a:0", "[v1out]", "0:a:0", "[v2out]", "0:a:0"]
+
+
+def test_hls_groups_the_renditions_around_one_audio_track():
+    command, outputs = build_ladder_command("in.mp4", "out", "ffmpeg", RENDITIONS[:2], has_audio=True,
+                                            packaging="hls")
+    assert values(command, "-var_stream_map") == ["v:0,agroup:audio,name:360p v:1,agroup:audio,name:1080p "
+                                                  "a:0,agroup:audio,name:audio"]
+    assert values(command, "-map") == ["[v0out]", "[v1out]", "0:a:0"]
+    assert outputs == {'360p': '360p/index.m3u8', '1080p': '1080p/index.m3u8', 'master': 'master.m3u8'}
+
+
+def test_dash_without_audio():
+    command, outputs = build_ladder_command("in.mp4", "out", "ffmpeg", RENDITIONS, has_audio=False,
+                                            packaging="dash")
+    assert values(command, "-adaptation_sets") == ["id=0,streams=v"]
+    assert "-c:a" not in command
+    assert outputs == {'master': 'manifest.mpd'}
+
+
+def test_unknown_packaging():
+    with pytest.raises(ValueError):
+        build_ladder_command("in.mp4", "out", "ffmpeg", RENDITIONS, has_audio=True, packaging="smooth")
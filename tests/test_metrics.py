@@ -0,0 +1,59 @@
+import pytest
+
+from src import metrics
+from src.jobs import JobStore, QUEUED
+from src.metrics import REGISTRY, SharedStateCollector, observe_compression
+from src.profiles import ProfileStats
+
+
+@pytest.fixture(autouse=True)
+def profile_stats(monkeypatch, tmp_path):
+    stats = ProfileStats(str(tmp_path / "profile_stats.db"))
+    monkeypatch.setattr(metrics, "default_profile_stats", lambda: stats)
+
+
+def compressions(outcome):
+    labels = {'encoder': 'libx264', 'preset': 'test', 'outcome': outcome}
+    return REGISTRY.get_sample_value("video_compressions_total", labels) or 0
+
+
+@pytest.mark.parametrize("report, success, outcome", [
+    ({'path': 'remux'}, True, 'remux'),
+    ({'cache': 'hit', 'path': 'encode'}, True, 'cache_hit'),
+    ({}, True, 'encode'),
+    ({'path': 'encode'}, False, 'failed'),
+])
+def test_compressions_are_counted_by_outcome(report, success, outcome):
+    before = compressions(outcome)
+    observe_compression({'encoder': 'libx264', 'preset': 'test', **report}, success)
+    assert compressions(outcome) == before + 1
+
+
+def test_timings_are_observed_from_the_report():
+    labels = {'encoder': 'libx264', 'preset': 'test', 'outcome': 'encode'}
+    count = REGISTRY.get_sample_value("video_ffmpeg_speed_factor_count", labels) or 0
+    observe_compression({'encoder': 'libx264', 'preset': 'test', 'encode_seconds': 5.0, 'duration': 10.0,
+                         'input_size': 1000, 'output_size': 250}, True)
+    assert REGISTRY.get_sample_value("video_ffmpeg_speed_factor_count", labels) == count + 1
+    assert REGISTRY.get_sample_value("video_ffmpeg_speed_factor_bucket", {**labels, 'le': '2.0'}) >= 1
+    assert REGISTRY.get_sample_value("video_output_size_ratio_bucket", {**labels, 'le': '0.3'}) >= 1
+
+
+def test_folder_size(tmp_path):
+    output = tmp_path / "output"
+    (output / "sub").mkdir(parents=True)
+    (output / "a.mp4").write_bytes(b"x" * 10)
+    (output / "sub" / "b.mp4").write_bytes(b"x" * 5)
+    assert metrics.folder_size(str(output)) == 15
+
+
+def test_queued_gauge_reads_the_job_store(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    for name in ("a", "b", "c"):
+        store.create(f"{name}.mp4", f"uploads/{name}.mp4", f"output/{name}.mp4", job_id=name)
+    store.claim("w", 60, 3)
+    (tmp_path / "output").mkdir()
+    (tmp_path / "output" / "a.mp4").write_bytes(b"x" * 10)
+    collector = SharedStateCollector(str(tmp_path / "output"), lambda: store.count_by_status(QUEUED))
+    values = {family.name: family.samples[0].value for family in collector.collect()}
+    assert values == {'video_queued_jobs': 2, 'video_output_disk_bytes': 10}
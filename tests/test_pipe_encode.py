@@ -0,0 +1,51 @@
+import struct
+
+import pytest
+
+from src.pipe_encode import build_stream_command, sniff_streamability
+
+
+def box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+FTYP = box(b"ftyp", b"isom\x00\x00\x02\x00")
+
+
+@pytest.mark.parametrize("head, expected", [
+    (FTYP + box(b"moov", b"x" * 16), True),  # faststart
+    (FTYP + box(b"free") + box(b"moof"), True),  # fragmented
+    (FTYP + box(b"mdat", b"x" * 16), False),  # moov at the end
+    (FTYP + struct.pack(">I4s", 0, b"mdat"), False),
+    (FTYP + box(b"abcd"), False),
+    (b"\x1aE\xdf\xa3\x9f\x42\x86\x81", True),  # Matroska
+    (b"\x47" * 188, True),  # MPEG-TS
+])
+def test_sniff_streamability(head, expected):
+    assert sniff_streamability(head) is expected
+
+
+@pytest.mark.parametrize("head", [
+    b"",
+    FTYP[:6],
+    FTYP,  # The next box decides
+    FTYP + struct.pack(">I4s", 1, b"free"),  # 64-bit size not read yet
+])
+def test_sniff_streamability_needs_more_bytes(head):
+    assert sniff_streamability(head) is None
+
+
+def test_64_bit_box_sizes_are_skipped():
+    free = struct.pack(">I4sQ", 1, b"free", 24) + b"x" * 8
+    assert sniff_streamability(FTYP + free + box(b"moov")) is True
+
+
+def test_stream_command_writes_fragments_to_stdout():
+    settings = {'codec': 'libx264', 'preset': 'fast', 'extra_params': ['-crf', '28', '-movflags', '+faststart']}
+    command = build_stream_command("ffmpeg", settings, threads=2)
+    assert command[command.index("-i") - 2:command.index("-i") + 2] == ["-threads", "2", "-i", "pipe:0"]
+    assert "+faststart" not in command
+    assert command[command.index("-movflags") + 1] == "frag_keyframe+empty_moov+default_base_moof"
+    assert command[-3:] == ["-f", "mp4", "pipe:1"]
+    # The caller's settings are left as they were
+    assert settings['extra_params'] == ['-crf', '28', '-movflags', '+faststart']
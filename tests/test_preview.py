@@ -0,0 +1,54 @@
+import os
+
+import pytest
+
+from src.config import PREVIEW_FOLDER_PREFIX
+from src.preview import (
+    build_preview_command, parse_thumbnail_times, preview_dir, sprite_layout, write_thumbnail_vtt
+)
+
+
+@pytest.mark.parametrize("duration, expected", [
+    (45, (10, 5, 1)),  # A thumbnail every 10s
+    (95, (10, 10, 1)),
+    (250, (10, 10, 3)),
+    (3000, (30.0, 10, 10)),  # Spaced out to fit 100 thumbnails
+    (None, (10, 10, 10)),
+])
+def test_sprite_layout(duration, expected):
+    assert sprite_layout(duration, interval=10, max_thumbs=100, columns=10) == expected
+
+
+def test_preview_dir():
+    assert preview_dir("output", "abc") == os.path.join("output", f"{PREVIEW_FOLDER_PREFIX}abc")
+
+
+def test_preview_command_caps_decoder_threads_on_both_inputs():
+    media = {'duration': 120.0, 'video': {'width': 1920, 'height': 1080}}
+    command, layout = build_preview_command("in.mp4", "out", "ffmpeg", media=media, threads=1)
+    inputs = [i for i, arg in enumerate(command) if arg == "-i"]
+    assert [command[i - 2:i] for i in inputs] == [["-threads", "1"], ["-threads", "1"]]
+    assert (layout['width'], layout['height'], layout['columns'], layout['rows']) == (160, 90, 10, 2)
+
+
+def test_parse_thumbnail_times(tmp_path):
+    path = tmp_path / "thumbs.txt"
+    path.write_text("frame:0    pts:0       pts_time:0\nlavfi.thumbnail=1\n"
+                    "frame:1    pts:120120  pts_time:10.01\nlavfi.thumbnail=1\npts_time:N/A\n")
+    assert parse_thumbnail_times(str(path)) == [0.0, 10.01]
+    assert parse_thumbnail_times(str(tmp_path / "missing.txt")) == []
+
+
+def test_thumbnail_vtt_points_at_the_sprite_tiles(tmp_path):
+    layout = {'interval': 10, 'columns': 2, 'rows': 2, 'width': 160, 'height': 90}
+    path = str(tmp_path / "thumbnails.vtt")
+    # More frames than the sprite has tiles: the extra ones are not in the image
+    assert write_thumbnail_vtt(path, [0.0, 10.0, 20.0, 3600.0, 3700.0], layout, duration=3605.5) == 4
+    with open(path) as f:
+        assert f.read().split("\n") == [
+            "WEBVTT", "",
+            "00:00:00.000 --> 00:00:10.000", "sprite.jpg#xywh=0,0,160,90", "",
+            "00:00:10.000 --> 00:00:20.000", "sprite.jpg#xywh=160,0,160,90", "",
+            "00:00:20.000 --> 01:00:00.000", "sprite.jpg#xywh=0,90,160,90", "",
+            "01:00:00.000 --> 01:00:10.000", "sprite.jpg#xywh=160,90,160,90", "",
+        ]
@@ -0,0 +1,113 @@
+import json
+import os
+import stat
+
+import pytest
+
+from src.config import AUDIO_BITRATE
+from src.probe import ENCODER_CODECS, parse_bitrate, plan_compression, probe_media
+
+MAX_WIDTH = 1920
+MAX_BITRATE = 2_000_000
+
+
+def media(video=None, audio=None, bit_rate=None):
+    """A probe_media result with H.264 1080p video and AAC stereo audio, overridden by the arguments"""
+    result = {
+        'duration': 60.0,
+        'bit_rate': bit_rate,
+        'video': {'codec': 'h264', 'width': 1920, 'height': 1080, 'pix_fmt': 'yuv420p', 'bit_rate': 1_500_000},
+        'audio': {'codec': 'aac', 'bit_rate': AUDIO_BITRATE, 'channels': 2},
+    }
+    result['video'].update(video or {})
+    result['audio'].update(audio or {})
+    return result
+
+
+def test_remux_when_both_streams_meet_the_target():
+    assert plan_compression(media(), MAX_WIDTH, MAX_BITRATE) == 'remux'
+
+
+def test_remux_without_audio():
+    probed = media()
+    probed['audio'] = None
+    assert plan_compression(probed, MAX_WIDTH, MAX_BITRATE) == 'remux'
+
+
+@pytest.mark.parametrize("audio", [
+    {'codec': 'mp3'},
+    {'channels': 6},
+    {'bit_rate': 320_000},
+    {'bit_rate': None},
+])
+def test_audio_only_when_only_the_audio_misses(audio):
+    assert plan_compression(media(audio=audio), MAX_WIDTH, MAX_BITRATE) == 'audio_only'
+
+
+@pytest.mark.parametrize("video", [
+    {'codec': 'hevc'},
+    {'pix_fmt': 'yuv420p10le'},
+    {'width': 3840},
+    {'width': None},
+    {'bit_rate': 8_000_000},
+])
+def test_encode_when_the_video_misses(video):
+    assert plan_compression(media(video=video), MAX_WIDTH, MAX_BITRATE) == 'encode'
+
+
+def test_video_bitrate_falls_back_to_the_container():
+    assert plan_compression(media(video={'bit_rate': None}, bit_rate=1_800_000), MAX_WIDTH, MAX_BITRATE) == 'remux'
+    assert plan_compression(media(video={'bit_rate': None}, bit_rate=9_000_000), MAX_WIDTH, MAX_BITRATE) == 'encode'
+    assert plan_compression(media(video={'bit_rate': None}), MAX_WIDTH, MAX_BITRATE) == 'encode'
+
+
+def test_encode_when_not_probed_or_no_target():
+    assert plan_compression(None, MAX_WIDTH, MAX_BITRATE) == 'encode'
+    assert plan_compression({**media(), 'video': None}, MAX_WIDTH, MAX_BITRATE) == 'encode'
+    assert plan_compression(media(), MAX_WIDTH, None) == 'encode'
+
+
+
+def test_remux_only_into_the_profiles_codec():
+    hevc = media(video={'codec': 'hevc'})
+    assert plan_compression(hevc, MAX_WIDTH, MAX_BITRATE, codec=ENCODER_CODECS['libx265']) == 'remux'
+    assert plan_compression(hevc, MAX_WIDTH, MAX_BITRATE, codec=ENCODER_CODECS['libx264']) == 'encode'
+    # An encoder of unknown output codec always encodes
+    assert plan_compression(media(), MAX_WIDTH, MAX_BITRATE, codec=ENCODER_CODECS.get('libvpx-vp9')) == 'encode'
+
+
+@pytest.mark.parametrize("value, expected", [("1000k", 1_000_000), ("2M", 2_000_000), ("1.5m", 1_500_000), (96000, 96000)])
+def test_parse_bitrate(value, expected):
+    assert parse_bitrate(value) == expected
+
+
+def fake_ffprobe(path, output):
+    with open(path, "w") as f:
+        f.write(f"#!/bin/sh\ncat <<'EOF'\n{output}\nEOF\n")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+
+
+def test_probe_media(tmp_path):
+    ffprobe = str(tmp_path / "ffprobe")
+    fake_ffprobe(ffprobe, json.dumps({
+        'format': {'duration': '12.5', 'size': '1000', 'bit_rate': 'N/A', 'format_name': 'mov,mp4,m4a'},
+        'streams': [
+            {'codec_type': 'video', 'codec_name': 'mjpeg', 'disposition': {'attached_pic': 1}},
+            {'codec_type': 'video', 'codec_name': 'h264', 'width': 1280, 'height': 720, 'pix_fmt': 'yuv420p',
+             'bit_rate': '900000', 'avg_frame_rate': '30000/1001'},
+            {'codec_type': 'audio', 'codec_name': 'aac', 'bit_rate': '128000', 'channels': 2, 'sample_rate': '48000'},
+        ],
+    }))
+    probed = probe_media(ffprobe, "in.mp4")
+    assert (probed['duration'], probed['size'], probed['bit_rate']) == (12.5, 1000, None)
+    # Cover art is not the video stream
+    assert probed['video']['codec'] == 'h264'
+    assert probed['video']['fps'] == pytest.approx(29.97, abs=0.01)
+    assert probed['audio'] == {'codec': 'aac', 'bit_rate': 128000, 'channels': 2, 'sample_rate': 48000}
+
+
+def test_probe_media_failure_is_none(tmp_path):
+    ffprobe = str(tmp_path / "ffprobe")
+    fake_ffprobe(ffprobe, "not json")
+    assert probe_media(ffprobe, "in.mp4") is None
+    assert probe_media(str(tmp_path / "missing"), "in.mp4") is None
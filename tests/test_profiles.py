@@ -0,0 +1,57 @@
+import pytest
+
+from src import profiles
+from src.profiles import ProfileStats, available_profiles, resolve_profile
+
+
+@pytest.fixture
+def encoders(monkeypatch):
+    """The encoders the fake FFmpeg build has"""
+    names = {"libx264", "aac"}
+    monkeypatch.setattr(profiles, "get_capabilities", lambda ffmpeg_path: {'encoders': names})
+    return names
+
+
+def test_profiles_need_their_encoder(encoders):
+    assert set(available_profiles("ffmpeg")) == {"fast", "balanced", "archive"}
+    encoders.add("libx265")
+    assert "hevc" in available_profiles("ffmpeg")
+
+
+def test_resolve_profile(encoders):
+    assert resolve_profile("ffmpeg", "fast") == "fast"
+    assert resolve_profile("ffmpeg") == profiles.DEFAULT_PROFILE
+    with pytest.raises(ValueError, match="Unknown profile"):
+        resolve_profile("ffmpeg", "ultra")
+    with pytest.raises(ValueError, match="libsvtav1"):
+        resolve_profile("ffmpeg", "av1")
+
+
+def report(profile, encode_seconds=10.0, duration=20.0, input_size=1000, output_size=250, **kwargs):
+    return {'profile': profile, 'path': 'encode', 'encode_seconds': encode_seconds, 'duration': duration,
+            'input_size': input_size, 'output_size': output_size, **kwargs}
+
+
+def test_stats_count_real_encodes_only(tmp_path):
+    stats = ProfileStats(str(tmp_path / "profile_stats.db"))
+    stats.record(report("fast"), True)
+    stats.record(report("fast", encode_seconds=30.0, duration=20.0, input_size=3000, output_size=750), True)
+    stats.record(report("fast"), False)
+    stats.record(report("fast", path='remux'), True)
+    stats.record(report("fast", cache='hit'), True)
+    stats.record(report(None), True)
+    fast = ProfileStats(str(tmp_path / "profile_stats.db")).summary()["fast"]
+    assert (fast['encodes'], fast['failures']) == (2, 1)
+    assert (fast['speed'], fast['size_ratio'], fast['mean_encode_seconds']) == (1.0, 0.25, 20.0)
+
+
+def test_recent_rates_keep_the_last_window(tmp_path):
+    stats = ProfileStats(str(tmp_path / "profile_stats.db"), window=2)
+    stats.record(report("fast", encode_seconds=100.0), True)
+    stats.record(report("fast", encode_seconds=10.0, duration=0), True)
+    stats.record(report("fast", encode_seconds=20.0, duration=40.0), True)
+    rates = stats.recent_rates()["fast"]
+    assert rates['samples'] == 2
+    assert rates['seconds_per_byte'] == 30.0 / 2000
+    # Samples without a duration count for the per-byte rate only
+    assert rates['speed'] == 2.0
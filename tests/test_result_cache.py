@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+from src.result_cache import ResultCache, cache_key, hash_file
+from src.video_processor import partial_output_path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "cache"), max_bytes=1024 * 1024, ttl_seconds=3600)
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_hit_and_miss(cache, tmp_path):
+    output = str(tmp_path / "out.mp4")
+    write(output, b"encoded")
+    cache.store("key", output, encode_seconds=2.5)
+    served = str(tmp_path / "served.mp4")
+    assert cache.lookup("key", served)
+    assert read(served) == b"encoded"
+    assert not cache.lookup("other", served)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_later_output_under_the_same_name_leaves_the_cache_alone(cache, tmp_path):
+    output = str(tmp_path / "compressed_video.mp4")
+    write(output, b"first upload")
+    cache.store("first", output, encode_seconds=1)
+    # A hit is hard-linked to the output, which a second upload of the same name then replaces
+    assert cache.lookup("first", output)
+    partial = partial_output_path(output)
+    write(partial, b"second upload")
+    os.replace(partial, output)
+    again = str(tmp_path / "again.mp4")
+    assert cache.lookup("first", again)
+    assert read(again) == b"first upload"
+
+
+def test_missing_cache_file_is_a_miss(cache, tmp_path):
+    output = str(tmp_path / "out.mp4")
+    write(output, b"encoded")
+    cache.store("key", output, encode_seconds=1)
+    os.remove(cache._path("key"))
+    assert not cache.lookup("key", str(tmp_path / "served.mp4"))
+    assert cache.stats()['entries'] == 0
+
+
+def test_cache_key_depends_on_content_and_arguments(tmp_path):
+    path = str(tmp_path / "in.mp4")
+    write(path, b"video")
+    content = hash_file(path)
+    assert cache_key(content, ["-crf", "28"]) == cache_key(content, ["-crf", "28"])
+    assert cache_key(content, ["-crf", "28"]) != cache_key(content, ["-crf", "30"])
+    assert cache_key(content, ["-crf", "28"]) != cache_key(hash_file(__file__), ["-crf", "28"])
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=25, ttl_seconds=3600)
+    output = str(tmp_path / "out.mp4")
+    for key in ("a", "b"):
+        write(output, b"x" * 10)
+        cache.store(key, output, encode_seconds=1)
+    assert cache.lookup("a", str(tmp_path / "served.mp4"))  # b is now the least recently used
+    write(output, b"x" * 10)
+    cache.store("c", output, encode_seconds=1)
+    assert cache.stats()['evictions'] == 1
+    assert not cache.lookup("b", str(tmp_path / "served.mp4"))
+    assert cache.lookup("a", str(tmp_path / "served.mp4"))
+
+
+def test_expired_entries_are_misses(tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1024, ttl_seconds=-1)
+    output = str(tmp_path / "out.mp4")
+    write(output, b"encoded")
+    cache.store("key", output, encode_seconds=1)
+    assert not cache.lookup("key", str(tmp_path / "served.mp4"))
@@ -0,0 +1,170 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from src import scheduler as scheduler_module
+from src.scheduler import EncodeScheduler, current_scheduler, plan_concurrency, plan_web_workers
+
+GiB = 1024 ** 3
+
+
+@pytest.fixture
+def scheduler():
+    created = []
+
+    def make(slots, threads_per_job=2):
+        created.append(EncodeScheduler(slots, threads_per_job))
+        return created[-1]
+    yield make
+    for s in created:
+        s.shutdown()
+
+
+def blocker(scheduler, owner="blocker"):
+    """Occupy one slot until the returned event is set"""
+    started, release = threading.Event(), threading.Event()
+
+    def run(threads):
+        started.set()
+        release.wait(5)
+    future = scheduler.submit(owner, run)
+    assert started.wait(5)
+    return release, future
+
+
+def test_owners_take_turns(scheduler):
+    s = scheduler(1)
+    release, _ = blocker(s)
+    order = []
+    futures = [s.submit(owner, lambda name, threads: order.append(name), name)
+               for owner, name in [("batch", "a1"), ("batch", "a2"), ("batch", "a3"), ("single", "b1")]]
+    assert s.queued == 4
+    release.set()
+    for future in futures:
+        future.result(5)
+    # The single upload runs after one job of the batch, not after all three
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_jobs_get_the_thread_budget_and_their_scheduler(scheduler):
+    s = scheduler(1, threads_per_job=3)
+    assert s.submit("a", lambda threads: (threads, current_scheduler())).result(5) == (3, s)
+    assert current_scheduler() is None
+
+
+def test_exceptions_reach_the_future(scheduler):
+    s = scheduler(1)
+
+    def fail(threads):
+        raise RuntimeError("boom")
+    with pytest.raises(RuntimeError):
+        s.submit("a", fail).result(5)
+    assert s.submit("a", lambda threads: "still running").result(5) == "still running"
+
+
+def test_reserve_borrows_only_idle_slots(scheduler):
+    s = scheduler(3)
+    release, running = blocker(s)
+    assert s.reserve(5) == 2
+    assert s.active == 3
+    assert s.reserve(1) == 0
+    s.release(2)
+    assert s.active == 1
+    release.set()
+    running.result(5)
+
+
+def test_reserve_leaves_slots_to_queued_jobs(scheduler):
+    s = scheduler(2)
+    release_a, a = blocker(s, "a")
+    release_b, b = blocker(s, "b")
+    queued = s.submit("c", lambda threads: "c")
+    release_a.set()
+    a.result(5)
+    assert queued.result(5) == "c"
+    assert s.reserve(2) == 1
+    s.release(1)
+    release_b.set()
+    b.result(5)
+
+
+def test_queued_job_waits_for_borrowed_slots(scheduler):
+    s = scheduler(2)
+    release, running = blocker(s)
+    assert s.reserve(1) == 1
+    waiting = s.submit("b", lambda threads: "b")
+    with pytest.raises(TimeoutError):
+        waiting.result(0.2)
+    s.release(1)
+    assert waiting.result(5) == "b"
+    release.set()
+    running.result(5)
+
+
+def test_reserve_leaves_slots_to_the_backlog(scheduler):
+    s = scheduler(3)
+    s.backlog = lambda: 1
+    assert s.reserve(3) == 2
+    s.release(2)
+
+
+def test_failing_backlog_lends_nothing(scheduler):
+    s = scheduler(2)
+
+    def backlog():
+        raise RuntimeError("database is locked")
+    s.backlog = backlog
+    assert s.reserve(1) == 0
+    assert s.active == 0
+
+
+def test_load_callback_sees_active_and_queued(scheduler):
+    s = scheduler(1)
+    loads = []
+    s.on_load = lambda active, queued: loads.append((active, queued))
+    release, running = blocker(s)
+    s.submit("b", lambda threads: None)
+    assert loads[-1] == (1, 1)
+    release.set()
+    running.result(5)
+
+
+@pytest.mark.parametrize("cpus, memory, threads, slots, expected", [
+    (8, None, 0, 0, (4, 2)),
+    (1, None, 0, 0, (1, 1)),
+    (8, 2 * GiB, 0, 0, (2, 2)),  # Memory-bound: 1GiB per encode
+    (8, None, 4, 3, (3, 4)),  # Explicit values win
+])
+def test_plan_concurrency(cpus, memory, threads, slots, expected):
+    assert plan_concurrency(cpus, memory, GiB, threads, slots) == expected
+
+
+@pytest.mark.parametrize("cpus, processes, expected", [
+    (8, 2, (2, 2)),  # Split over the container's processes
+    (8, 16, (1, 2)),  # Every process gets a slot
+])
+def test_plan_concurrency_splits_the_slots_over_processes(cpus, processes, expected):
+    assert plan_concurrency(cpus, None, GiB, processes=processes) == expected
+
+
+@pytest.mark.parametrize("requested, cpus, memory, expected", [
+    (0, 4, None, 2),  # One per CPU, capped at the container's slots (2 threads each)
+    (8, 8, None, 4),
+    (2, 8, None, 2),
+    (0, 8, 2 * GiB, 2),
+    (0, 1, None, 1),
+])
+def test_plan_web_workers_never_exceeds_the_slots(monkeypatch, requested, cpus, memory, expected):
+    monkeypatch.setattr(scheduler_module, "detect_cpu_limit", lambda: cpus)
+    monkeypatch.setattr(scheduler_module, "detect_memory_limit", lambda: memory)
+    assert plan_web_workers(requested, GiB) == expected
+
+
+def test_reserved_threads_come_out_of_the_cpu_quota(monkeypatch):
+    # 8 CPUs less one preview thread per process, in two-thread slots
+    assert plan_concurrency(8, None, GiB, reserved_threads=1) == (3, 2)
+    assert plan_concurrency(8, None, GiB, processes=2, reserved_threads=1) == (1, 2)
+    monkeypatch.setattr(scheduler_module, "detect_cpu_limit", lambda: 8)
+    monkeypatch.setattr(scheduler_module, "detect_memory_limit", lambda: None)
+    assert plan_web_workers(0, GiB, reserved_threads=1) == 2
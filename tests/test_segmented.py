@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+import pytest
+
+from src import segmented
+from src.segmented import write_concat_list
+from src.scheduler import EncodeScheduler
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """Stand in for FFmpeg: split into segments, write every output and record who encoded what"""
+    calls = {'segments': [], 'concat': None, 'active': 0, 'peak': 0}
+    lock = threading.Lock()
+
+    def split(ffmpeg_path, input_path, segment_dir, segment_seconds):
+        return [os.path.join(segment_dir, f"source_{i:05d}.mkv") for i in range(6)]
+
+    def run_ffmpeg(command, duration=None, on_progress=None, usage=None):
+        output = command[-1]
+        if os.path.basename(output).startswith("encoded_"):
+            with lock:
+                calls['active'] += 1
+                calls['peak'] = max(calls['peak'], calls['active'])
+            time.sleep(0.05)
+            with lock:
+                calls['active'] -= 1
+                calls['segments'].append(output)
+        if "concat" in command:
+            with open(command[command.index("concat") + 4]) as f:
+                calls['concat'] = f.read().splitlines()
+        with open(output, "wb") as f:
+            f.write(b"out")
+        return ""
+    monkeypatch.setattr(segmented, "split_at_keyframes", split)
+    monkeypatch.setattr(segmented, "run_ffmpeg", run_ffmpeg)
+    return calls
+
+
+def encode_on(scheduler, tmp_path, workers):
+    """Run compress_segmented as a scheduler job, on the caller's own slot"""
+    return scheduler.submit("a", lambda threads: segmented.compress_segmented(
+        "in.mp4", str(tmp_path / "out.mp4"), "ffmpeg", ["-c:v", "libx264"], [], False,
+        workers=workers, threads=threads, scratch_dir=str(tmp_path), scheduler=scheduler
+    )).result(10)
+
+
+def test_segments_borrow_idle_slots(fake_ffmpeg, tmp_path):
+    s = EncodeScheduler(3, 2)
+    try:
+        encode_on(s, tmp_path, workers=3)
+        assert fake_ffmpeg['peak'] == 3
+        assert len(fake_ffmpeg['segments']) == 6
+        # Joined in segment order, whichever worker encoded them
+        assert [line.rsplit("_", 1)[1] for line in fake_ffmpeg['concat']] == [f"{i:05d}.mp4'" for i in range(6)]
+        assert s.active == 0
+    finally:
+        s.shutdown()
+
+
+def test_segments_leave_slots_to_the_backlog(fake_ffmpeg, tmp_path):
+    s = EncodeScheduler(3, 2)
+    s.backlog = lambda: 2
+    try:
+        encode_on(s, tmp_path, workers=3)
+        assert fake_ffmpeg['peak'] == 1
+        assert len(fake_ffmpeg['segments']) == 6
+    finally:
+        s.shutdown()
+
+
+def test_concat_list_entries_are_absolute(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("scratch")
+    list_path = os.path.join("scratch", "list.txt")
+    write_concat_list(list_path, [os.path.join("scratch", "seg_000.mp4"), os.path.join("scratch", "it's.mp4")])
+    with open(list_path) as f:
+        lines = f.read().splitlines()
+    assert lines == [
+        f"file '{tmp_path}/scratch/seg_000.mp4'",
+        f"file '{tmp_path}/scratch/it'\\''s.mp4'",
+    ]
@@ -0,0 +1,76 @@
+import os
+import time
+
+import pytest
+
+from src.delivery import ActiveReaders, RetentionStore
+from src.storage import DiskJanitor, InsufficientSpace, entry_size
+
+HOUR = 3600
+
+
+@pytest.fixture
+def folders(tmp_path):
+    paths = {name: tmp_path / name for name in ("uploads", "output", "scratch")}
+    (paths["uploads"] / "resumable").mkdir(parents=True)
+    paths["output"].mkdir()
+    paths["scratch"].mkdir()
+    return paths
+
+
+def janitor(tmp_path, folders, quota=0, active_paths=None):
+    db_path = str(tmp_path / "data" / "downloads.db")
+    retention = RetentionStore(db_path, max_downloads=0, ttl_seconds=24 * HOUR, readers=ActiveReaders(db_path))
+    return DiskJanitor(
+        retention, str(folders["uploads"]), str(folders["output"]), str(folders["uploads"] / "resumable"),
+        str(folders["scratch"]), quota, upload_ttl=6 * HOUR, scratch_ttl=HOUR, min_age=60,
+        active_paths=active_paths, folder_prefix="ladder_"
+    )
+
+
+def write(path, size, age=0):
+    path.write_bytes(b"x" * size)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return path
+
+
+def test_hard_links_are_counted_once(tmp_path):
+    os.link(write(tmp_path / "a.mp4", 100), tmp_path / "b.mp4")
+    seen = set()
+    assert entry_size(str(tmp_path / "a.mp4"), seen) == 100
+    assert entry_size(str(tmp_path / "b.mp4"), seen) == 0
+    assert entry_size(str(tmp_path)) == 100
+
+
+def test_sweep_removes_stale_uploads_and_scratch(tmp_path, folders):
+    write(folders["uploads"] / "old.mp4", 10, age=7 * HOUR)
+    write(folders["uploads"] / "queued.mp4", 10, age=7 * HOUR)
+    write(folders["uploads"] / "new.mp4", 10)
+    write(folders["uploads"] / "resumable" / "abc.part", 10, age=7 * HOUR)
+    write(folders["uploads"] / "resumable" / "abc.json", 10, age=7 * HOUR)
+    write(folders["scratch"] / "segments_x", 10, age=2 * HOUR)
+    in_use = {str(folders["uploads"] / "queued.mp4")}
+    removed = janitor(tmp_path, folders, active_paths=lambda: in_use).sweep()
+    assert (removed['uploads'], removed['scratch']) == (2, 1)
+    assert sorted(os.listdir(folders["uploads"])) == ["new.mp4", "queued.mp4", "resumable"]
+    assert os.listdir(folders["uploads"] / "resumable") == []
+
+
+def test_quota_evicts_least_recently_used_outputs(tmp_path, folders):
+    for i in range(3):
+        write(folders["output"] / f"o{i}.mp4", 100, age=HOUR - i)
+    write(folders["output"] / "fresh.mp4", 100)  # Younger than min_age
+    j = janitor(tmp_path, folders, quota=250)
+    j.retention.record_download(str(folders["output"] / "o0.mp4"))
+    assert j.sweep()['evicted'] == 2
+    assert sorted(os.listdir(folders["output"])) == ["fresh.mp4", "o0.mp4"]
+
+
+def test_make_room_refuses_what_the_quota_cannot_take(tmp_path, folders):
+    write(folders["output"] / "o0.mp4", 100, age=HOUR)
+    j = janitor(tmp_path, folders, quota=150)
+    j.make_room(100, min_free=0)  # Fits once o0.mp4 is evicted
+    assert os.listdir(folders["output"]) == []
+    with pytest.raises(InsufficientSpace):
+        j.make_room(200, min_free=0)
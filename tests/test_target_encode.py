@@ -0,0 +1,67 @@
+import pytest
+
+from src.config import AUDIO_BITRATE, TARGET_MIN_VIDEO_BITRATE, TARGET_MUX_OVERHEAD
+from src.target_encode import PassLogStore, _pass_progress, rate_control_args, video_bitrate_for_target
+
+
+def test_target_size_leaves_room_for_audio_and_the_container():
+    size = 10 * 1000 * 1000
+    expected = int(size * 8 * (1 - TARGET_MUX_OVERHEAD) / 60 - AUDIO_BITRATE)
+    assert video_bitrate_for_target(60, target_size=size) == expected
+    assert video_bitrate_for_target(60, target_size=size, has_audio=False) == expected + AUDIO_BITRATE
+
+
+def test_target_bitrate_includes_the_audio():
+    assert video_bitrate_for_target(60, target_bitrate=2_000_000) == 2_000_000 - AUDIO_BITRATE
+
+
+@pytest.mark.parametrize("duration, target", [
+    (None, {'target_bitrate': 2_000_000}),
+    (600, {'target_size': 100_000}),
+    (60, {'target_bitrate': AUDIO_BITRATE + TARGET_MIN_VIDEO_BITRATE - 1}),
+])
+def test_unreachable_targets_are_refused(duration, target):
+    with pytest.raises(ValueError):
+        video_bitrate_for_target(duration, **target)
+
+
+def test_rate_control_replaces_crf_with_a_bitrate():
+    settings = {'codec': 'libx264', 'extra_params': ['-crf', '28', '-pix_fmt', 'yuv420p', '-maxrate', '5M']}
+    assert rate_control_args(settings, 1_000_000) == [
+        '-b:v', '1000000', '-maxrate', '1500000', '-bufsize', '2000000', '-pix_fmt', 'yuv420p'
+    ]
+
+
+def test_rate_control_uses_nvenc_multipass():
+    settings = {'codec': 'h264_nvenc', 'extra_params': ['-rc', 'constqp', '-cq', '30']}
+    assert rate_control_args(settings, 1_000_000)[:4] == ['-rc', 'vbr', '-multipass', 'fullres']
+    assert '-cq' not in rate_control_args(settings, 1_000_000)
+
+
+def test_passlogs_are_keyed_by_content_and_analysis_settings(tmp_path):
+    store = PassLogStore(str(tmp_path), ttl_seconds=3600)
+    prefix = store.prefix("content", ["-c:v", "libx264"])
+    assert prefix == store.prefix("content", ["-c:v", "libx264"])
+    assert prefix != store.prefix("other", ["-c:v", "libx264"])
+    assert prefix != store.prefix("content", ["-c:v", "libx264", "-vf", "scale=640:-2"])
+    assert not store.is_complete(prefix)
+    for suffix in ("-0.log", "-0.log.mbtree"):
+        with open(prefix + suffix, "w") as f:
+            f.write("stats")
+    assert store.is_complete(prefix)
+
+
+def test_each_pass_reports_half_of_the_job():
+    published = []
+    first, second = _pass_progress(published.append, first=True), _pass_progress(published.append, first=False)
+    first({'percent': 50.0, 'state': 'encoding'})
+    first({'percent': 100.0, 'state': 'finished'})
+    second({'percent': 50.0, 'state': 'encoding'})
+    second({'percent': 100.0, 'state': 'finished'})
+    assert published == [
+        {'percent': 25.0, 'state': 'encoding'},
+        {'percent': 50.0, 'state': 'encoding'},
+        {'percent': 75.0, 'state': 'encoding'},
+        {'percent': 100.0, 'state': 'finished'},
+    ]
+    assert _pass_progress(None, first=True) is None
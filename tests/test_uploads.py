@@ -0,0 +1,127 @@
+import asyncio
+import os
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from src.uploads import save_upload_stream, UploadTooLarge, MaxBodySizeMiddleware, ResumableUploads, BodyReader
+
+
+class FakeUpload:
+    """The read() side of an UploadFile over bytes"""
+
+    def __init__(self, data, filename="video.mp4"):
+        self.filename = filename
+        self._data = data
+
+    async def read(self, size):
+        chunk, self._data = self._data[:size], self._data[size:]
+        return chunk
+
+
+async def chunks(*parts, disconnect=False):
+    for part in parts:
+        yield part
+    if disconnect:
+        raise ClientDisconnect()
+
+
+def test_save_upload_stream(tmp_path):
+    path = str(tmp_path / "upload.mp4")
+    data = os.urandom(300_000)
+    assert asyncio.run(save_upload_stream(FakeUpload(data), path, len(data))) == len(data)
+    with open(path, "rb") as f:
+        assert f.read() == data
+
+
+def test_save_upload_stream_removes_oversize_uploads(tmp_path):
+    path = str(tmp_path / "upload.mp4")
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(save_upload_stream(FakeUpload(b"x" * 2_000_000), path, 1_000_000))
+    assert not os.path.exists(path)
+
+
+def test_body_reader_replays_the_sniffed_head():
+    reader = BodyReader("video.mp4", b"head", chunks(b"-body", b"-tail"))
+
+    async def read_all():
+        parts = []
+        while True:
+            part = await reader.read(3)
+            if not part:
+                return b"".join(parts)
+            parts.append(part)
+    assert asyncio.run(read_all()) == b"head-body-tail"
+
+
+def test_resumable_upload_continues_at_the_offset(tmp_path):
+    uploads = ResumableUploads(str(tmp_path / "resumable"), max_size=100)
+    upload_id = uploads.create("video.mp4", 10)
+    assert uploads.get(upload_id)['offset'] == 0
+
+    # The connection drops after the first chunk: what arrived is kept
+    assert asyncio.run(uploads.append(upload_id, 0, chunks(b"01234", disconnect=True))) == 5
+    with pytest.raises(ValueError):
+        asyncio.run(uploads.append(upload_id, 0, chunks(b"01234")))
+    assert asyncio.run(uploads.append(upload_id, 5, chunks(b"567", b"89"))) == 10
+    meta = uploads.get(upload_id)
+    assert (meta['offset'], meta['complete'], meta['filename']) == (10, True, "video.mp4")
+
+    destination = str(tmp_path / "video.mp4")
+    uploads.finish(upload_id, destination)
+    with open(destination, "rb") as f:
+        assert f.read() == b"0123456789"
+    assert uploads.get(upload_id) is None
+
+
+def test_resumable_upload_limits(tmp_path):
+    uploads = ResumableUploads(str(tmp_path / "resumable"), max_size=100)
+    with pytest.raises(UploadTooLarge):
+        uploads.create("video.mp4", 101)
+    upload_id = uploads.create("video.mp4", 4)
+    with pytest.raises(UploadTooLarge):
+        asyncio.run(uploads.append(upload_id, 0, chunks(b"12345")))
+    with pytest.raises(KeyError):
+        asyncio.run(uploads.append("0" * 32, 0, chunks(b"1")))
+    assert uploads.get("../etc") is None
+    uploads.discard(upload_id)
+    assert os.listdir(tmp_path / "resumable") == []
+
+
+def body_app(**kwargs):
+    async def upload(request):
+        return JSONResponse({"received": len(await request.body())})
+    app = Starlette(routes=[Route("/upload/", upload, methods=["POST"]), Route("/other", upload, methods=["POST"])])
+    return MaxBodySizeMiddleware(app, limits={"/upload/": 1000}, **kwargs)
+
+
+def test_max_body_size_checks_content_length_before_reading():
+    client = TestClient(body_app())
+    assert client.post("/upload/", content=b"x" * 1001).status_code == 413
+    assert client.post("/upload/", content=b"x" * 1000).json() == {"received": 1000}
+    assert client.post("/other", content=b"x" * 5000).json() == {"received": 5000}
+
+
+def test_max_body_size_cuts_off_chunked_bodies():
+    client = TestClient(body_app())
+
+    def body():
+        for _ in range(5):
+            yield b"x" * 300
+    assert client.post("/upload/", content=body()).status_code == 413
+
+
+def test_max_body_size_reports_the_time_to_receive_each_body():
+    timings = []
+    client = TestClient(body_app(on_body=timings.append))
+
+    def body():
+        for _ in range(3):
+            yield b"x" * 300
+    assert client.post("/upload/", content=body()).json() == {"received": 900}
+    assert client.post("/upload/", content=b"x" * 5000).status_code == 413
+    assert len(timings) == 1 and timings[0] >= 0
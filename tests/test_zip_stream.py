@@ -0,0 +1,39 @@
+import asyncio
+import io
+import zipfile
+
+from src import zip_stream
+from src.zip_stream import stream_zip
+
+
+async def entries(*items):
+    for item in items:
+        yield item
+
+
+def collect(stream):
+    async def run():
+        return [chunk async for chunk in stream]
+    return asyncio.run(run())
+
+
+def test_archive_holds_files_and_generated_entries(tmp_path):
+    video = tmp_path / "a.mp4"
+    video.write_bytes(b"v" * 5000)
+    chunks = collect(stream_zip(entries(("videos/a.mp4", str(video)), ("FAILED.txt", b"b.mp4\n"))))
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert archive.namelist() == ["videos/a.mp4", "FAILED.txt"]
+        assert archive.getinfo("videos/a.mp4").compress_type == zipfile.ZIP_STORED
+        assert archive.read("videos/a.mp4") == b"v" * 5000
+        assert archive.read("FAILED.txt") == b"b.mp4\n"
+        assert archive.testzip() is None
+
+
+def test_files_are_streamed_a_chunk_at_a_time(tmp_path, monkeypatch):
+    monkeypatch.setattr(zip_stream, "ZIP_CHUNK_SIZE", 1000)
+    video = tmp_path / "a.mp4"
+    video.write_bytes(b"v" * 10_000)
+    chunks = collect(stream_zip(entries(("a.mp4", str(video)))))
+    # Nothing is held back until the end: no chunk is much larger than ZIP_CHUNK_SIZE
+    assert max(len(chunk) for chunk in chunks) < 1100
+    assert len(chunks) >= 10